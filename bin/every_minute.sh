@@ -2,5 +2,6 @@
 
 source /home/pinax/virtualenvs/code.pinaxproject.com/bin/activate
 cd /home/pinax/webapps/code.pinaxproject.com/cpc_project
+./manage.py emit_task_notices >> /home/pinax/webapps/code.pinaxproject.com/logs/cron_task_notices.log 2>&1
 ./manage.py emit_notices >> /home/pinax/webapps/code.pinaxproject.com/logs/cron_notices.log 2>&1
 ./manage.py send_mail >> /home/pinax/webapps/code.pinaxproject.com/logs/cron_mail.log 2>&1
\ No newline at end of file
@@ -1,8 +1,9 @@
-from django.contrib.auth.models import User
-
-from notification import models as notification
+from django.db import transaction
 
 from tasks import signals
+from tasks.bulk import insert_rows
+
+from signals.models import NotificationJob
 
 
 def signal(signals, sender=None):
@@ -17,76 +18,48 @@ def signal(signals, sender=None):
     return _wrapped
 
 
-def task_notify_list(kwargs):
-    if kwargs["group"]:
-        users = kwargs["group"].member_queryset()
-    else:
-        users = User.objects.all()
-    return users.exclude(id__exact=kwargs["user"].id)
-
-
 @signal([signals.task_created])
 def task_created(sender, **kwargs):
-    # @@@ temporarily turned off
-    return
-    notification.send(task_notify_list(dict(kwargs, user=kwargs["user"])), "tasks_new", {
-        "creator": kwargs["user"],
-        "task": kwargs["task"],
-        "group": kwargs["group"]
-    })
+    NotificationJob.objects.enqueue("tasks_new", kwargs["task"], kwargs["user"], kwargs["group"])
+
+
+@signal([signals.tasks_created])
+def tasks_created(sender, **kwargs):
+    jobs = []
+    for task in kwargs["tasks"]:
+        job = NotificationJob(label="tasks_new", task=task, actor=kwargs["user"], extra="{}")
+        if kwargs["group"] is not None:
+            job.group = kwargs["group"]
+        jobs.append(job)
+    with transaction.commit_on_success():
+        insert_rows(NotificationJob, jobs)
 
 
 @signal([signals.task_nudged])
 def task_nudged(sender, **kwargs):
-    # @@@ temporarily turned off
-    return
-    notification.send([kwargs["task"].assignee], "tasks_nudge", {
-        "nudger": kwargs["nudger"],
-        "task": kwargs["task"],
-        "count": kwargs["count"],
-    })
+    if kwargs["task"].assignee_id is None:
+        return
+    NotificationJob.objects.enqueue("tasks_nudge", kwargs["task"], kwargs["nudger"],
+        count = kwargs["count"],
+    )
 
 @signal([signals.task_status_changed])
 def task_status_changed(sender, **kwargs):
-    # @@@ temporarily turned off
-    return
-    notification.send(task_notify_list(kwargs), "tasks_status", {
-        "user": kwargs["user"],
-        "task": kwargs["task"],
-        "group": kwargs["group"]
-    })
+    NotificationJob.objects.enqueue("tasks_status", kwargs["task"], kwargs["user"], kwargs["group"])
 
 
 @signal([signals.task_changed])
 def task_changed(sender, **kwargs):
-    # @@@ temporarily turned off
-    return
-    notification.send(task_notify_list(kwargs), "tasks_change", {
-        "user": kwargs["user"],
-        "task": kwargs["task"],
-        "group": kwargs["group"],
-        "new_state": kwargs["task"].get_state_display()
-    })
+    NotificationJob.objects.enqueue("tasks_change", kwargs["task"], kwargs["user"], kwargs["group"],
+        new_state = unicode(kwargs["task"].get_state_display()),
+    )
 
 
 @signal([signals.task_assignment_changed])
 def task_assignment_changed(sender, **kwargs):
-    # @@@ temporarily turned off
-    return
-    notification.send(task_notify_list(kwargs), "tasks_assignment", {
-        "user": kwargs["user"],
-        "task": kwargs["task"],
-        "assignee": kwargs["task"].assignee,
-        "group": kwargs["group"],
-    })
+    NotificationJob.objects.enqueue("tasks_assignment", kwargs["task"], kwargs["user"], kwargs["group"])
 
 
 @signal([signals.task_tags_changed])
 def task_tags_changed(sender, **kwargs):
-    # @@@ temporarily turned off
-    return
-    notification.send(task_notify_list(kwargs), "tasks_tags", {
-        "user": kwargs["user"],
-        "task": kwargs["task"],
-        "group": kwargs["group"],
-    })
+    NotificationJob.objects.enqueue("tasks_tags", kwargs["task"], kwargs["user"], kwargs["group"])
@@ -0,0 +1,37 @@
+import sys
+import traceback
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from signals.models import NotificationJob, send_notices
+
+
+
+class Command(BaseCommand):
+    help = "Sends the notices of the queued task events to their recipients"
+    
+    option_list = BaseCommand.option_list + (
+        make_option("--limit",
+            type = "int",
+            dest = "limit",
+            default = 0,
+            help = "Stop once this many events were sent (all of them by default)"
+        ),
+    )
+    
+    def handle(self, *args, **options):
+        jobs, sent = 0, 0
+        while not options["limit"] or jobs < options["limit"]:
+            claimed = NotificationJob.objects.claim()
+            if not claimed:
+                break
+            try:
+                sent += send_notices(claimed)
+            except Exception:
+                # left claimed, they are retried once the claim times out
+                print >> sys.stderr, "[NotificationJob] failed to send %s" % ", ".join(unicode(job) for job in claimed)
+                traceback.print_exc()
+            jobs += len(claimed)
+        print "[NotificationJob] %s event(s) sent as %s notice(s)" % (jobs, sent)
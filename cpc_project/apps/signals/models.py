@@ -1 +1,331 @@
-import signals.handlers
\ No newline at end of file
+"""
+Notices of task events are sent outside the request: the signal handlers
+only record a NotificationJob (the event, the task and the user behind it)
+and the emit_task_notices command, run from cron, fans the jobs out to their
+recipients by chunks of TASKS_NOTIFICATION_CHUNK_SIZE users. The notice
+settings of a chunk are read with a query, its notices are rendered as
+notification.send_now renders them, then written with a single insert and
+their emails handed to the mail backend (which may queue them) at once.
+
+Events are held for TASKS_NOTIFICATION_DIGEST_WINDOW seconds and the events
+of a task within that window are sent together: a user notified of several
+of them gets a single notice, of the type of the first one, listing them all.
+"""
+import json
+import operator
+
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.urlresolvers import reverse
+from django.db import models, transaction
+from django.template import Context
+from django.template.loader import render_to_string
+from django.utils.translation import activate, get_language, ugettext
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.contenttypes import generic
+from django.contrib.sites.models import Site
+
+from notification import models as notification
+from notification.models import Notice, NoticeSetting, NoticeType, NOTICE_MEDIA, NOTICE_MEDIA_DEFAULTS
+
+from tasks.bulk import insert_rows
+from tasks.models import Task
+
+
+TASKS_NOTIFICATION_CHUNK_SIZE = getattr(settings, "TASKS_NOTIFICATION_CHUNK_SIZE", 500)
+# jobs claimed by a worker longer ago than this are taken over by the next one
+TASKS_NOTIFICATION_CLAIM_TIMEOUT = getattr(settings, "TASKS_NOTIFICATION_CLAIM_TIMEOUT", 60 * 10)
+# events of a task this close to the first one are merged, 0 sends each alone
+TASKS_NOTIFICATION_DIGEST_WINDOW = getattr(settings, "TASKS_NOTIFICATION_DIGEST_WINDOW", 60 * 5)
+
+# the medium notification sends emails for
+EMAIL_MEDIUM = "1"
+# the formats of a notice, as notification.send_now renders them
+NOTICE_FORMATS = ("short.txt", "full.txt", "notice.html", "full.html")
+
+
+def notice_media(notice_type, user_ids):
+    """
+    Returns the ids of the users among ``user_ids`` who receive notices of
+    ``notice_type`` by each medium, with a single query. Users without a
+    setting for a medium get its default, as notification does.
+    """
+    # media are stored by their ids as strings
+    wanted = dict(
+        (str(medium), set(user_ids) if NOTICE_MEDIA_DEFAULTS[medium] <= notice_type.default else set())
+        for medium, name in NOTICE_MEDIA
+    )
+    for user_id, medium, send in NoticeSetting.objects.filter(
+            notice_type=notice_type, user__in=user_ids).values_list("user", "medium", "send"):
+        if medium not in wanted:
+            continue
+        if send:
+            wanted[medium].add(user_id)
+        else:
+            wanted[medium].discard(user_id)
+    return wanted
+
+
+def notice_wanted(notice_type, user_ids):
+    """
+    Returns the ids of the users among ``user_ids`` who receive notices of
+    ``notice_type`` by any medium, with a single query.
+    """
+    return set().union(*notice_media(notice_type, user_ids).values())
+
+
+def notice_languages(user_ids):
+    """
+    Returns the languages of the users among ``user_ids`` found in the store
+    named by NOTIFICATION_LANGUAGE_MODULE, with a single query, by user id.
+    """
+    store = getattr(settings, "NOTIFICATION_LANGUAGE_MODULE", False)
+    if not store:
+        return {}
+    model = models.get_model(*store.split("."))
+    if model is None:
+        return {}
+    return dict(model._default_manager.filter(user__in=user_ids).values_list("user", "language"))
+
+
+def render_notices(users, notice_type, extra_context, emailed=(), languages=None):
+    """
+    Returns the unsaved Notices of ``users`` and the EmailMessages of the
+    active ones with an address whose ids are in ``emailed``, rendered in
+    the language of each user as notification.send_now renders them.
+    """
+    current_site = Site.objects.get_current()
+    notices_url = u"%s://%s%s" % (
+        getattr(settings, "DEFAULT_HTTP_PROTOCOL", "http"),
+        unicode(current_site),
+        reverse("notification_notices"),
+    )
+    current_language = get_language()
+    languages = languages or {}
+    notices, messages = [], []
+    try:
+        for user in users:
+            activate(languages.get(user.pk, current_language))
+            context = Context({
+                "recipient": user,
+                "sender": None,
+                "notice": ugettext(notice_type.display),
+                "notices_url": notices_url,
+                "current_site": current_site,
+            })
+            context.update(extra_context)
+            formatted = notification.get_formatted_messages(NOTICE_FORMATS, notice_type.label, context)
+            notices.append(Notice(
+                recipient = user,
+                message = formatted["notice.html"],
+                notice_type = notice_type,
+                on_site = True,
+            ))
+            if user.pk in emailed and user.email and user.is_active:
+                subject = "".join(render_to_string("notification/email_subject.txt", {
+                    "message": formatted["short.txt"],
+                }, context).splitlines())
+                body = render_to_string("notification/email_body.txt", {
+                    "message": formatted["full.txt"],
+                }, context)
+                messages.append(EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [user.email]))
+    finally:
+        activate(current_language)
+    return notices, messages
+
+
+class NotificationJobManager(models.Manager):
+    
+    def enqueue(self, label, task, actor, group=None, **extra):
+        """
+        Records a task event to notify, ``extra`` being the values of the
+        notice context depending on when the event happened.
+        """
+        job = self.model(label=label, task=task, actor=actor, extra=json.dumps(extra))
+        if group is not None:
+            job.group = group
+        job.save()
+        return job
+    
+    def claim(self, window=TASKS_NOTIFICATION_DIGEST_WINDOW):
+        """
+        Returns the next events to send, claimed for this worker: the oldest
+        event at least ``window`` seconds old and the events of its task in
+        the ``window`` seconds following it, oldest first. Returns an empty
+        list when no event is due.
+        """
+        now = datetime.now()
+        stale = now - timedelta(seconds=TASKS_NOTIFICATION_CLAIM_TIMEOUT)
+        claimable = self.filter(models.Q(claimed=None) | models.Q(claimed__lt=stale))
+        due = now - timedelta(seconds=window)
+        for job in claimable.filter(created__lte=due).order_by("pk")[:10]:
+            # another worker may have claimed it since it was looked up
+            if not self.filter(pk=job.pk, claimed=job.claimed).update(claimed=now):
+                continue
+            claimable.filter(
+                task = job.task_id,
+                created__lte = job.created + timedelta(seconds=window),
+            ).update(claimed=now)
+            return list(self.filter(task=job.task_id, claimed=now).order_by("created", "pk"))
+        return []
+
+
+class NotificationJob(models.Model):
+    """
+    A task event whose notices are yet to be sent.
+    """
+    
+    label = models.CharField(max_length=40)
+    task = models.ForeignKey(Task)
+    actor = models.ForeignKey(User)
+    
+    # the group of the task, whose members are notified rather than everyone
+    content_type = models.ForeignKey(ContentType, null=True)
+    object_id = models.PositiveIntegerField(null=True)
+    group = generic.GenericForeignKey("content_type", "object_id")
+    
+    # JSON of the context values captured when the event happened
+    extra = models.TextField(blank=True)
+    
+    created = models.DateTimeField(default=datetime.now)
+    claimed = models.DateTimeField(null=True)
+    # the users up to this id were sent the notice, so a job resumes after
+    # a failure without notifying anyone twice
+    last_recipient = models.PositiveIntegerField(default=0)
+    
+    objects = NotificationJobManager()
+    
+    def __unicode__(self):
+        return u"%s for task %s" % (self.label, self.task_id)
+    
+    def recipients(self):
+        if self.label == "tasks_nudge":
+            return User.objects.filter(pk=self.task.assignee_id)
+        if self.object_id is not None:
+            users = self.group.member_queryset()
+        else:
+            users = User.objects.all()
+        return users.exclude(id__exact=self.actor_id)
+    
+    def context(self):
+        context = {"task": self.task, "group": self.object_id is not None and self.group or None}
+        if self.label == "tasks_new":
+            context["creator"] = self.actor
+        elif self.label == "tasks_nudge":
+            context["nudger"] = self.actor
+        else:
+            context["user"] = self.actor
+        if self.label == "tasks_assignment":
+            context["assignee"] = self.task.assignee
+        context.update(json.loads(self.extra or "{}"))
+        return context
+    
+    def audience(self):
+        # jobs notifying the same users share this
+        if self.label == "tasks_nudge":
+            return ("assignee", self.task.assignee_id)
+        return ("group", self.content_type_id, self.object_id, self.actor_id)
+
+
+def digest_context(jobs, contexts):
+    """
+    The context of the notice of ``jobs``, events of the same task: their
+    contexts merged, the latest values winning, with the context of each of
+    them listed as ``events`` when there are several.
+    """
+    context = {}
+    for job in jobs:
+        context.update(contexts[job.pk])
+    if len(jobs) > 1:
+        context["events"] = [dict(contexts[job.pk], label=job.label) for job in jobs]
+    return context
+
+
+def send_notices(jobs, chunk_size=TASKS_NOTIFICATION_CHUNK_SIZE):
+    """
+    Sends the notices of ``jobs``, events of the same task as claimed
+    together, by chunks of recipients, then deletes the jobs. Returns the
+    number of notices sent.
+    
+    The notices of a chunk are written with its progress in one transaction,
+    after its emails were handed to the mail backend over a single
+    connection.
+    """
+    notice_types = dict(
+        (notice_type.label, notice_type)
+        for notice_type in NoticeType.objects.filter(label__in=set(job.label for job in jobs))
+    )
+    contexts = dict((job.pk, job.context()) for job in jobs)
+    audiences = {}
+    for job in jobs:
+        if job.audience() not in audiences:
+            audiences[job.audience()] = job.recipients()
+    if len(audiences) == 1:
+        recipients = audiences.values()[0]
+    else:
+        recipients = User.objects.filter(reduce(operator.or_, [
+            models.Q(pk__in=users.values("pk")) for users in audiences.values()
+        ]))
+    recipients = recipients.order_by("pk")
+    
+    pks = [job.pk for job in jobs]
+    last_recipient = min(job.last_recipient for job in jobs)
+    sent = 0
+    while True:
+        chunk = list(recipients.filter(pk__gt=last_recipient)[:chunk_size].iterator())
+        if not chunk:
+            break
+        ids = [user.pk for user in chunk]
+        if len(audiences) == 1:
+            members = dict((key, set(ids)) for key in audiences)
+        else:
+            members = dict(
+                (key, set(users.filter(pk__in=ids).values_list("pk", flat=True)))
+                for key, users in audiences.items()
+            )
+        media = dict(
+            (label, notice_media(notice_type, ids))
+            for label, notice_type in notice_types.items()
+        )
+        wanted = dict((label, set().union(*media[label].values())) for label in media)
+        
+        # users notified of the same events get the same notice
+        notices = {}
+        for user in chunk:
+            events = tuple(
+                job for job in jobs
+                if user.pk in members[job.audience()] and user.pk in wanted.get(job.label, ())
+            )
+            if events:
+                notices.setdefault(events, []).append(user)
+        languages = notice_languages(ids)
+        rows, messages = [], []
+        for events, users in notices.items():
+            label = events[0].label
+            chunk_rows, chunk_messages = render_notices(users, notice_types[label],
+                digest_context(events, contexts), media[label].get(EMAIL_MEDIUM, ()), languages
+            )
+            rows.extend(chunk_rows)
+            messages.extend(chunk_messages)
+        
+        last_recipient = chunk[-1].pk
+        with transaction.commit_on_success():
+            insert_rows(Notice, rows)
+            if messages:
+                get_connection().send_messages(messages)
+            NotificationJob.objects.filter(pk__in=pks).update(
+                last_recipient = last_recipient,
+                claimed = datetime.now(),
+            )
+        sent += len(rows)
+        if len(chunk) < chunk_size:
+            break
+    NotificationJob.objects.filter(pk__in=pks).delete()
+    return sent
+
+
+import signals.handlers
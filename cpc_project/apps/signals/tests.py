@@ -0,0 +1,250 @@
+from datetime import datetime, timedelta
+
+from django.core import mail
+from django.db import connection
+from django.test import TestCase
+
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+
+from notification.models import Notice, NoticeSetting, NoticeType, NOTICE_MEDIA
+
+from tasks import signals
+from tasks.models import Task
+
+from signals import models
+from signals.models import NotificationJob, digest_context, notice_wanted, send_notices
+
+
+class TestNoticeWanted(TestCase):
+    
+    def setUp(self):
+        self.users = [User.objects.create_user("user%s" % i, "user%s@example.com" % i, "test") for i in range(3)]
+        self.ids = [user.pk for user in self.users]
+        self.on = NoticeType.objects.create(label="test_on", display="On", description="on", default=2)
+        self.off = NoticeType.objects.create(label="test_off", display="Off", description="off", default=0)
+    
+    def tearDown(self):
+        pass
+    
+    def setting(self, user, notice_type, send):
+        for medium, name in NOTICE_MEDIA:
+            NoticeSetting.objects.create(user=user, notice_type=notice_type, medium=str(medium), send=send)
+    
+    def test_defaults(self):
+        self.assertEquals(notice_wanted(self.on, self.ids), set(self.ids))
+        self.assertEquals(notice_wanted(self.off, self.ids), set())
+    
+    def test_settings(self):
+        self.setting(self.users[0], self.on, False)
+        self.setting(self.users[1], self.off, True)
+        self.assertEquals(notice_wanted(self.on, self.ids), set(self.ids[1:]))
+        self.assertEquals(notice_wanted(self.off, self.ids), set([self.ids[1]]))
+    
+    def test_single_query(self):
+        self.assertNumQueries(1, notice_wanted, self.on, self.ids)
+
+
+class TestClaim(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user("actor", "actor@example.com", "test")
+        self.task = Task.objects.create(summary="claimed", creator=self.user)
+        self.other_task = Task.objects.create(summary="other", creator=self.user)
+    
+    def tearDown(self):
+        pass
+    
+    def enqueue(self, label, task, minutes_ago):
+        job = NotificationJob.objects.enqueue(label, task, self.user)
+        NotificationJob.objects.filter(pk=job.pk).update(
+            created = datetime.now() - timedelta(minutes=minutes_ago),
+        )
+        return job
+    
+    def test_nothing_due(self):
+        self.enqueue("tasks_change", self.task, 0)
+        self.assertEquals(NotificationJob.objects.claim(window=60), [])
+    
+    def test_claim_window(self):
+        first = self.enqueue("tasks_change", self.task, 10)
+        second = self.enqueue("tasks_assignment", self.task, 9)
+        # too late to be merged with the first one
+        late = self.enqueue("tasks_tags", self.task, 5)
+        other = self.enqueue("tasks_change", self.other_task, 10)
+        
+        claimed = NotificationJob.objects.claim(window=120)
+        self.assertEquals([job.pk for job in claimed], [first.pk, second.pk])
+        
+        # claimed jobs are left to their worker
+        self.assertEquals([job.pk for job in NotificationJob.objects.claim(window=120)], [late.pk])
+        self.assertEquals([job.pk for job in NotificationJob.objects.claim(window=120)], [other.pk])
+        self.assertEquals(NotificationJob.objects.claim(window=120), [])
+    
+    def test_stale_claim_taken_over(self):
+        job = self.enqueue("tasks_change", self.task, 30)
+        NotificationJob.objects.filter(pk=job.pk).update(claimed=datetime.now() - timedelta(days=1))
+        self.assertEquals([j.pk for j in NotificationJob.objects.claim(window=60)], [job.pk])
+    
+    def test_claimed_concurrently(self):
+        first = self.enqueue("tasks_change", self.task, 10)
+        other = self.enqueue("tasks_change", self.other_task, 10)
+        
+        manager = NotificationJob.objects
+        def filter(*args, **kwargs):
+            if kwargs.get("pk") == first.pk and "claimed" in kwargs:
+                # another worker claims it between the lookup and the update
+                NotificationJob._default_manager.get_query_set().filter(pk=first.pk).update(claimed=datetime.now())
+            return manager.get_query_set().filter(*args, **kwargs)
+        manager.filter = filter
+        try:
+            claimed = NotificationJob.objects.claim(window=60)
+        finally:
+            del manager.filter
+        self.assertEquals([job.pk for job in claimed], [other.pk])
+
+
+class TestSendNotices(TestCase):
+    
+    def setUp(self):
+        self.users = [User.objects.create_user("user%s" % i, "user%s@example.com" % i, "test") for i in range(6)]
+        self.actor = self.users[0]
+        self.task = Task.objects.create(summary="sent", creator=self.actor)
+    
+    def tearDown(self):
+        pass
+    
+    def recipients(self):
+        return sorted(to for message in mail.outbox for to in message.to)
+    
+    def test_send(self):
+        job = NotificationJob.objects.enqueue("tasks_change", self.task, self.actor, new_state="resolved")
+        self.assertEquals(send_notices([job], chunk_size=2), 5)
+        self.assertEquals(self.recipients(), [user.email for user in self.users[1:]])
+        self.assertEquals(
+            sorted(Notice.objects.values_list("recipient", flat=True)),
+            [user.pk for user in self.users[1:]],
+        )
+        self.assertEquals(NotificationJob.objects.count(), 0)
+    
+    def test_not_emailed(self):
+        NoticeSetting.objects.create(user=self.users[1], notice_type=NoticeType.objects.get(label="tasks_change"),
+            medium="1", send=False)
+        self.users[2].email = ""
+        self.users[2].save()
+        job = NotificationJob.objects.enqueue("tasks_change", self.task, self.actor, new_state="resolved")
+        self.assertEquals(send_notices([job], chunk_size=2), 4)
+        self.assertEquals(self.recipients(), [user.email for user in self.users[3:]])
+    
+    def test_queries_per_chunk(self):
+        job = NotificationJob.objects.enqueue("tasks_change", self.task, self.actor, new_state="resolved")
+        job.task, job.actor = self.task, self.actor
+        # the site is cached once looked up
+        Site.objects.get_current()
+        # the notices are inserted with one statement where the database
+        # returns the ids of the rows, one per notice otherwise
+        inserts = connection.features.can_return_id_from_insert and 1 or 5
+        # besides, the notice types, the chunk, its settings, the progress,
+        # the look up of the next chunk and the deletion of the job
+        self.assertNumQueries(7 + inserts, send_notices, [job], 5)
+    
+    def test_resume(self):
+        job = NotificationJob.objects.enqueue("tasks_change", self.task, self.actor, new_state="resolved")
+        # the users up to the third were sent the notice before a failure
+        NotificationJob.objects.filter(pk=job.pk).update(last_recipient=self.users[2].pk)
+        job = NotificationJob.objects.get(pk=job.pk)
+        self.assertEquals(send_notices([job], chunk_size=2), 3)
+        self.assertEquals(self.recipients(), [user.email for user in self.users[3:]])
+    
+    def test_progress_recorded(self):
+        job = NotificationJob.objects.enqueue("tasks_change", self.task, self.actor, new_state="resolved")
+        get_connection = models.get_connection
+        sent = []
+        def failing_get_connection():
+            if sent:
+                raise IOError("mail server down")
+            sent.append(True)
+            return get_connection()
+        models.get_connection = failing_get_connection
+        try:
+            self.assertRaises(IOError, send_notices, [job], 2)
+        finally:
+            models.get_connection = get_connection
+        self.assertEquals(NotificationJob.objects.get(pk=job.pk).last_recipient, self.users[2].pk)
+        self.assertEquals(self.recipients(), [user.email for user in self.users[1:3]])
+
+
+class TestDigest(TestCase):
+    
+    def setUp(self):
+        self.users = [User.objects.create_user("user%s" % i, "user%s@example.com" % i, "test") for i in range(4)]
+        self.actor = self.users[0]
+        self.task = Task.objects.create(summary="digested", creator=self.actor, assignee=self.users[2])
+    
+    def tearDown(self):
+        pass
+    
+    def claim(self):
+        NotificationJob.objects.update(created=datetime.now() - timedelta(minutes=10))
+        return NotificationJob.objects.claim(window=60)
+    
+    def messages(self):
+        return dict((message.to[0], message) for message in mail.outbox)
+    
+    def test_digest_context(self):
+        first = NotificationJob.objects.enqueue("tasks_change", self.task, self.actor, new_state="open")
+        second = NotificationJob.objects.enqueue("tasks_change", self.task, self.users[1], new_state="resolved")
+        contexts = dict((job.pk, job.context()) for job in [first, second])
+        
+        self.assertEquals(digest_context([first], contexts), contexts[first.pk])
+        context = digest_context([first, second], contexts)
+        self.assertEquals(context["new_state"], "resolved")
+        self.assertEquals([event["user"] for event in context["events"]], [self.actor, self.users[1]])
+        self.assertEquals([event["label"] for event in context["events"]], ["tasks_change", "tasks_change"])
+    
+    def test_events_merged(self):
+        NotificationJob.objects.enqueue("tasks_change", self.task, self.actor, new_state="resolved")
+        NotificationJob.objects.enqueue("tasks_assignment", self.task, self.actor)
+        jobs = self.claim()
+        self.assertEquals(len(jobs), 2)
+        
+        self.assertEquals(send_notices(jobs), 3)
+        messages = self.messages()
+        self.assertEquals(sorted(messages.keys()), [user.email for user in self.users[1:]])
+        for message in messages.values():
+            self.assertTrue("2 changes" in message.subject)
+            self.assertTrue("changed its state to resolved" in message.body)
+            self.assertTrue("assigned it to user2" in message.body)
+    
+    def test_audiences(self):
+        NotificationJob.objects.enqueue("tasks_change", self.task, self.actor, new_state="resolved")
+        NotificationJob.objects.enqueue("tasks_nudge", self.task, self.users[1], count=1)
+        jobs = self.claim()
+        
+        # the assignee is told of both, the others of the change alone
+        self.assertEquals(send_notices(jobs), 3)
+        messages = self.messages()
+        self.assertTrue("nudged you about it" in messages[self.users[2].email].body)
+        self.assertTrue("changed its state to resolved" in messages[self.users[2].email].body)
+        for user in [self.users[1], self.users[3]]:
+            self.assertTrue("nudged" not in messages[user.email].body)
+            self.assertTrue("changed the state of task" in messages[user.email].body)
+
+
+class TestHandlers(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user("actor", "actor@example.com", "test")
+    
+    def tearDown(self):
+        pass
+    
+    def test_tasks_created(self):
+        tasks = [Task.objects.create(summary="bulk %s" % i, creator=self.user) for i in range(3)]
+        signals.tasks_created.send(sender=Task, user=self.user, tasks=tasks, group=None)
+        jobs = NotificationJob.objects.order_by("pk")
+        self.assertEquals([job.task_id for job in jobs], [task.pk for task in tasks])
+        self.assertEquals(set(job.label for job in jobs), set(["tasks_new"]))
+        self.assertEquals(set(job.actor_id for job in jobs), set([self.user.pk]))
+        self.assertEquals(set(job.object_id for job in jobs), set([None]))
+        self.assertEquals(jobs[0].context()["creator"], self.user)
@@ -0,0 +1,192 @@
+"""
+Creation of tasks in batches, for importers.
+
+A batch is validated as a whole before anything is written, then its tasks,
+their tags and their first history revisions are inserted with a statement
+per table and per chunk of rows in a single transaction, where the database
+can tell the ids of the rows it inserted (PostgreSQL). Other databases get
+the rows inserted one at a time, still in that one transaction.
+"""
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
+from taggit.models import Tag, TaggedItem
+from taggit.utils import parse_tags
+
+from tasks import signals, tagindex
+from tasks.models import Task, TaskCount, TaskHistory, workflow
+
+
+
+TASKS_BULK_INSERT_CHUNK_SIZE = getattr(settings, "TASKS_BULK_INSERT_CHUNK_SIZE", 500)
+
+# the fields of a task a batch item can set, besides assignee and tags
+BULK_FIELDS = ["summary", "detail", "markup", "status"]
+
+
+def insert_rows(model, objects, chunk_size=TASKS_BULK_INSERT_CHUNK_SIZE):
+    """
+    Inserts ``objects``, unsaved instances of ``model``, and sets their
+    primary keys. Field values are prepared as save() does (auto_now dates
+    are set) but no signal is sent.
+    """
+    fields = [f for f in model._meta.local_fields if not isinstance(f, models.AutoField)]
+    if not connection.features.can_return_id_from_insert:
+        for obj in objects:
+            obj.pk = model._base_manager._insert([
+                (f, f.get_db_prep_save(f.pre_save(obj, True), connection=connection)) for f in fields
+            ], return_id=True, using=connection.alias)
+        return objects
+    
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for start in range(0, len(objects), chunk_size):
+        chunk = objects[start:start + chunk_size]
+        params = []
+        for obj in chunk:
+            params.extend([f.get_db_prep_save(f.pre_save(obj, True), connection=connection) for f in fields])
+        row = "(%s)" % ", ".join(["%s"] * len(fields))
+        cursor.execute("INSERT INTO %s (%s) VALUES %s RETURNING %s" % (
+            qn(model._meta.db_table),
+            ", ".join([qn(f.column) for f in fields]),
+            ", ".join([row] * len(chunk)),
+            qn(model._meta.pk.column),
+        ), params)
+        for obj, (pk,) in zip(chunk, cursor.fetchall()):
+            obj.pk = pk
+    return objects
+
+
+def new_tags(names):
+    """
+    Returns unsaved Tags named ``names`` with the slugs Tag.save would have
+    found free for them, looked up with a query, and one more per slug
+    already taken.
+    """
+    tags = [Tag(name=name) for name in names]
+    for tag in tags:
+        tag.slug = tag.slugify(tag.name)
+    taken = set(Tag.objects.filter(slug__in=[tag.slug for tag in tags]).values_list("slug", flat=True))
+    for tag in tags:
+        if tag.slug in taken:
+            base = tag.slug
+            taken.update(Tag.objects.filter(slug__startswith=base + "_").values_list("slug", flat=True))
+            i = 1
+            while tag.slug in taken:
+                tag.slug = tag.slugify(tag.name, i)
+                i += 1
+        taken.add(tag.slug)
+    return tags
+
+
+def validate_tasks(items, user):
+    """
+    Validates a batch of tasks, dictionaries of task fields with the
+    assignee given by username and the tags as a string or a list.
+    
+    Returns a list of (task, tag names) pairs and a list of the errors of
+    each item, a dictionary of messages by field or None when it is valid.
+    Assignees are looked up with a single query.
+    """
+    usernames = set(
+        item["assignee"] for item in items
+        if isinstance(item, dict) and isinstance(item.get("assignee"), basestring)
+    )
+    users = dict((u.username, u) for u in User.objects.filter(username__in=usernames))
+    
+    tasks, errors = [], []
+    for item in items:
+        if not isinstance(item, dict):
+            tasks.append((None, []))
+            errors.append({"__all__": ["Expected an object."]})
+            continue
+        
+        item_errors = {}
+        task = Task(creator=user)
+        for field in BULK_FIELDS:
+            if field in item:
+                setattr(task, field, item[field])
+        
+        assignee = item.get("assignee")
+        if assignee:
+            if assignee in users:
+                task.assignee = users[assignee]
+            else:
+                item_errors["assignee"] = ["Unknown user '%s'." % assignee]
+        
+        tags = item.get("tags") or []
+        if isinstance(tags, basestring):
+            tags = parse_tags(tags)
+        elif isinstance(tags, list) and all(isinstance(tag, basestring) for tag in tags):
+            tags = sorted(set(tag.strip() for tag in tags if tag.strip()))
+        else:
+            tags = []
+            item_errors["tags"] = ["Expected a string or a list of strings."]
+        if [tag for tag in tags if len(tag) > Tag._meta.get_field("name").max_length]:
+            item_errors["tags"] = ["Tags are limited to %s characters." % Tag._meta.get_field("name").max_length]
+        
+        try:
+            task.full_clean(exclude=["creator", "assignee", "content_type", "object_id"])
+        except ValidationError, e:
+            item_errors.update(e.message_dict)
+        
+        tasks.append((task, tags))
+        errors.append(item_errors or None)
+    return tasks, errors
+
+
+def create_tasks(tasks, user, group=None):
+    """
+    Creates the (task, tag names) pairs returned by validate_tasks, with
+    their tags and first history revisions, in a single transaction, then
+    sends a single tasks_created signal for all of them.
+    """
+    now = datetime.now()
+    for task, tags in tasks:
+        task.creator = user
+        if group:
+            group.associate(task, commit=False)
+        if hasattr(workflow, "initial_state"):
+            task.state = workflow.initial_state(task, user)
+        task.created = task.modified = now
+        task.render_detail()
+    
+    with transaction.commit_on_success():
+        insert_rows(Task, [task for task, tags in tasks])
+        
+        names = set(name for task, tags in tasks for name in tags)
+        tag_objects = dict((tag.name, tag) for tag in Tag.objects.filter(name__in=names))
+        new_names = [name for name in names if name not in tag_objects]
+        tag_objects.update((tag.name, tag) for tag in insert_rows(Tag, new_tags(new_names)))
+        content_type = ContentType.objects.get_for_model(Task)
+        insert_rows(TaggedItem, [
+            TaggedItem(tag=tag_objects[name], content_type=content_type, object_id=task.pk)
+            for task, tags in tasks for name in tags
+        ])
+        
+        histories = []
+        for task, tags in tasks:
+            history = task.history_revision(None, 0, tags=[tag_objects[name] for name in tags])
+            history.modified = now
+            histories.append(history)
+        insert_rows(TaskHistory, histories)
+        
+        TaskCount.objects.tasks_created([
+            (task, [tag_objects[name].pk for name in tags]) for task, tags in tasks
+        ])
+    
+    if new_names:
+        tagindex.tags_changed()
+    signals.tasks_created.send(
+        sender = Task,
+        user = user,
+        tasks = [task for task, tags in tasks],
+        group = group,
+    )
+    return tasks
@@ -0,0 +1,117 @@
+"""
+Exports of the state transitions of a workflow module: CSV (one row per
+transition with the current state, the new state, the permission and the
+name of the transition), JSON and a Graphviz DOT graph of the states.
+
+The exports of a workflow are rendered once, by the first call to
+compile_exports for it, and shared by every later caller.
+"""
+import csv
+import json
+
+from cStringIO import StringIO
+
+from django.utils.encoding import force_unicode, smart_str
+from django.utils.hashcompat import md5_constructor
+
+
+
+def predicate_name(predicate):
+    # predicates combined with OR are named after their parts
+    return getattr(predicate, "__name__", None) or repr(predicate)
+
+
+def transition_rows(workflow):
+    """
+    Returns (current state, new state, permission, name) tuples for the
+    transitions of ``workflow``, states by their names.
+    """
+    states = dict(workflow.STATE_CHOICES)
+    return [
+        (states[str(current_state)], states[str(new_state)], predicate_name(predicate), name)
+        for current_state, new_state, predicate, name in workflow.STATE_TRANSITIONS
+    ]
+
+
+def render_csv(workflow):
+    out = StringIO()
+    writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\n")
+    for row in transition_rows(workflow):
+        writer.writerow([smart_str(value) for value in row])
+    return out.getvalue()
+
+
+def render_json(workflow):
+    return json.dumps({
+        "states": [
+            {"id": str(state), "name": force_unicode(name)}
+            for state, name in workflow.STATE_CHOICES
+        ],
+        "transitions": [
+            {
+                "from": str(current_state),
+                "to": str(new_state),
+                "permission": predicate_name(predicate),
+                "name": force_unicode(name),
+            }
+            for current_state, new_state, predicate, name in workflow.STATE_TRANSITIONS
+        ],
+    }, indent=2)
+
+
+def dot_string(value):
+    return '"%s"' % smart_str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render_dot(workflow):
+    lines = ["digraph workflow {"]
+    for state, name in workflow.STATE_CHOICES:
+        lines.append("    %s [label=%s];" % (dot_string(state), dot_string(name)))
+    for current_state, new_state, predicate, name in workflow.STATE_TRANSITIONS:
+        lines.append("    %s -> %s [label=%s];" % (
+            dot_string(current_state),
+            dot_string(new_state),
+            dot_string("%s (%s)" % (name, predicate_name(predicate))),
+        ))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+# format -> (renderer, mimetype)
+FORMATS = {
+    "csv": (render_csv, "text/csv"),
+    "json": (render_json, "application/json"),
+    "dot": (render_dot, "text/vnd.graphviz"),
+}
+
+
+def render(workflow, format="csv"):
+    return FORMATS[format][0](workflow)
+
+
+class Export(object):
+    """
+    A rendered export, ``etag`` is a digest of its content.
+    """
+    
+    def __init__(self, content, mimetype):
+        self.content = content
+        self.mimetype = mimetype
+        self.etag = md5_constructor(content).hexdigest()
+
+
+# compiled exports by workflow
+_compiled = {}
+
+
+def compile_exports(workflow):
+    """
+    Returns a dictionary of the Exports of ``workflow`` by format, rendered
+    on the first call for ``workflow``.
+    """
+    if workflow not in _compiled:
+        _compiled[workflow] = dict(
+            (format, Export(renderer(workflow), mimetype))
+            for format, (renderer, mimetype) in FORMATS.items()
+        )
+    return _compiled[workflow]
@@ -1,24 +1,73 @@
+"""
+Atom feeds of the task history: of all tasks, of the tasks assigned to a
+user and of the tasks with a tag, each of them in or out of a group.
+
+Feeds are served by task_feed which answers conditional requests from the
+newest revision a feed shows, looked up with a single aggregate query, and
+keeps the serialized feed in the cache set with TASKS_FEED_CACHE (an alias
+of CACHES or a backend URI) under a key made of that same revision, so a
+cached feed is used until the next history write.
+
+The entries themselves are rendered once per revision and shared by every
+feed showing it: serializing a feed looks up the ids of its revisions,
+renders the entries missing from the cache and concatenates them.
+"""
 import datetime
 
-from atomformat import Feed
+from cStringIO import StringIO
+
+from atomformat import AtomFeed, Feed, SimplerXMLGenerator
 
+from django.core.cache import get_cache
 from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.db.models import Count, Max
+from django.http import HttpResponse, Http404
 from django.template.defaultfilters import linebreaks, escape
+from django.utils.hashcompat import md5_constructor
+from django.views.decorators.http import condition
 
+from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 
-from tasks.models import TaskHistory
+from tasks.models import Task, TaskHistory
 
 
 ITEMS_PER_FEED = getattr(settings, "PINAX_ITEMS_PER_FEED", 20)
+TASKS_FEED_CACHE = getattr(settings, "TASKS_FEED_CACHE", "default")
+TASKS_FEED_CACHE_TIMEOUT = getattr(settings, "TASKS_FEED_CACHE_TIMEOUT", 60 * 60 * 24)
+
+cache = get_cache(TASKS_FEED_CACHE)
 
 
 class BaseTaskFeed(Feed):
     
+    def __init__(self, slug, feed_url, group=None):
+        super(BaseTaskFeed, self).__init__(slug, feed_url)
+        self.slug = slug
+        self.feed_url = feed_url
+        self.group = group
+        self.obj = None
+    
+    def get_object(self, bits):
+        # feeds taking a parameter look it up here
+        if bits:
+            raise LookupError("Feed takes no parameter")
+    
+    @property
+    def domain(self):
+        if not hasattr(self, "_domain"):
+            self._domain = Site.objects.get_current().domain
+        return self._domain
+    
+    def reverse(self, name, kwargs=None):
+        if self.group is None:
+            return reverse(name, kwargs=kwargs)
+        return self.group.content_bridge.reverse(name, self.group, kwargs=kwargs)
+    
     def item_id(self, item):
         return "http://%s%s" % (
-            Site.objects.get_current().domain,
+            self.domain,
             item.task.get_absolute_url(),
         )
     
@@ -47,33 +96,211 @@ class BaseTaskFeed(Feed):
         return [{"name" : item.owner.username}]
     
     def feed_id(self):
-        return "http://%s/tasks/feeds/all/" % Site.objects.get_current().domain
+        return "http://%s%s" % (self.domain, self.feed_url)
     
     def feed_title(self):
+        if self.group:
+            return "%s: Tasks Changes" % self.group.name
         return "Tasks Changes"
     
     def feed_updated(self):
-        qs = self.get_qs()
         # We return an arbitrary date if there are no results, because there
         # must be a feed_updated field as per the Atom specifications, however
         # there is no real data to go by, and an arbitrary date can be static.
-        if qs.count() == 0:
+        latest = self.latest()
+        if latest["modified"] is None:
             return datetime.datetime(year=2008, month=7, day=1)
-        return qs.latest("modified").modified
+        return latest["modified"]
     
     def feed_links(self):
         complete_url = "http://%s%s" % (
-            Site.objects.get_current().domain,
-            reverse("task_list"),
+            self.domain,
+            self.reverse("task_list"),
         )
         return ({"href": complete_url},)
     
     def items(self):
-        return self.get_qs()[:ITEMS_PER_FEED]
+        if not hasattr(self, "_items"):
+            self._items = TaskHistory.objects.resolve(
+                self.get_qs().select_related("owner", "task")[:ITEMS_PER_FEED]
+            )
+        return self._items
+    
+    def history(self):
+        if self.group:
+            return self.group.content_objects(TaskHistory)
+        return TaskHistory.objects.filter(object_id__isnull=True)
     
     def get_qs(self):
-        return TaskHistory.objects.filter(object_id__isnull=True).order_by("-modified")
+        return self.history().order_by("-modified")
+    
+    def latest(self):
+        """
+        The date of the newest revision, the highest id and the number of
+        revisions, together telling whether anything changed since a
+        feed was served.
+        """
+        if not hasattr(self, "_latest"):
+            self._latest = self.get_qs().order_by().aggregate(
+                modified = Max("modified"),
+                pk = Max("pk"),
+                count = Count("pk"),
+            )
+        return self._latest
+    
+    def etag(self):
+        latest = self.latest()
+        return md5_constructor(":".join([
+            self.slug,
+            self.feed_url,
+            latest["modified"] and latest["modified"].isoformat() or "",
+            str(latest["pk"]),
+            str(latest["count"]),
+        ])).hexdigest()
+    
+    def entry_key(self, pk, modified):
+        # entries only depend on the revision and where the tasks live
+        args = md5_constructor(":".join([modified.isoformat(), self.domain]))
+        return "tasks:feed-entry:%s:%s" % (pk, args.hexdigest())
+    
+    def render_entry(self, item):
+        entry = AtomFeed(atom_id=self.feed_id(), title=self.feed_title())
+        entry.add_item(
+            atom_id = self.item_id(item),
+            title = self.item_title(item),
+            updated = self.item_updated(item),
+            content = self.item_content(item),
+            published = self.item_published(item),
+            authors = self.item_authors(item),
+            links = self.item_links(item),
+        )
+        out = StringIO()
+        entry.write_items(SimplerXMLGenerator(out, "utf-8"))
+        return out.getvalue()
+    
+    def entries(self):
+        """
+        Returns the serialized entries of the feed, rendering and caching
+        the ones that were not yet. Revisions are only loaded for those.
+        """
+        revisions = list(self.get_qs().values_list("pk", "modified")[:ITEMS_PER_FEED])
+        pks = [pk for pk, modified in revisions]
+        keys = dict((pk, self.entry_key(pk, modified)) for pk, modified in revisions)
+        cached = cache.get_many(keys.values())
+        
+        missing = [pk for pk in pks if keys[pk] not in cached]
+        if missing:
+            items = TaskHistory.objects.filter(pk__in=missing).select_related("owner", "task")
+            rendered = dict(
+                (keys[item.pk], self.render_entry(item))
+                for item in TaskHistory.objects.resolve(items)
+            )
+            cache.set_many(rendered, TASKS_FEED_CACHE_TIMEOUT)
+            cached.update(rendered)
+        return [cached[keys[pk]] for pk in pks if keys[pk] in cached]
+    
+    def render(self):
+        """
+        Returns the serialized feed, from the cache when nothing changed
+        since it was last serialized.
+        """
+        key = "tasks:feed:%s" % self.etag()
+        content = cache.get(key)
+        if content is None:
+            feed = AtomFeed(
+                atom_id = self.feed_id(),
+                title = self.feed_title(),
+                updated = self.feed_updated(),
+                links = self.feed_links(),
+            )
+            out = StringIO()
+            feed.write(out, "utf-8")
+            content = out.getvalue()
+            end = content.rindex("</feed>")
+            content = "".join([content[:end]] + self.entries() + [content[end:]])
+            cache.set(key, content, TASKS_FEED_CACHE_TIMEOUT)
+        return content
 
 
 class AllTaskFeed(BaseTaskFeed):
-    pass
\ No newline at end of file
+    pass
+
+
+class AssigneeTaskFeed(BaseTaskFeed):
+    """
+    Changes of the tasks currently assigned to a user.
+    """
+    
+    def get_object(self, bits):
+        if len(bits) != 1:
+            raise LookupError("Feed takes a username")
+        return User.objects.get(username=bits[0])
+    
+    def feed_title(self):
+        return "%s for %s" % (super(AssigneeTaskFeed, self).feed_title(), self.obj.username)
+    
+    def feed_links(self):
+        complete_url = "http://%s%s" % (
+            self.domain,
+            self.reverse("tasks_for_user", kwargs={"username": self.obj.username}),
+        )
+        return ({"href": complete_url},)
+    
+    def get_qs(self):
+        return self.history().filter(task__assignee=self.obj).order_by("-modified")
+
+
+class TagTaskFeed(BaseTaskFeed):
+    """
+    Changes of the tasks currently tagged with a tag.
+    """
+    
+    def get_object(self, bits):
+        if len(bits) != 1:
+            raise LookupError("Feed takes a tag")
+        return bits[0]
+    
+    def feed_title(self):
+        return "%s tagged %s" % (super(TagTaskFeed, self).feed_title(), self.obj)
+    
+    def feed_links(self):
+        complete_url = "http://%s%s" % (
+            self.domain,
+            self.reverse("task_focus", kwargs={"field": "tag", "value": self.obj}),
+        )
+        return ({"href": complete_url},)
+    
+    def get_qs(self):
+        tasks = Task.objects.filter(tags__name__in=[self.obj])
+        return self.history().filter(task__in=tasks).order_by("-modified")
+
+
+FEEDS = {
+    "all": AllTaskFeed,
+    "assignee": AssigneeTaskFeed,
+    "tag": TagTaskFeed,
+}
+
+
+def get_feed(request, slug, param=None):
+    # shared by the conditional checks and the view itself
+    if not hasattr(request, "_task_feed"):
+        if slug not in FEEDS:
+            raise Http404
+        feed = FEEDS[slug](slug, request.path, getattr(request, "group", None))
+        try:
+            feed.obj = feed.get_object(param and param.split("/") or [])
+        except (LookupError, User.DoesNotExist):
+            raise Http404
+        request._task_feed = feed
+    return request._task_feed
+
+
+@condition(
+    etag_func = lambda request, slug, param=None: get_feed(request, slug, param).etag(),
+    last_modified_func = lambda request, slug, param=None: get_feed(request, slug, param).latest()["modified"],
+)
+def task_feed(request, slug, param=None):
+    return HttpResponse(get_feed(request, slug, param).render(),
+        mimetype = "application/atom+xml; charset=utf-8"
+    )
@@ -1,5 +1,9 @@
 from django.conf import settings
 from django.db import models
+from django.utils.encoding import force_unicode
+from django.utils.hashcompat import md5_constructor
+
+from django_markup.markup import formatter
 
 
 MARKUP_DEFAULT_FILTER = getattr(settings, "MARKUP_DEFAULT_FILTER", None)
@@ -22,3 +26,28 @@ class MarkupField(models.CharField):
         if self.markup_default_filter:
             return None
         return super(MarkupField, self).formfield(**kwargs)
+
+
+class CountField(models.PositiveIntegerField):
+    """
+    Count kept up to date with update() statements, saving an instance
+    leaves the stored count as it is rather than writing back the one it was
+    loaded with.
+    """
+    
+    def pre_save(self, model_instance, add):
+        if add:
+            return super(CountField, self).pre_save(model_instance, add)
+        return models.F(self.attname)
+
+
+def markup_key(text, markup):
+    """
+    Hash of the text and markup rendered HTML is stored for, it changes
+    whenever either of them does.
+    """
+    return md5_constructor((u"%s\0%s" % (force_unicode(markup), force_unicode(text))).encode("utf-8")).hexdigest()
+
+
+def render_markup(text, markup):
+    return formatter(text, markup)
@@ -8,6 +8,7 @@ from django.contrib.auth.models import User
 from taggit.forms import TagField
 
 from tasks.models import Task, TaskHistory, workflow
+from tasks.permissions import is_group_member
 from tasks.widgets import ReadOnlyWidget
 
 
@@ -46,7 +47,7 @@ class TaskForm(forms.ModelForm):
     
     def check_group_membership(self):
         group = self.group
-        if group and not self.group.user_is_member(self.user):
+        if group and not is_group_member(group, self.user):
             raise forms.ValidationError("You must be a member to create tasks")
 
 
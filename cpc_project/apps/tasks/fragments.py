@@ -0,0 +1,94 @@
+"""
+Caching of the rendered rows of the task table.
+
+Rows are cached in parts (everything but the relative modification time,
+which changes on its own) under a key made of the task id, its modification
+date, a per task version and what else the row depends on: the group, the
+vote of the viewer and whether they are logged in. The version is bumped
+whenever the task, its tags or its votes change, which makes all the cached
+parts of its rows stale at once. Rows and versions are kept in the cache
+set with TASKS_ROW_CACHE.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import get_language
+
+from django.contrib.contenttypes.models import ContentType
+
+
+TASKS_ROW_CACHE = getattr(settings, "TASKS_ROW_CACHE", "default")
+TASKS_ROW_CACHE_TIMEOUT = getattr(settings, "TASKS_ROW_CACHE_TIMEOUT", 60 * 60)
+
+# versions outlive the rows they are part of the key of
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+# rendered in place of the csrf token of the viewer so cached rows can be
+# shared between viewers, replaced with the actual token on the way out
+CSRF_PLACEHOLDER = "__TASK_ROW_CSRF_TOKEN__"
+
+cache = get_cache(TASKS_ROW_CACHE)
+
+
+def version_key(task_id):
+    return "tasks:row-version:%s" % task_id
+
+
+def new_version():
+    # versions start from the clock so a version evicted from the cache can
+    # not come back with the value of a stale one
+    return int(time.time() * 1000)
+
+
+def row_version(task):
+    if not hasattr(task, "_row_version"):
+        version = cache.get(version_key(task.pk))
+        if version is None:
+            cache.add(version_key(task.pk), new_version(), VERSION_TIMEOUT)
+            version = cache.get(version_key(task.pk), 0)
+        task._row_version = version
+    return task._row_version
+
+
+def invalidate_task_row(task_id):
+    try:
+        cache.incr(version_key(task_id))
+    except ValueError:
+        cache.set(version_key(task_id), new_version(), VERSION_TIMEOUT)
+
+
+def row_key(part, task, group=None, vote=None, authenticated=False):
+    if vote:
+        vote_state = vote.is_upvote() and "up" or "down"
+    else:
+        vote_state = ""
+    if group is not None:
+        group_key = "%s.%s" % (group._meta, group.pk)
+    else:
+        group_key = ""
+    args = md5_constructor(":".join([
+        part,
+        task.modified.isoformat(),
+        vote_state,
+        authenticated and "1" or "0",
+        group_key,
+        get_language() or "",
+    ]))
+    return "tasks:row:%s:%s:%s" % (task.pk, row_version(task), args.hexdigest())
+
+
+def task_changed(sender, instance, **kwargs):
+    invalidate_task_row(instance.pk)
+
+
+def object_changed(model):
+    """
+    Returns a signal handler invalidating the task row of tagged items and
+    votes attached to tasks (``model``).
+    """
+    def handler(sender, instance, **kwargs):
+        if instance.content_type_id == ContentType.objects.get_for_model(model).pk:
+            invalidate_task_row(instance.object_id)
+    return handler
@@ -0,0 +1,187 @@
+"""
+Batch loaders used by the task views and templates to fetch related data
+for a whole collection of tasks in a fixed number of queries.
+"""
+from django.db.models import Q
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
+from taggit.models import TaggedItem
+from voting.models import Vote
+
+from tasks.models import TaskHistory
+
+
+
+def tags_for_objects(objects):
+    """
+    Return a dictionary mapping the primary key of each object to the list
+    of tags attached to it, ordered by name. All objects must be instances
+    of the same model. A single query is made regardless of the number of
+    objects or tags.
+    """
+    tag_map = dict((obj.pk, []) for obj in objects)
+    if not tag_map:
+        return tag_map
+    
+    items = TaggedItem.objects.filter(
+        content_type = ContentType.objects.get_for_model(objects[0]),
+        object_id__in = tag_map.keys(),
+    ).select_related("tag").order_by("tag__name")
+    
+    for item in items:
+        tag_map[item.object_id].append(item.tag)
+    
+    return tag_map
+
+
+def prefetch_tags(objects):
+    """
+    Load the tags of all the given objects with one query and attach them to
+    each object as a ``prefetched_tags`` list. Objects that already carry
+    prefetched tags are left alone.
+    """
+    pending = [obj for obj in objects if not hasattr(obj, "prefetched_tags")]
+    tag_map = tags_for_objects(pending)
+    for obj in pending:
+        obj.prefetched_tags = tag_map[obj.pk]
+    return objects
+
+
+def prefetch_generic(objects, name="group"):
+    """
+    Resolve the generic foreign key ``name`` of all the given objects with
+    one query per content type they point to, rather than one per object,
+    and cache the result on each object the way the generic foreign key
+    itself does. All objects must be instances of the same model.
+    """
+    if not objects:
+        return objects
+    field = [f for f in objects[0]._meta.virtual_fields if f.name == name][0]
+    ct_attname = objects[0]._meta.get_field(field.ct_field).get_attname()
+    
+    wanted = {}
+    for obj in objects:
+        ct_id, pk = getattr(obj, ct_attname), getattr(obj, field.fk_field)
+        if ct_id is not None and pk is not None:
+            wanted.setdefault(ct_id, set()).add(pk)
+    
+    loaded = {}
+    for ct_id, pks in wanted.items():
+        model = ContentType.objects.get_for_id(ct_id).model_class()
+        for pk, instance in model._default_manager.in_bulk(list(pks)).items():
+            loaded[(ct_id, pk)] = instance
+    
+    for obj in objects:
+        key = (getattr(obj, ct_attname), getattr(obj, field.fk_field))
+        setattr(obj, field.cache_attr, loaded.get(key))
+    return objects
+
+
+def load_history(histories):
+    """
+    Load a page of task history for display: the task, owner and assignee
+    of each revision are joined in, the groups they belong to are resolved
+    per content type and the fields and tags deltas did not store are
+    filled in (see TaskHistoryManager.resolve). The number of queries does
+    not depend on the number of revisions.
+    """
+    histories = TaskHistory.objects.resolve(histories.select_related("task", "owner", "assignee"))
+    load_assignees(histories)
+    return prefetch_generic(histories, "group")
+
+
+def load_assignees(histories):
+    """
+    Attach the assignees resolved revisions were filled in with after the
+    join (see TaskHistoryManager.resolve), with one query for all of them.
+    """
+    missing = [h for h in histories if not hasattr(h, "_assignee_cache")]
+    users = User.objects.in_bulk(set(h.assignee_id for h in missing if h.assignee_id))
+    for history in missing:
+        history.assignee = users.get(history.assignee_id)
+    return histories
+
+
+def group_by_tag(tasks):
+    """
+    Group tasks by tag the same way the task table expects a regrouped list:
+    a list of {"grouper": tag, "list": [task, ...]} dictionaries ordered by
+    tag name. A task with several tags shows up in each of their sections.
+    
+    The tasks are fetched once and their tags with one more query, so the
+    cost stays flat however many tags exist.
+    """
+    tasks = list(tasks)
+    tag_map = tags_for_objects(tasks)
+    
+    sections = {}
+    for task in tasks:
+        task.prefetched_tags = tag_map[task.pk]
+        for tag in task.prefetched_tags:
+            if tag.pk not in sections:
+                sections[tag.pk] = {"grouper": tag, "list": []}
+            sections[tag.pk]["list"].append(task)
+    
+    return sorted(sections.values(), key=lambda section: section["grouper"].name)
+
+
+def votes_for_objects(objects, user=None):
+    """
+    Return a (scores, user_votes) pair of dictionaries keyed by object
+    primary key, shaped like the ones of the scores_for_objects and
+    votes_by_user tags of voting. Objects showing up several times are only
+    looked up once: one query for the scores, one for the votes of ``user``
+    (none for anonymous users).
+    """
+    unique = dict((obj.pk, obj) for obj in objects).values()
+    if not unique:
+        return {}, {}
+    
+    scores = Vote.objects.get_scores_in_bulk(unique)
+    if user is not None and user.is_authenticated():
+        user_votes = Vote.objects.get_for_user_in_bulk(unique, user)
+    else:
+        user_votes = {}
+    return scores, user_votes
+
+
+def user_task_lists(tasks, user, states):
+    """
+    Load the tasks ``user`` is assigned to, created or is nudged about (the
+    assigned tasks someone nudged) out of ``tasks`` with a single query.
+    
+    ``states`` maps each list, "assigned", "created" and "nudged", to the
+    states shown in it or None to show them all. The nudged list is also
+    narrowed by the states of the assigned one, which it is a part of.
+    Returns a dictionary of the three lists ordered by state and newest
+    first. Each task carries the lists it belongs to as a ``roles`` set.
+    """
+    wanted = set()
+    for list_states in states.values():
+        if list_states is None:
+            wanted = None
+            break
+        wanted.update(list_states)
+    
+    tasks = tasks.filter(Q(assignee=user) | Q(creator=user))
+    if wanted is not None:
+        tasks = tasks.filter(state__in=wanted)
+    tasks = tasks.select_related("assignee").order_by("state", "-modified")
+    
+    lists = {"assigned": [], "created": [], "nudged": []}
+    for task in tasks:
+        task.roles = set()
+        if task.assignee_id == user.pk:
+            task.roles.add("assigned")
+            if task.nudge_count:
+                task.roles.add("nudged")
+        if task.creator_id == user.pk:
+            task.roles.add("created")
+        shown = set(role for role in task.roles if states[role] is None or task.state in states[role])
+        if "assigned" not in shown:
+            shown.discard("nudged")
+        for role in shown:
+            lists[role].append(task)
+    return lists
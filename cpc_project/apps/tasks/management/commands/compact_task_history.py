@@ -0,0 +1,83 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tasks.models import TaskHistory, HISTORY_FIELDS, TASKS_HISTORY_KEYFRAME_INTERVAL
+from tasks.models import apply_revision, history_column
+
+
+
+def text_size(values):
+    return sum(len(value.encode("utf-8")) for value in values if isinstance(value, basestring))
+
+
+class Command(BaseCommand):
+    help = "Converts the history of tasks to keyframes and deltas and reports the space saved"
+    
+    option_list = BaseCommand.option_list + (
+        make_option("--dry-run",
+            action = "store_true",
+            dest = "dry_run",
+            default = False,
+            help = "Only report the space that would be saved, do not convert"
+        ),
+    )
+    
+    def compact(self, revisions):
+        """
+        Returns the (pk, keyframe, changed fields, snapshot) of each revision
+        of a task, oldest first, once compacted.
+        """
+        compacted = []
+        snapshot, since_keyframe = None, 0
+        for revision in revisions:
+            current = apply_revision(dict(snapshot or {}), revision)
+            if snapshot is None or since_keyframe + 1 >= TASKS_HISTORY_KEYFRAME_INTERVAL:
+                compacted.append((revision["pk"], True, HISTORY_FIELDS, current))
+                since_keyframe = 0
+            else:
+                changed = [field for field in HISTORY_FIELDS if current.get(field) != snapshot.get(field)]
+                compacted.append((revision["pk"], False, changed, current))
+                since_keyframe += 1
+            snapshot = current
+        return compacted
+    
+    def handle(self, *args, **options):
+        task_ids = TaskHistory.objects.values_list("task", flat=True).distinct()
+        
+        before, after, converted, keyframes = 0, 0, 0, 0
+        for task_id in task_ids.order_by("task"):
+            revisions = list(TaskHistory.objects.revisions().filter(task=task_id).order_by("pk"))
+            compacted = self.compact(revisions)
+            
+            for revision, (pk, keyframe, changed, snapshot) in zip(revisions, compacted):
+                stored = apply_revision({}, revision)
+                before += text_size(stored.values())
+                after += text_size(snapshot.get(field) for field in changed)
+                keyframes += keyframe
+            converted += len(revisions)
+            
+            if options["dry_run"]:
+                continue
+            
+            with transaction.commit_on_success():
+                for pk, keyframe, changed, snapshot in compacted:
+                    values = {
+                        "keyframe": keyframe,
+                        "changed_fields": not keyframe and ",".join(changed) or "",
+                    }
+                    for field in HISTORY_FIELDS:
+                        if field in changed:
+                            values[history_column(field)] = snapshot.get(field)
+                        elif field == "assignee":
+                            values[history_column(field)] = None
+                        else:
+                            values[history_column(field)] = ""
+                    TaskHistory.objects.filter(pk=pk).update(**values)
+        
+        saved = before - after
+        print "[TaskHistory] %s revision(s) of %s task(s), %s keyframe(s)" % (converted, task_ids.count(), keyframes)
+        print "[TaskHistory] snapshot text %s bytes before, %s bytes after, %s bytes (%.1f%%) saved" % (
+            before, after, saved, before and 100.0 * saved / before or 0
+        )
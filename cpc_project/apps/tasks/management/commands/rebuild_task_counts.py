@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from tasks.models import TaskCount
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the open task counts from scratch or verifies them"
+    
+    option_list = BaseCommand.option_list + (
+        make_option("--verify",
+            action = "store_true",
+            dest = "verify",
+            default = False,
+            help = "Only report the counts that differ from the tasks, do not rebuild"
+        ),
+    )
+    
+    def handle(self, *args, **options):
+        expected = TaskCount.objects.compute()
+        current = TaskCount.objects.current()
+        
+        differences = 0
+        for key in sorted(set(expected) | set(current)):
+            if expected.get(key, 0) != current.get(key, 0):
+                differences += 1
+                print "[TaskCount] %s %s (group %s/%s): counted %s, actually %s" % (
+                    key[2], key[3], key[0], key[1], current.get(key, 0), expected.get(key, 0)
+                )
+        
+        if options["verify"]:
+            print "[TaskCount] %s count(s) differ" % differences
+            return
+        
+        TaskCount.objects.rebuild()
+        print "[TaskCount] rebuilt %s count(s), %s fixed" % (len(expected), differences)
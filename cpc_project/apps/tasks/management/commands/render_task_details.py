@@ -0,0 +1,98 @@
+import itertools
+import multiprocessing
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from tasks.fields import markup_key, render_markup
+from tasks.models import Task
+
+
+
+def render_chunk(rows):
+    # runs in the worker processes: pure rendering, no database access
+    return [
+        (pk, render_markup(detail, markup), markup_key(detail, markup))
+        for pk, detail, markup in rows
+    ]
+
+
+class Command(BaseCommand):
+    help = "Renders the detail of tasks whose rendered HTML is missing or stale"
+    
+    option_list = BaseCommand.option_list + (
+        make_option("--all",
+            action = "store_true",
+            dest = "all",
+            default = False,
+            help = "Render every task again, not only stale ones"
+        ),
+        make_option("--processes",
+            dest = "processes",
+            type = "int",
+            default = multiprocessing.cpu_count(),
+            help = "Number of rendering processes (defaults to the number of CPUs)"
+        ),
+        make_option("--chunk-size",
+            dest = "chunk_size",
+            type = "int",
+            default = 200,
+            help = "Number of tasks handed to a rendering process at once"
+        ),
+    )
+    
+    def chunks(self, render_all, chunk_size):
+        # walks the tasks by id so each chunk is a small query of its own
+        last_pk = 0
+        while True:
+            rows = list(
+                Task.objects.filter(pk__gt=last_pk).order_by("pk").values_list(
+                    "pk", "detail", "markup", "detail_html_key"
+                )[:chunk_size]
+            )
+            if not rows:
+                return
+            last_pk = rows[-1][0]
+            stale = [
+                (pk, detail, markup)
+                for pk, detail, markup, key in rows
+                if render_all or key != markup_key(detail, markup)
+            ]
+            if stale:
+                yield stale
+    
+    def save_chunk(self, rendered):
+        for pk, detail_html, key in rendered:
+            # update() leaves modified alone, rendering is not a change
+            Task.objects.filter(pk=pk).update(detail_html=detail_html, detail_html_key=key)
+        transaction.commit_unless_managed()
+    
+    def handle(self, *args, **options):
+        processes = options["processes"]
+        chunks = self.chunks(options["all"], options["chunk_size"])
+        rendered = 0
+        if processes > 1:
+            # the workers would be forked with the database connection of
+            # this process, close it so they do not share it
+            connection.close()
+            pool = multiprocessing.Pool(processes)
+            try:
+                while True:
+                    # a chunk per process at a time, the chunks are read here
+                    # and only rendered by the workers
+                    window = list(itertools.islice(chunks, processes))
+                    if not window:
+                        break
+                    for result in pool.map(render_chunk, window):
+                        self.save_chunk(result)
+                        rendered += len(result)
+            finally:
+                pool.terminate()
+        else:
+            for chunk in chunks:
+                result = render_chunk(chunk)
+                self.save_chunk(result)
+                rendered += len(result)
+        print "[Task] rendered the detail of %s task(s)" % rendered
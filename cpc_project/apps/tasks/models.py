@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
+import operator
+
 from datetime import datetime
 
-from django.db import models
+from django.db import connection, models, transaction, IntegrityError
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.core.urlresolvers import reverse
+from django.utils.encoding import force_unicode
 from django.utils.html import escape
 from django.utils.importlib import import_module
+from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
 from django.contrib.auth.models import User
@@ -14,12 +18,27 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 
 from taggit.managers import TaggableManager
+from taggit.models import Tag, TaggedItem
+from taggit.utils import edit_string_for_tags, parse_tags
+from voting.models import Vote
 # from threadedcomments.models import ThreadedComment
 
-from tasks.fields import MarkupField
+from tasks import fragments, permissions, tagindex
+from tasks.exports import compile_exports
+from tasks.fields import CountField, MarkupField, markup_key, render_markup
+from tasks.transitions import compile_workflow
 
 
 workflow = import_module(getattr(settings, "TASKS_WORKFLOW_MODULE", "tasks.workflow"))
+transitions = compile_workflow(workflow)
+exports = compile_exports(workflow)
+
+# tasks in these states are not counted as open
+CLOSED_STATES = getattr(settings, "TASKS_CLOSED_STATES", ["2", "3"])
+
+# every nth revision of a task is stored in full, the others only store the
+# fields that changed since the previous revision
+TASKS_HISTORY_KEYFRAME_INTERVAL = getattr(settings, "TASKS_HISTORY_KEYFRAME_INTERVAL", 20)
 
 
 class Task(models.Model):
@@ -38,6 +57,10 @@ class Task(models.Model):
     summary = models.CharField(_("summary"), max_length=100)
     detail = models.TextField(_("detail"), blank=True)
     markup = MarkupField(_(u"Detail Markup"))
+    # detail rendered with markup when the task is saved, detail_html_key
+    # tells which detail and markup it was rendered from
+    detail_html = models.TextField(editable=False, blank=True)
+    detail_html_key = models.CharField(max_length=32, editable=False, blank=True)
     creator = models.ForeignKey(User,
         related_name = "created_tasks",
         verbose_name = _("creator")
@@ -69,6 +92,9 @@ class Task(models.Model):
         blank = True
     )
     
+    # number of nudges, maintained by NudgeManager and denudge
+    nudge_count = CountField(default=0, editable=False)
+    
     # fields for review and saves
     fields = [
         "summary",
@@ -88,7 +114,35 @@ class Task(models.Model):
     
     def save(self, **kwargs):
         self.modified = datetime.now()
+        self.render_detail()
+        adding = self.pk is None
+        if not adding and not hasattr(self, "_counted_key"):
+            # deferred instances are not told what they are counted as
+            self._counted_key = TaskCount.objects.stored_key(self.pk)
+        # the open task counts are updated in the transaction of the caller,
+        # the views save a task, its tags and history in one
         super(Task, self).save(**kwargs)
+        TaskCount.objects.task_saved(self)
+    
+    def render_detail(self):
+        """
+        Renders detail_html again when detail or markup have changed since it
+        was last rendered, returns whether it was.
+        """
+        key = markup_key(self.detail, self.markup)
+        if key == self.detail_html_key:
+            return False
+        self.detail_html = render_markup(self.detail, self.markup)
+        self.detail_html_key = key
+        return True
+    
+    @property
+    def rendered_detail(self):
+        # rows not rendered yet (see render_task_details) or changed through
+        # update() are rendered on the fly
+        if self.detail_html_key != markup_key(self.detail, self.markup):
+            return mark_safe(render_markup(self.detail, self.markup))
+        return mark_safe(self.detail_html)
     
     def get_absolute_url(self, group=None):
         kwargs = {"id": self.pk}
@@ -98,13 +152,22 @@ class Task(models.Model):
     
     def denudge(self):
         # we remove all nudges for this Task
-        for nudge in Nudge.objects.filter(task__exact=self):
-            nudge.delete()
+        Nudge.objects.clear(self)
     
     def save_history(self, comment_instance=None, change_owner=None):
         """
         Create a new ChangeSet with the old content.
         """
+        previous, since_keyframe = TaskHistory.objects.latest_snapshot(self)
+        th = self.history_revision(previous, since_keyframe, comment_instance, change_owner)
+        th.save()
+    
+    def history_revision(self, previous, since_keyframe, comment_instance=None, change_owner=None, tags=None):
+        """
+        Returns the unsaved TaskHistory revision following ``previous``, the
+        snapshot of the latest revision (None for the first one), which is
+        ``since_keyframe`` revisions after the latest keyframe.
+        """
         
         # get the task history object
         th = TaskHistory()
@@ -113,11 +176,28 @@ class Task(models.Model):
         if self.group:
             self.group.associate(th, commit=False)
         
-        # save the simple fields
+        # save the simple fields, the ones the history is a snapshot of are
+        # only stored when they changed unless this revision is a keyframe
         
         for field in self.fields:
-            value = getattr(self, field)
-            setattr(th, field, value)
+            if field not in HISTORY_FIELDS:
+                setattr(th, field, getattr(self, field))
+        
+        snapshot = self.history_snapshot(tags)
+        if previous is None or since_keyframe + 1 >= TASKS_HISTORY_KEYFRAME_INTERVAL:
+            changed = HISTORY_FIELDS
+            th.keyframe = True
+        else:
+            changed = [field for field in HISTORY_FIELDS if snapshot[field] != previous.get(field)]
+            th.keyframe = False
+            th.changed_fields = ",".join(changed)
+        for field in HISTORY_FIELDS:
+            if field in changed:
+                setattr(th, history_attname(field), snapshot[field])
+            elif field == "assignee":
+                th.assignee_id = None
+            else:
+                setattr(th, history_attname(field), "")
         
         if change_owner:
             # If a user is provided then we are editing a record.
@@ -132,40 +212,40 @@ class Task(models.Model):
         if comment_instance:
             th.comment = comment_instance.comment
         
-        th.save()
+        return th
+    
+    def history_snapshot(self, tags=None):
+        """
+        The current values of the fields a history revision is a snapshot of,
+        as they are stored. ``tags`` are the tags of the task when they are
+        already known.
+        """
+        snapshot = {}
+        for field in HISTORY_FIELDS:
+            if field == "tags":
+                if tags is None:
+                    tags = self.tags.all()
+                value = edit_string_for_tags(tags)
+            elif field == "assignee":
+                value = self.assignee_id
+            else:
+                value = force_unicode(getattr(self, field))
+            snapshot[field] = value
+        return snapshot
     
     def allowable_states(self, user):
         """
         return state choices allowed given current state and user
         """
-        
-        # I'm the relevant state choices.
-        choices = []
-        
-        # I'm the states already allowed for the users
-        existing_states = []
-        
-        for transition in workflow.STATE_TRANSITIONS:
-            
-            if self.state != str(transition[0]):
-                # if the current state does not match a first element in the
-                # state transitions we skip to the next transition
-                continue
-            
-            # Fire the validation function.
-            if transition[2](self, user):
-                
-                # grab the new state and state description
-                new_state = str(transition[1])
-                description = transition[3]
-                
-                # build new element
-                element = (new_state, description)
-                
-                # append new element to choices
-                choices.append(element)
-        
-        return choices
+        return transitions.allowable_states(self, user)
+    
+    @classmethod
+    def allowable_states_for(cls, tasks, user):
+        """
+        return the state choices allowed to user for each of tasks, keyed by
+        task id, sharing the permission checks that only depend on the user
+        """
+        return transitions.allowable_states_for(tasks, user)
 
 
 def new_comment(sender, instance, **kwargs):
@@ -187,6 +267,174 @@ def new_comment(sender, instance, **kwargs):
 # models.signals.post_save.connect(new_comment, sender=ThreadedComment)
 
 
+def remember_counted_key(sender, instance, **kwargs):
+    # what the open task counts currently hold for this task, compared
+    # against the new values when it's saved. Deferred instances are sent
+    # with their own class and would load their deferred fields, they look
+    # up the stored row when saved instead
+    if isinstance(instance, Task) and not instance._deferred:
+        instance._counted_key = TaskCount.objects.counted_key(instance)
+models.signals.post_init.connect(remember_counted_key)
+
+
+def uncount_task(sender, instance, **kwargs):
+    if isinstance(instance, Task):
+        TaskCount.objects.task_deleted(instance)
+models.signals.pre_delete.connect(uncount_task)
+
+
+# tags are counted when added to or removed from a task however it's done
+# (forms, admin, API, shell), items inserted in bulk are counted by bulk
+def count_added_tag(sender, instance, created, **kwargs):
+    if created and instance.content_type_id == ContentType.objects.get_for_model(Task).pk:
+        TaskCount.objects.tagged_item_changed(instance.object_id, instance.tag_id, 1)
+models.signals.post_save.connect(count_added_tag, sender=TaggedItem)
+
+
+def count_removed_tag(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(Task).pk:
+        TaskCount.objects.tagged_item_changed(instance.object_id, instance.tag_id, -1)
+models.signals.post_delete.connect(count_removed_tag, sender=TaggedItem)
+
+
+def record_deleted_task(sender, instance, **kwargs):
+    DeletedTask.objects.create(task_id=instance.pk)
+models.signals.post_delete.connect(record_deleted_task, sender=Task)
+
+
+# cached task table rows are invalidated when the task, its tags or votes change
+models.signals.post_save.connect(fragments.task_changed, sender=Task)
+for sender in [TaggedItem, Vote]:
+    models.signals.post_save.connect(fragments.object_changed(Task), sender=sender, weak=False)
+    models.signals.post_delete.connect(fragments.object_changed(Task), sender=sender, weak=False)
+
+# the tag autocompletion index is rebuilt when tags are created or deleted
+models.signals.post_save.connect(tagindex.tag_saved, sender=Tag)
+models.signals.post_delete.connect(tagindex.tag_deleted, sender=Tag)
+
+# cached auth groups are dropped when the groups of a user change
+models.signals.m2m_changed.connect(permissions.user_groups_changed, sender=User.groups.through)
+
+
+# the fields of a task each history revision is a snapshot of
+HISTORY_FIELDS = [
+    "summary",
+    "detail",
+    "markup",
+    "assignee",
+    "tags",
+    "status",
+    "state",
+    "resolution",
+]
+
+HISTORY_ATTNAMES = {"assignee": "assignee_id", "tags": "tag_names"}
+HISTORY_COLUMNS = {"tags": "tag_names"}
+
+
+def history_attname(field):
+    return HISTORY_ATTNAMES.get(field, field)
+
+
+def history_column(field):
+    # the name values() knows the field under
+    return HISTORY_COLUMNS.get(field, field)
+
+
+def apply_revision(snapshot, revision):
+    """
+    Updates ``snapshot`` with a revision, a dictionary of task history
+    values, and returns it.
+    """
+    if revision["keyframe"]:
+        fields = HISTORY_FIELDS
+    else:
+        fields = [field for field in revision["changed_fields"].split(",") if field]
+    for field in fields:
+        snapshot[field] = revision[history_column(field)]
+    return snapshot
+
+
+class TaskHistoryManager(models.Manager):
+    
+    def revisions(self):
+        return self.values("pk", "task", "keyframe", "changed_fields",
+            *[history_column(field) for field in HISTORY_FIELDS]
+        )
+    
+    def latest_snapshot(self, task):
+        """
+        Returns the snapshot of the latest revision of ``task`` and the
+        number of revisions since the last keyframe, (None, 0) when there is
+        no keyframe to start from.
+        """
+        latest = list(self.revisions().filter(task=task).order_by("-pk")[:TASKS_HISTORY_KEYFRAME_INTERVAL])
+        for since_keyframe, revision in enumerate(latest):
+            if revision["keyframe"]:
+                break
+        else:
+            return None, 0
+        snapshot = {}
+        for revision in reversed(latest[:since_keyframe + 1]):
+            apply_revision(snapshot, revision)
+        return snapshot, since_keyframe
+    
+    def resolve(self, histories):
+        """
+        Fills in the fields revisions in ``histories`` did not store because
+        they did not change, from the revisions before them, so each one
+        looks like a full snapshot. Two queries are made for the whole list
+        of revisions, none when they are all keyframes. The tags of each
+        revision are attached as a ``prefetched_tags`` list of names.
+        """
+        histories = list(histories)
+        pending = {}
+        for history in histories:
+            if not history.keyframe:
+                pending.setdefault(history.task_id, []).append(history)
+        
+        if pending:
+            bounds = dict(
+                (task_id, (min(h.pk for h in rows), max(h.pk for h in rows)))
+                for task_id, rows in pending.items()
+            )
+            # the latest keyframe before the first pending revision of each task
+            start = {}
+            keyframes = self.filter(
+                task__in = pending.keys(),
+                keyframe = True,
+                pk__lte = max(high for low, high in bounds.values()),
+            ).values_list("task", "pk")
+            for task_id, pk in keyframes:
+                if pk <= bounds[task_id][0] and pk > start.get(task_id, 0):
+                    start[task_id] = pk
+            
+            ranges = [
+                models.Q(task=task_id, pk__gte=start.get(task_id, 0), pk__lte=high)
+                for task_id, (low, high) in bounds.items()
+            ]
+            targets = dict((h.pk, h) for rows in pending.values() for h in rows)
+            task_id, snapshot = None, {}
+            for revision in self.revisions().filter(reduce(operator.or_, ranges)).order_by("task", "pk"):
+                if revision["task"] != task_id:
+                    task_id, snapshot = revision["task"], {}
+                apply_revision(snapshot, revision)
+                if revision["pk"] in targets:
+                    history = targets[revision["pk"]]
+                    for field in HISTORY_FIELDS:
+                        if field in snapshot:
+                            setattr(history, history_attname(field), snapshot[field])
+                    # an assignee joined in by select_related is the blank one
+                    # of the delta, not the one filled in
+                    if hasattr(history, "_assignee_cache"):
+                        if getattr(history._assignee_cache, "pk", None) != history.assignee_id:
+                            del history._assignee_cache
+        
+        for history in histories:
+            history.prefetched_tags = parse_tags(history.tag_names)
+        return histories
+
+
 class TaskHistory(models.Model):
     
     STATE_CHOICES = workflow.STATE_CHOICES
@@ -244,14 +492,99 @@ class TaskHistory(models.Model):
         verbose_name=_("Owner")
     )
     
+    # tags of the task, as edited
+    tag_names = models.TextField(blank=True)
+    
+    # keyframes store all the HISTORY_FIELDS of the task, other revisions
+    # only the changed_fields (comma separated)
+    keyframe = models.BooleanField(default=True)
+    changed_fields = models.CharField(max_length=100, blank=True)
+    
+    objects = TaskHistoryManager()
+    
     def __unicode__(self):
         return "for " + str(self.task)
     
+    def snapshot(self):
+        """
+        Returns the task fields as they were at this revision.
+        """
+        if not hasattr(self, "prefetched_tags"):
+            TaskHistory.objects.resolve([self])
+        snapshot = dict(
+            (field, getattr(self, history_attname(field)))
+            for field in HISTORY_FIELDS
+        )
+        snapshot["tags"] = self.prefetched_tags
+        return snapshot
+    
     def save(self, **kwargs):
         self.modified = datetime.now()
         super(TaskHistory, self).save(**kwargs)
 
 
+class NudgeManager(models.Manager):
+    """
+    Nudges are added and removed with single statements that report whether
+    they did anything, Task.nudge_count is adjusted in the same transaction.
+    """
+    
+    def execute(self, sql, params):
+        cursor = connection.cursor()
+        cursor.execute(sql % {
+            "nudge": connection.ops.quote_name(self.model._meta.db_table),
+            "task": connection.ops.quote_name(Task._meta.db_table),
+        }, params)
+        return cursor.rowcount
+    
+    def adjust_count(self, task, delta):
+        Task.objects.filter(pk=task.pk).update(nudge_count=models.F("nudge_count") + delta)
+    
+    def toggle(self, task, user):
+        """
+        Removes the nudge of ``user`` from ``task`` or adds one when there is
+        none. Returns whether ``task`` ends up nudged by ``user`` and the
+        number of nudges of ``task``.
+        """
+        with transaction.commit_on_success():
+            removed = self.execute(
+                "DELETE FROM %(nudge)s WHERE task_id = %%s AND nudger_id = %%s",
+                [task.pk, user.pk]
+            )
+            if removed:
+                self.adjust_count(task, -removed)
+                nudged = False
+            else:
+                sid = transaction.savepoint()
+                try:
+                    added = self.execute(
+                        "INSERT INTO %(nudge)s (nudger_id, task_id, modified) "
+                        "SELECT %%s, %%s, %%s WHERE NOT EXISTS "
+                        "(SELECT 1 FROM %(nudge)s WHERE task_id = %%s AND nudger_id = %%s)",
+                        [user.pk, task.pk, datetime.now(), task.pk, user.pk]
+                    )
+                    transaction.savepoint_commit(sid)
+                except IntegrityError:
+                    # nudged concurrently
+                    transaction.savepoint_rollback(sid)
+                    added = 0
+                if added:
+                    self.adjust_count(task, added)
+                nudged = True
+            count = Task.objects.filter(pk=task.pk).values_list("nudge_count", flat=True)[0]
+        task.nudge_count = count
+        return nudged, count
+    
+    def clear(self, task):
+        """
+        Removes all the nudges of ``task``.
+        """
+        with transaction.commit_on_success():
+            self.execute("DELETE FROM %(nudge)s WHERE task_id = %%s", [task.pk])
+            Task.objects.filter(pk=task.pk).update(nudge_count=0)
+        task.nudge_count = 0
+
+
 class Nudge(models.Model):
     
     nudger = models.ForeignKey(User,
@@ -263,3 +596,235 @@ class Nudge(models.Model):
         verbose_name = _("task")
     )
     modified = models.DateTimeField(_("nudge date"), default=datetime.now)
+    
+    objects = NudgeManager()
+    
+    class Meta:
+        unique_together = [("task", "nudger")]
+
+
+class TaskCountManager(models.Manager):
+    
+    def counted_key(self, task):
+        """
+        The (content_type_id, object_id, state, assignee_id) of a saved task,
+        the values its open task counts depend on (besides tags).
+        """
+        if task.pk is None:
+            return None
+        return (task.content_type_id, task.object_id, str(task.state), task.assignee_id)
+    
+    def stored_key(self, task_id):
+        """
+        The counted key of the row of a task as stored, None when it has none.
+        """
+        rows = Task.objects.filter(pk=task_id).values_list("content_type", "object_id", "state", "assignee")[:1]
+        if not rows:
+            return None
+        content_type_id, object_id, state, assignee_id = rows[0]
+        return (content_type_id, object_id, str(state), assignee_id)
+    
+    def is_open(self, key):
+        return key is not None and key[2] not in CLOSED_STATES
+    
+    def keys_for(self, key):
+        if not self.is_open(key):
+            return []
+        return [
+            ("state", key[2]),
+            ("assignee", str(key[3] or "")),
+        ]
+    
+    def adjust(self, content_type_id, object_id, keys, delta):
+        for dimension, value in keys:
+            counts = self.filter(
+                content_type = content_type_id,
+                object_id = object_id,
+                dimension = dimension,
+                value = value,
+            )
+            if counts.update(count=models.F("count") + delta):
+                continue
+            sid = transaction.savepoint()
+            try:
+                self.create(
+                    content_type_id = content_type_id,
+                    object_id = object_id,
+                    dimension = dimension,
+                    value = value,
+                    count = delta,
+                )
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                # created concurrently, update it instead
+                transaction.savepoint_rollback(sid)
+                counts.update(count=models.F("count") + delta)
+    
+    def tag_keys(self, tag_ids):
+        return [("tag", str(tag_id)) for tag_id in tag_ids]
+    
+    def task_saved(self, task):
+        previous = getattr(task, "_counted_key", None)
+        current = self.counted_key(task)
+        if previous == current:
+            return
+        
+        if previous is not None:
+            self.adjust(previous[0], previous[1], self.keys_for(previous), -1)
+        self.adjust(current[0], current[1], self.keys_for(current), 1)
+        
+        # the tags follow the task when it opens, closes or changes group
+        if previous is not None and (previous[:2] != current[:2] or
+            self.is_open(previous) != self.is_open(current)):
+            tag_keys = self.tag_keys(task.tags.values_list("id", flat=True))
+            if self.is_open(previous):
+                self.adjust(previous[0], previous[1], tag_keys, -1)
+            if self.is_open(current):
+                self.adjust(current[0], current[1], tag_keys, 1)
+        
+        task._counted_key = current
+    
+    def tagged_item_changed(self, task_id, tag_id, delta):
+        """
+        Counts a tag added to (``delta`` 1) or removed from (-1) a task.
+        """
+        key = self.stored_key(task_id)
+        if self.is_open(key):
+            self.adjust(key[0], key[1], self.tag_keys([tag_id]), delta)
+    
+    def tasks_created(self, tasks):
+        """
+        Counts tasks inserted in bulk rather than saved one by one, given as
+        (task, tag ids) pairs, adjusting each count once for all of them.
+        """
+        deltas = {}
+        for task, tag_ids in tasks:
+            key = self.counted_key(task)
+            if self.is_open(key):
+                for dimension, value in self.keys_for(key) + self.tag_keys(tag_ids):
+                    count_key = (key[0], key[1], dimension, value)
+                    deltas[count_key] = deltas.get(count_key, 0) + 1
+            task._counted_key = key
+        for (content_type_id, object_id, dimension, value), delta in deltas.items():
+            self.adjust(content_type_id, object_id, [(dimension, value)], delta)
+    
+    def task_deleted(self, task):
+        if hasattr(task, "_counted_key"):
+            key = task._counted_key
+        else:
+            key = self.stored_key(task.pk)
+        if not self.is_open(key):
+            return
+        tag_keys = self.tag_keys(task.tags.values_list("id", flat=True))
+        self.adjust(key[0], key[1], self.keys_for(key) + tag_keys, -1)
+    
+    def for_group(self, group):
+        if group is None:
+            return self.filter(content_type__isnull=True, object_id__isnull=True)
+        return self.filter(
+            content_type = ContentType.objects.get_for_model(group),
+            object_id = group.pk,
+        )
+    
+    def counts_for(self, group):
+        """
+        Returns the open task counts of a group (or of the tasks outside any
+        group) as {dimension: {value: count}} using a single query.
+        """
+        counts = {"state": {}, "assignee": {}, "tag": {}}
+        for dimension, value, count in self.for_group(group).values_list("dimension", "value", "count"):
+            counts[dimension][value] = counts[dimension].get(value, 0) + count
+        return counts
+    
+    def compute(self):
+        """
+        Counts the open tasks from scratch, returns a dictionary keyed by
+        (content_type_id, object_id, dimension, value).
+        """
+        expected = {}
+        open_tasks = Task.objects.exclude(state__in=CLOSED_STATES).order_by()
+        for dimension in ["state", "assignee"]:
+            rows = open_tasks.values("content_type", "object_id", dimension).annotate(
+                count = models.Count("id")
+            )
+            for row in rows:
+                value = str(row[dimension] or "")
+                expected[(row["content_type"], row["object_id"], dimension, value)] = row["count"]
+        
+        cursor = connection.cursor()
+        cursor.execute("""
+            SELECT t.content_type_id, t.object_id, i.tag_id, COUNT(*)
+            FROM tasks_task t
+            INNER JOIN taggit_taggeditem i ON i.object_id = t.id
+            WHERE i.content_type_id = %%s AND t.state NOT IN (%s)
+            GROUP BY t.content_type_id, t.object_id, i.tag_id
+        """ % ", ".join(["%s"] * len(CLOSED_STATES)),
+            [ContentType.objects.get_for_model(Task).pk] + list(CLOSED_STATES)
+        )
+        for content_type_id, object_id, tag_id, count in cursor.fetchall():
+            expected[(content_type_id, object_id, "tag", str(tag_id))] = count
+        
+        return expected
+    
+    def current(self):
+        counts = {}
+        for row in self.values_list("content_type", "object_id", "dimension", "value", "count"):
+            counts[row[:4]] = counts.get(row[:4], 0) + row[4]
+        return dict((key, count) for key, count in counts.items() if count)
+    
+    def rebuild(self):
+        expected = self.compute()
+        with transaction.commit_on_success():
+            self.all().delete()
+            for (content_type_id, object_id, dimension, value), count in expected.items():
+                self.create(
+                    content_type_id = content_type_id,
+                    object_id = object_id,
+                    dimension = dimension,
+                    value = value,
+                    count = count,
+                )
+        return expected
+
+
+class TaskCount(models.Model):
+    """
+    Incrementally maintained number of open tasks of a group (or of the
+    tasks outside any group) per state, assignee and tag.
+    """
+    
+    DIMENSION_CHOICES = (
+        ("state", _("state")),
+        ("assignee", _("assignee")),
+        ("tag", _("tag")),
+    )
+    
+    content_type = models.ForeignKey(ContentType, null=True)
+    object_id = models.PositiveIntegerField(null=True)
+    group = generic.GenericForeignKey("content_type", "object_id")
+    
+    dimension = models.CharField(_("dimension"), max_length=10, choices=DIMENSION_CHOICES)
+    # the state, the assignee id ("" when unassigned) or the tag id
+    value = models.CharField(_("value"), max_length=100, blank=True)
+    count = models.IntegerField(_("count"), default=0)
+    
+    objects = TaskCountManager()
+    
+    class Meta:
+        unique_together = [("content_type", "object_id", "dimension", "value")]
+    
+    def __unicode__(self):
+        return u"%s %s: %s" % (self.dimension, self.value, self.count)
+
+
+class DeletedTask(models.Model):
+    """
+    Tombstone of a deleted task, telling the API clients syncing changes
+    to drop their copy of it. Its history is deleted with it.
+    """
+    
+    task_id = models.PositiveIntegerField(_("task id"))
+    deleted = models.DateTimeField(_("deleted"), default=datetime.now)
+    
+    def __unicode__(self):
+        return u"task %s deleted" % self.task_id
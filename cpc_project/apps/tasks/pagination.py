@@ -0,0 +1,273 @@
+"""
+Keyset (cursor) pagination for task and task history listings.
+
+Pages are ordered newest first on (modified, id) and addressed with opaque
+cursors pointing at the first or last row of the neighbouring page rather
+than with an offset, so fetching a deep page costs the same as fetching the
+first one.
+
+Timelines merge several such querysets (task history and nudges) into one
+paginated list, each of them ordered and bounded by the database.
+"""
+import base64
+import datetime
+import heapq
+import itertools
+
+from django.db.models import Q
+
+
+
+CURSOR_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def encode_cursor(direction, modified, pk):
+    value = "%s|%s|%s" % (direction, modified.strftime(CURSOR_DATE_FORMAT), pk)
+    return base64.urlsafe_b64encode(value).rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns a (direction, modified, pk) tuple for the given cursor or None
+    when it can't be decoded.
+    """
+    try:
+        cursor = str(cursor)
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, modified, pk = value.split("|")
+        modified = datetime.datetime.strptime(modified, CURSOR_DATE_FORMAT)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeError):
+        return None
+    if direction not in ("next", "prev"):
+        return None
+    return direction, modified, pk
+
+
+def before(modified, pk, inclusive=False):
+    """
+    Rows sorting after (modified, pk) in newest first order.
+    """
+    if inclusive:
+        return Q(modified__lt=modified) | Q(modified=modified, pk__lte=pk)
+    return Q(modified__lt=modified) | Q(modified=modified, pk__lt=pk)
+
+
+def after(modified, pk, inclusive=False):
+    """
+    Rows sorting before (modified, pk) in newest first order.
+    """
+    if inclusive:
+        return Q(modified__gt=modified) | Q(modified=modified, pk__gte=pk)
+    return Q(modified__gt=modified) | Q(modified=modified, pk__gt=pk)
+
+
+class KeysetPage(object):
+    """
+    A page of a keyset paginated queryset.
+    
+    ``queryset`` is the original queryset narrowed down to the rows of this
+    page, it can still be reordered (templates regroup on it).
+    ``object_list`` is the same rows ordered newest first.
+    """
+    
+    def __init__(self, queryset, next_cursor=None, previous_cursor=None):
+        self.queryset = queryset
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+    
+    @property
+    def object_list(self):
+        return self.queryset.order_by("-modified", "-pk")
+    
+    def has_next(self):
+        return self.next_cursor is not None
+    
+    def has_previous(self):
+        return self.previous_cursor is not None
+    
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginate(queryset, cursor=None, per_page=50):
+    """
+    Returns the KeysetPage of ``queryset`` designated by ``cursor`` (the
+    first page when it is missing or invalid).
+    
+    Only the keys of the page are looked up here, bounded by the cursor
+    and the page size, the rows themselves are loaded when the page is used.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    
+    keys = queryset.values_list("modified", "pk")
+    if position is None:
+        keys = keys.order_by("-modified", "-pk")
+    else:
+        direction, modified, pk = position
+        if direction == "next":
+            keys = keys.filter(before(modified, pk)).order_by("-modified", "-pk")
+        else:
+            keys = keys.filter(after(modified, pk)).order_by("modified", "pk")
+    keys = list(keys[:per_page + 1])
+    
+    more = len(keys) > per_page
+    keys = keys[:per_page]
+    if position is not None and position[0] == "prev":
+        keys.reverse()
+        has_next, has_previous = True, more
+    else:
+        has_next, has_previous = more, position is not None
+    
+    if not keys:
+        return KeysetPage(queryset.none())
+    
+    first, last = keys[0], keys[-1]
+    page = KeysetPage(queryset.filter(before(*first, inclusive=True)).filter(after(*last, inclusive=True)))
+    if has_next:
+        page.next_cursor = encode_cursor("next", *last)
+    if has_previous:
+        page.previous_cursor = encode_cursor("prev", *first)
+    return page
+
+
+def encode_timeline_cursor(direction, modified, stream, pk):
+    value = "%s|%s|%s|%s" % (direction, modified.strftime(CURSOR_DATE_FORMAT), stream, pk)
+    return base64.urlsafe_b64encode(value).rstrip("=")
+
+
+def decode_timeline_cursor(cursor):
+    """
+    Returns a (direction, modified, stream, pk) tuple for the given cursor
+    or None when it can't be decoded.
+    """
+    try:
+        cursor = str(cursor)
+        value = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, modified, stream, pk = value.split("|")
+        modified = datetime.datetime.strptime(modified, CURSOR_DATE_FORMAT)
+        stream, pk = int(stream), int(pk)
+    except (TypeError, ValueError, UnicodeError):
+        return None
+    if direction not in ("next", "prev"):
+        return None
+    return direction, modified, stream, pk
+
+
+class TimelineEvent(object):
+    """
+    Heap entry of merge_streams, ordered on (modified, stream, pk) newest
+    first unless ``ascending``.
+    """
+    __slots__ = ["key", "item", "ascending"]
+    
+    def __init__(self, item, stream, ascending):
+        self.key = (item.modified, stream, item.pk)
+        self.item = item
+        self.ascending = ascending
+    
+    def __lt__(self, other):
+        if self.ascending:
+            return self.key < other.key
+        return self.key > other.key
+
+
+def merge_streams(streams, ascending=False):
+    """
+    Lazily merges iterables of rows each already ordered on (modified, pk)
+    newest first (oldest first when ``ascending``) into a single iterable of
+    (stream index, row) in that same order, ties broken on stream index.
+    Only one row per stream is held at any time.
+    """
+    heap = []
+    iterators = [iter(stream) for stream in streams]
+    for index, iterator in enumerate(iterators):
+        for item in iterator:
+            heap.append((TimelineEvent(item, index, ascending), index))
+            break
+    heapq.heapify(heap)
+    while heap:
+        event, index = heap[0]
+        yield index, event.item
+        for item in iterators[index]:
+            heapq.heapreplace(heap, (TimelineEvent(item, index, ascending), index))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+def timeline_stream(queryset, index, position, limit):
+    """
+    The rows of ``queryset`` (stream ``index`` of a timeline) that may show
+    up on the page designated by ``position``, at most ``limit`` of them.
+    """
+    if position is None:
+        return queryset.order_by("-modified", "-pk")[:limit]
+    direction, modified, stream, pk = position
+    if direction == "next":
+        if index < stream:
+            bound = Q(modified__lte=modified)
+        elif index == stream:
+            bound = before(modified, pk)
+        else:
+            bound = Q(modified__lt=modified)
+        return queryset.filter(bound).order_by("-modified", "-pk")[:limit]
+    else:
+        if index > stream:
+            bound = Q(modified__gte=modified)
+        elif index == stream:
+            bound = after(modified, pk)
+        else:
+            bound = Q(modified__gt=modified)
+        return queryset.filter(bound).order_by("modified", "pk")[:limit]
+
+
+class TimelinePage(KeysetPage):
+    """
+    A page of a timeline, ``object_list`` is the list of its rows newest
+    first.
+    """
+    
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self._object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+    
+    @property
+    def object_list(self):
+        return self._object_list
+
+
+def paginate_timeline(querysets, cursor=None, per_page=50):
+    """
+    Returns the TimelinePage designated by ``cursor`` of the rows of several
+    querysets (of models having a ``modified`` date) merged newest first.
+    
+    Each queryset is bounded by the cursor and limited to one page more one
+    row, only the rows of the page are kept.
+    """
+    position = decode_timeline_cursor(cursor) if cursor else None
+    ascending = position is not None and position[0] == "prev"
+    
+    streams = [
+        timeline_stream(queryset, index, position, per_page + 1)
+        for index, queryset in enumerate(querysets)
+    ]
+    events = list(itertools.islice(merge_streams(streams, ascending), per_page + 1))
+    
+    more = len(events) > per_page
+    events = events[:per_page]
+    if ascending:
+        events.reverse()
+        has_next, has_previous = True, more
+    else:
+        has_next, has_previous = more, position is not None
+    
+    page = TimelinePage([item for index, item in events])
+    if events:
+        first, last = events[0], events[-1]
+        if has_next:
+            page.next_cursor = encode_timeline_cursor("next", last[1].modified, last[0], last[1].pk)
+        if has_previous:
+            page.previous_cursor = encode_timeline_cursor("prev", first[1].modified, first[0], first[1].pk)
+    return page
@@ -0,0 +1,83 @@
+"""
+Caching of the group lookups made by the workflow permission checks and the
+views.
+
+The auth groups of a user and their membership of project groups are looked
+up once and kept on the user object, which lives as long as the request
+(this is how ModelBackend caches permissions). Auth groups can also be kept
+in the TASKS_PERMISSION_CACHE cache for TASKS_PERMISSION_CACHE_TIMEOUT
+seconds (0, the default, disables it); they are dropped from it whenever
+the groups of a user change.
+"""
+from django.conf import settings
+from django.core.cache import get_cache
+
+
+
+TASKS_PERMISSION_CACHE = getattr(settings, "TASKS_PERMISSION_CACHE", "default")
+TASKS_PERMISSION_CACHE_TIMEOUT = getattr(settings, "TASKS_PERMISSION_CACHE_TIMEOUT", 0)
+
+cache = get_cache(TASKS_PERMISSION_CACHE)
+
+
+def groups_key(user_id):
+    return "tasks:user-groups:%s" % user_id
+
+
+def group_names(user):
+    """
+    Returns the names of the auth groups of ``user`` as a frozenset.
+    """
+    if not user or user.is_anonymous():
+        return frozenset()
+    if not hasattr(user, "_tasks_group_cache"):
+        names = None
+        if TASKS_PERMISSION_CACHE_TIMEOUT:
+            names = cache.get(groups_key(user.pk))
+        if names is None:
+            names = frozenset(user.groups.values_list("name", flat=True))
+            if TASKS_PERMISSION_CACHE_TIMEOUT:
+                cache.set(groups_key(user.pk), names, TASKS_PERMISSION_CACHE_TIMEOUT)
+        user._tasks_group_cache = names
+    return user._tasks_group_cache
+
+
+def is_group_member(group, user):
+    """
+    Whether ``user`` is a member of the project ``group`` the tasks belong
+    to, always false for anonymous users and otherwise always true for
+    tasks outside of a group.
+    """
+    if not user or not user.is_authenticated():
+        return False
+    if group is None:
+        return True
+    if not hasattr(user, "_tasks_member_cache"):
+        user._tasks_member_cache = {}
+    key = (group._meta.app_label, group._meta.object_name, group.pk)
+    if key not in user._tasks_member_cache:
+        user._tasks_member_cache[key] = group.user_is_member(user)
+    return user._tasks_member_cache[key]
+
+
+def forget_groups(user_ids):
+    if TASKS_PERMISSION_CACHE_TIMEOUT:
+        cache.delete_many([groups_key(user_id) for user_id in user_ids])
+
+
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    m2m_changed handler for auth_user_groups, from either side.
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            instance.__dict__.pop("_tasks_group_cache", None)
+            forget_groups([instance.pk])
+        return
+    if action == "pre_clear":
+        # the members are gone once the group has been cleared
+        instance._tasks_cleared_user_ids = list(instance.user_set.values_list("pk", flat=True))
+    elif action == "post_clear":
+        forget_groups(instance.__dict__.pop("_tasks_cleared_user_ids", []))
+    elif action in ("post_add", "post_remove"):
+        forget_groups(pk_set)
@@ -30,4 +30,9 @@ task_tags_changed = django.dispatch.Signal(
     providing_args=[
         "user", "task", "group"
     ]
-)
\ No newline at end of file
+)
+tasks_created = django.dispatch.Signal(
+    providing_args=[
+        "user", "tasks", "group"
+    ]
+)
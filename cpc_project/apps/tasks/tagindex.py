@@ -0,0 +1,130 @@
+"""
+Process local index of tag names for the tag autocompletion.
+
+Tag names are kept lowercased in a sorted list searched with bisect, and
+matches are ranked by how many times the tags are used. The suggestions for
+the shortest prefixes, which match most of the tags, are ranked once when
+the index is built.
+
+The index is rebuilt when a tag is created or deleted, as recorded by a
+version stamp kept in the cache set with TASKS_TAG_INDEX_CACHE, and after
+TASKS_TAG_INDEX_MAX_AGE seconds in any case. Tagging and untagging objects
+only moves the usage counts the suggestions are ranked by, which are left
+to the periodic rebuild.
+"""
+import bisect
+import heapq
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db.models import Count
+
+from django.contrib.contenttypes.models import ContentType
+
+from taggit.models import Tag
+
+
+
+TASKS_TAG_INDEX_CACHE = getattr(settings, "TASKS_TAG_INDEX_CACHE", "default")
+TASKS_TAG_INDEX_MAX_AGE = getattr(settings, "TASKS_TAG_INDEX_MAX_AGE", 60 * 5)
+TASKS_TAG_AUTOCOMPLETE_LIMIT = getattr(settings, "TASKS_TAG_AUTOCOMPLETE_LIMIT", 20)
+# only suggest the tags used on tasks rather than all of them
+TASKS_TAG_AUTOCOMPLETE_TASKS_ONLY = getattr(settings, "TASKS_TAG_AUTOCOMPLETE_TASKS_ONLY", False)
+
+# prefixes up to this length have their suggestions ranked up front
+PRECOMPUTED_PREFIX_LENGTH = 2
+
+VERSION_KEY = "tasks:tag-index-version"
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+cache = get_cache(TASKS_TAG_INDEX_CACHE)
+
+# built indexes by scope, with the version and time they were built at
+_indexes = {}
+
+
+class TagIndex(object):
+    """
+    Prefix index of ``tags``, (name, usage count) pairs.
+    """
+    
+    def __init__(self, tags, limit=TASKS_TAG_AUTOCOMPLETE_LIMIT):
+        self.limit = limit
+        entries = sorted((name.lower(), -count, name) for name, count in tags)
+        self.keys = [key for key, count, name in entries]
+        self.entries = entries
+        
+        self.top = {}
+        for key, count, name in sorted(entries, key=lambda entry: (entry[1], entry[0])):
+            for length in range(min(len(key), PRECOMPUTED_PREFIX_LENGTH) + 1):
+                suggestions = self.top.setdefault(key[:length], [])
+                if len(suggestions) < limit:
+                    suggestions.append(name)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def suggest(self, term):
+        """
+        Returns the names of the most used tags starting with ``term``,
+        ignoring case, most used first.
+        """
+        term = term.lower()
+        if len(term) <= PRECOMPUTED_PREFIX_LENGTH:
+            return list(self.top.get(term, []))
+        start = bisect.bisect_left(self.keys, term)
+        end = bisect.bisect_left(self.keys, term + u"\uffff", start)
+        matches = heapq.nsmallest(self.limit, self.entries[start:end], key=lambda entry: (entry[1], entry[0]))
+        return [name for key, count, name in matches]
+
+
+def load_tags(tasks_only=False):
+    """
+    Returns (name, usage count) pairs of all tags or of the tags used on
+    tasks when ``tasks_only``, with a single query.
+    """
+    tags = Tag.objects.all()
+    if tasks_only:
+        content_type = ContentType.objects.get_by_natural_key("tasks", "task")
+        tags = tags.filter(taggit_taggeditem_items__content_type=content_type)
+    return tags.values_list("name").annotate(count=Count("taggit_taggeditem_items")).order_by()
+
+
+def index_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, int(time.time() * 1000), VERSION_TIMEOUT)
+        version = cache.get(VERSION_KEY, 0)
+    return version
+
+
+def get_index(tasks_only=TASKS_TAG_AUTOCOMPLETE_TASKS_ONLY):
+    """
+    Returns the TagIndex of this process, rebuilding it first when it is
+    out of date.
+    """
+    version = index_version()
+    built = _indexes.get(tasks_only)
+    if built is None or built[1] != version or built[2] + TASKS_TAG_INDEX_MAX_AGE < time.time():
+        built = _indexes[tasks_only] = (TagIndex(load_tags(tasks_only)), version, time.time())
+    return built[0]
+
+
+def tags_changed():
+    """
+    Marks the indexes of every process out of date.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time() * 1000), VERSION_TIMEOUT)
+
+
+def tag_saved(sender, instance, created, **kwargs):
+    if created:
+        tags_changed()
+
+
+def tag_deleted(sender, instance, **kwargs):
+    tags_changed()
@@ -6,7 +6,9 @@ from django.core.urlresolvers import reverse
 
 from django.contrib.contenttypes.models import ContentType
 
-from tasks.models import Task
+from tasks import fragments
+from tasks.loaders import prefetch_tags, votes_for_objects
+from tasks.models import Task, workflow
 
 
 register = template.Library()
@@ -38,12 +40,136 @@ def focus_url(field, value, group=None):
 
 @register.inclusion_tag("tasks/tag_list.html")
 def task_tags(obj, group=None):
+    # use the tags loaded by prefetch_task_tags when they are available
+    tags = getattr(obj, "prefetched_tags", None)
+    if tags is None:
+        tags = obj.tags.all()
     return {
-        "tags": obj.tags.all(),
+        "tags": tags,
         "group": group,
     }
 
 
+@register.simple_tag
+def prefetch_task_tags(tasks):
+    """
+    Loads the tags for a whole collection of tasks in a single query so that
+    the task_tags calls rendering them do not query the database again.
+    
+    Accepts either a list of tasks or the sections built by regroup:
+    
+    {% prefetch_task_tags grouped_tasks %}
+    """
+    prefetch_tags(flatten_sections(tasks))
+    return ""
+
+
+def flatten_sections(tasks):
+    objects = []
+    for item in tasks:
+        if isinstance(item, dict):
+            objects.extend(item["list"])
+        else:
+            objects.append(item)
+    return objects
+
+
+class TaskVotesNode(template.Node):
+    def __init__(self, tasks, user):
+        self.tasks = template.Variable(tasks)
+        self.user = template.Variable(user)
+    
+    def render(self, context):
+        try:
+            tasks = self.tasks.resolve(context)
+            user = self.user.resolve(context)
+        except template.VariableDoesNotExist:
+            return ""
+        context["task_scores"], context["user_votes"] = votes_for_objects(flatten_sections(tasks), user)
+        return ""
+
+
+@register.tag(name="load_task_votes")
+def load_task_votes(parser, token):
+    """
+    Loads the scores of a whole collection of tasks and the votes of the
+    given user on them into ``task_scores`` and ``user_votes``, ready for
+    dict_entry_for_item. Like prefetch_task_tags it accepts either a list of
+    tasks or the sections built by regroup, all sections share the result:
+    
+    {% load_task_votes grouped_tasks for request.user %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 4 or bits[2] != "for":
+        raise template.TemplateSyntaxError, "%r tag syntax is {%% %s tasks for user %%}" % (bits[0], bits[0])
+    return TaskVotesNode(bits[1], bits[3])
+
+
+@register.filter
+def open_count(counts, grouper):
+    """
+    Looks up the open task count of a task table section in the counts of
+    the dimension the table is grouped by (see TaskCount.counts_for).
+    """
+    if not counts:
+        return ""
+    if grouper is None:
+        key = ""
+    elif hasattr(grouper, "pk"):
+        key = str(grouper.pk)
+    else:
+        # state sections are grouped by their display name
+        key = workflow.REVERSE_STATE_CHOICES.get(grouper, grouper)
+    return counts.get(key, "")
+
+
+class CachedTaskRowNode(template.Node):
+    def __init__(self, nodelist, part, task, vote):
+        self.nodelist = nodelist
+        self.part = part
+        self.task = template.Variable(task)
+        self.vote = template.Variable(vote)
+    
+    def render(self, context):
+        task = self.task.resolve(context)
+        try:
+            vote = self.vote.resolve(context)
+        except template.VariableDoesNotExist:
+            vote = None
+        user = context.get("user")
+        key = fragments.row_key(self.part, task,
+            group = context.get("group"),
+            vote = vote,
+            authenticated = user is not None and user.is_authenticated(),
+        )
+        content = fragments.cache.get(key)
+        if content is None:
+            context.push()
+            context["csrf_token"] = fragments.CSRF_PLACEHOLDER
+            try:
+                content = self.nodelist.render(context)
+            finally:
+                context.pop()
+            fragments.cache.set(key, content, fragments.TASKS_ROW_CACHE_TIMEOUT)
+        return content.replace(fragments.CSRF_PLACEHOLDER, unicode(context.get("csrf_token") or ""))
+
+
+@register.tag(name="cached_task_row")
+def cached_task_row(parser, token):
+    """
+    Caches a part of a task table row, see tasks.fragments:
+    
+    {% cached_task_row "head" item vote %} ... {% endcached_task_row %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 4:
+        raise template.TemplateSyntaxError, "%r tag requires a part name, a task and a vote" % bits[0]
+    part = bits[1].strip("\"'")
+    nodelist = parser.parse(("endcached_task_row",))
+    parser.delete_first_token()
+    return CachedTaskRowNode(nodelist, part, bits[2], bits[3])
+
+
 class TasksForTagNode(template.Node):
     def __init__(self, tag, var_name, selection):
         self.tag = tag
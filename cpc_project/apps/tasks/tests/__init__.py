@@ -1,4 +1,10 @@
 from test_authentication import *
+from test_bulk import *
 from test_client import *
+from test_fragments import *
+from test_loaders import *
 from test_models import *
+from test_pagination import *
+from test_tagindex import *
+from test_transitions import *
 from test_workflow import *
\ No newline at end of file
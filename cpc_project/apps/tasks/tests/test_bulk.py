@@ -0,0 +1,91 @@
+from django.db.models.signals import post_save, pre_save
+from django.test import TestCase
+
+from django.contrib.auth.models import User
+
+from taggit.models import Tag
+
+from tasks import signals
+from tasks.bulk import create_tasks, insert_rows, new_tags, validate_tasks
+from tasks.models import Task, TaskCount, TaskHistory
+
+
+
+class TestBulkCreate(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        # the fixture tasks are loaded without counting them
+        TaskCount.objects.rebuild()
+        self.created = []
+        signals.tasks_created.connect(self.record)
+    
+    def tearDown(self):
+        signals.tasks_created.disconnect(self.record)
+    
+    def record(self, sender, **kwargs):
+        self.created.append(kwargs["tasks"])
+    
+    def test_validate(self):
+        tasks, errors = validate_tasks([
+            {"summary": "fine", "assignee": "joe", "tags": "one, two"},
+            {"summary": "", "assignee": "nobody"},
+            {"summary": "x" * 101, "tags": 3},
+            "not a task",
+        ], self.user_admin)
+        self.assertEquals(errors[0], None)
+        self.assertEquals(tasks[0][0].assignee.username, "joe")
+        self.assertEquals(tasks[0][1], ["one", "two"])
+        self.assertEquals(sorted(errors[1].keys()), ["assignee", "summary"])
+        self.assertEquals(sorted(errors[2].keys()), ["summary", "tags"])
+        self.assertEquals(errors[3].keys(), ["__all__"])
+    
+    def test_create(self):
+        tasks, errors = validate_tasks([
+            {"summary": "imported %s" % i, "assignee": "joe", "tags": ["imported", "batch%s" % (i % 2)]}
+            for i in range(5)
+        ], self.user_admin)
+        create_tasks(tasks, self.user_admin)
+        
+        imported = Task.objects.filter(summary__startswith="imported").order_by("pk")
+        self.assertEquals([task.pk for task in imported], [task.pk for task, tags in tasks])
+        self.assertEquals(sorted(tag.name for tag in imported[1].tags.all()), ["batch1", "imported"])
+        self.assertEquals(imported[0].detail_html_key != "", True)
+        
+        # every task has its first revision, a keyframe
+        for task in imported:
+            history = TaskHistory.objects.get(task=task)
+            self.assertTrue(history.keyframe)
+            self.assertEquals(history.tag_names, task.history_snapshot()["tags"])
+            self.assertEquals(history.owner, self.user_admin)
+        
+        # the open task counts match counting from scratch
+        self.assertEquals(TaskCount.objects.current(), TaskCount.objects.compute())
+        
+        # and a single signal was sent for the batch
+        self.assertEquals([len(batch) for batch in self.created], [5])
+    
+    def test_insert_rows_sends_no_signal(self):
+        saved = []
+        def record_save(sender, instance, **kwargs):
+            saved.append(instance)
+        pre_save.connect(record_save, sender=Task)
+        post_save.connect(record_save, sender=Task)
+        try:
+            tasks = insert_rows(Task, [Task(summary="inserted", creator=self.user_admin) for i in range(3)])
+        finally:
+            pre_save.disconnect(record_save, sender=Task)
+            post_save.disconnect(record_save, sender=Task)
+        self.assertEquals(saved, [])
+        self.assertEquals(Task.objects.filter(pk__in=[task.pk for task in tasks]).count(), 3)
+    
+    def test_new_tags(self):
+        Tag.objects.create(name="Taken")
+        Tag.objects.create(name="taken!")
+        tags = insert_rows(Tag, new_tags(["taken", "fresh", "Fresh"]))
+        self.assertEquals(
+            sorted((tag.name, tag.slug) for tag in tags),
+            [("Fresh", "fresh_1"), ("fresh", "fresh"), ("taken", "taken_2")],
+        )
+        self.assertEquals(Tag.objects.filter(pk__in=[tag.pk for tag in tags]).count(), 3)
@@ -1,7 +1,13 @@
 # coding: utf-8
+import json
+
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 
+from django.contrib.auth.models import User
+
+from tasks.models import Task
+
 
 # @@ docutils 0.6 omits the first header
 rst_markup = """
@@ -63,4 +69,128 @@ class TestAddForm(TestCase):
         #  checking for tag
         response = self.client.get(reverse("task_list"))
         self.assertContains(response, '<a rel="tag" href="/tasks/tag/test/">test</a>')
+
+
+class TestMiniListJson(TestCase):
+    fixtures = ["test_tasks.json"]
+    urls = "tasks.tests.tasks_urls"
+    
+    def setUp(self):
+        self.client.login(username="joe", password="test")
+    
+    def tearDown(self):
+        pass
+    
+    def test_conditional_get(self):
+        response = self.client.get(reverse("tasks_mini_list_json"))
+        self.failUnlessEqual(response.status_code, 200)
+        etag = response["ETag"]
+        data = json.loads(response.content)
+        
+        # unchanged, answered from the aggregate alone
+        response = self.client.get(reverse("tasks_mini_list_json"), HTTP_IF_NONE_MATCH=etag)
+        self.failUnlessEqual(response.status_code, 304)
+        
+        # a newly assigned task changes the answer
+        task = Task.objects.create(summary="polled", creator=User.objects.get(username="admin"),
+            assignee = User.objects.get(username="joe"),
+        )
+        response = self.client.get(reverse("tasks_mini_list_json"), HTTP_IF_NONE_MATCH=etag)
+        self.failUnlessEqual(response.status_code, 200)
+        self.assertEquals(json.loads(response.content)["count"], data["count"] + 1)
         
+        # and is the only one listed since the previous answer
+        response = self.client.get(reverse("tasks_mini_list_json"), {"since": data["latest"] or "2000-01-01T00:00:00.000000"})
+        self.assertEquals([item["id"] for item in json.loads(response.content)["tasks"]], [task.pk])
+    
+    def test_removed(self):
+        admin = User.objects.get(username="admin")
+        joe = User.objects.get(username="joe")
+        reassigned = Task.objects.create(summary="reassigned", creator=admin, assignee=joe)
+        deleted = Task.objects.create(summary="deleted", creator=admin, assignee=joe)
+        since = json.loads(self.client.get(reverse("tasks_mini_list_json")).content)["latest"]
+        
+        reassigned = Task.objects.get(pk=reassigned.pk)
+        reassigned.assignee = admin
+        reassigned.save()
+        deleted_id = deleted.pk
+        deleted.delete()
+        
+        data = json.loads(self.client.get(reverse("tasks_mini_list_json"), {"since": since}).content)
+        self.assertEquals(data["tasks"], [])
+        self.assertEquals(sorted(data["removed"]), sorted([reassigned.pk, deleted_id]))
+    
+    def test_invalid_since(self):
+        response = self.client.get(reverse("tasks_mini_list_json"), {"since": "yesterday"})
+        self.failUnlessEqual(response.status_code, 400)
+
+
+class TestTaskFeed(TestCase):
+    fixtures = ["test_tasks.json"]
+    urls = "tasks.tests.tasks_urls"
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username="admin")
+    
+    def tearDown(self):
+        pass
+    
+    def change(self, summary, **kwargs):
+        task = Task.objects.create(summary=summary, creator=self.user_admin, **kwargs)
+        task.save_history()
+        return task
+    
+    def test_conditional_get(self):
+        self.change("first change")
+        response = self.client.get(reverse("tasks_feed", args=["all"]))
+        self.failUnlessEqual(response.status_code, 200)
+        self.assertContains(response, "first change")
+        etag = response["ETag"]
+        
+        # unchanged, answered from the aggregate alone
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("tasks_feed", args=["all"]), HTTP_IF_NONE_MATCH=etag)
+        self.failUnlessEqual(response.status_code, 304)
+        
+        # a polling reader without the etag gets the cached feed
+        content = self.client.get(reverse("tasks_feed", args=["all"])).content
+        self.assertEquals(content, self.client.get(reverse("tasks_feed", args=["all"])).content)
+        
+        # a new revision shows up right away
+        self.change("second change")
+        response = self.client.get(reverse("tasks_feed", args=["all"]), HTTP_IF_NONE_MATCH=etag)
+        self.failUnlessEqual(response.status_code, 200)
+        self.assertContains(response, "second change")
+    
+    def test_narrower_feeds(self):
+        joe = User.objects.get(username="joe")
+        self.change("assigned to joe", assignee=joe)
+        self.change("tagged").tags.add("feedtag")
+        self.change("neither")
+        
+        response = self.client.get(reverse("tasks_feed", args=["assignee", "joe"]))
+        self.assertContains(response, "assigned to joe")
+        self.assertNotContains(response, "neither")
+        
+        response = self.client.get(reverse("tasks_feed", args=["tag", "feedtag"]))
+        self.assertContains(response, "<entry>", count=1)
+        self.assertContains(response, "tagged")
+        
+        response = self.client.get(reverse("tasks_feed", args=["assignee", "nobody"]))
+        self.failUnlessEqual(response.status_code, 404)
+    
+    def test_entries_are_shared(self):
+        """
+        Entries rendered for one feed are reused by the others: the feeds
+        of the same revisions only look up their ids (after the user and
+        the aggregate).
+        """
+        self.change("shared", assignee=User.objects.get(username="joe"))
+        self.client.get(reverse("tasks_feed", args=["all"]))
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("tasks_feed", args=["assignee", "joe"]))
+        self.assertContains(response, "shared")
+    
+    def test_unknown_feed(self):
+        response = self.client.get(reverse("tasks_feed", args=["nothing"]))
+        self.failUnlessEqual(response.status_code, 404)
@@ -0,0 +1,42 @@
+# coding: utf-8
+from django.test import TestCase
+
+from django.contrib.auth.models import User
+
+from voting.models import Vote
+
+from tasks import fragments
+from tasks.models import Task
+
+
+
+class TestRowKey(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.task = Task.objects.create(summary="cached", creator=self.user_admin)
+    
+    def tearDown(self):
+        pass
+    
+    def key(self, **kwargs):
+        # fresh instance, the row version is memoized on the task
+        return fragments.row_key("head", Task.objects.get(pk=self.task.pk), **kwargs)
+    
+    def test_stable(self):
+        self.assertEquals(self.key(), self.key())
+        self.assertNotEquals(self.key(), self.key(authenticated=True))
+    
+    def test_invalidated_on_change(self):
+        key = self.key()
+        self.task.tags.add("fragments")
+        self.assertNotEquals(key, self.key())
+        
+        key = self.key()
+        Vote.objects.record_vote(self.task, self.user_admin, 1)
+        self.assertNotEquals(key, self.key())
+        
+        key = self.key()
+        fragments.invalidate_task_row(self.task.pk)
+        self.assertNotEquals(key, self.key())
@@ -0,0 +1,210 @@
+# coding: utf-8
+from django.test import TestCase
+
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.contrib.contenttypes.models import ContentType
+
+from voting.models import Vote
+
+from tasks.loaders import group_by_tag, load_history, prefetch_tags, user_task_lists, votes_for_objects
+from tasks.models import Nudge, Task, TaskHistory
+
+
+
+class TestGroupByTag(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        # the content type lookup is cached after the first call, warm it so
+        # it does not count against the queries made while grouping.
+        ContentType.objects.get_for_model(Task)
+    
+    def tearDown(self):
+        pass
+    
+    def create_tagged_tasks(self, count, tags_per_task):
+        for i in range(count):
+            task = Task.objects.create(summary="tagged %s" % i, creator=self.user_admin)
+            task.tags.add(*["tag%s-%s" % (i, j) for j in range(tags_per_task)])
+            task.tags.add("shared")
+    
+    def test_sections(self):
+        self.create_tagged_tasks(3, 2)
+        grouped = group_by_tag(Task.objects.all())
+        
+        groupers = [section["grouper"].name for section in grouped]
+        self.assertEquals(groupers, sorted(groupers))
+        
+        # every tagged task shows up in the shared section
+        shared = [section for section in grouped if section["grouper"].name == "shared"][0]
+        self.assertEquals(len(shared["list"]), 3)
+        
+        # and the sections match what a per tag query returns
+        for section in grouped:
+            expected = Task.objects.filter(tags__name__in=[section["grouper"].name])
+            self.assertEquals(
+                sorted(task.pk for task in section["list"]),
+                sorted(task.pk for task in expected),
+            )
+    
+    def test_query_count_is_flat(self):
+        """
+        Grouping costs one query for the tasks and one for their tags no
+        matter how many tags there are.
+        """
+        self.create_tagged_tasks(2, 2)
+        self.assertNumQueries(2, group_by_tag, Task.objects.all())
+        
+        self.create_tagged_tasks(20, 10)
+        self.assertNumQueries(2, group_by_tag, Task.objects.all())
+
+
+class TestPrefetchTags(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        ContentType.objects.get_for_model(Task)
+    
+    def tearDown(self):
+        pass
+    
+    def test_prefetch(self):
+        for i in range(5):
+            task = Task.objects.create(summary="tagged %s" % i, creator=self.user_admin)
+            task.tags.add("first%s" % i, "second%s" % i)
+        
+        tasks = list(Task.objects.all())
+        self.assertNumQueries(1, prefetch_tags, tasks)
+        
+        for task in tasks:
+            self.assertEquals(
+                [tag.name for tag in task.prefetched_tags],
+                sorted(tag.name for tag in task.tags.all()),
+            )
+        
+        # tasks that already carry their tags are not loaded again
+        self.assertNumQueries(0, prefetch_tags, tasks)
+
+
+class TestVotesForObjects(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        ContentType.objects.get_for_model(Task)
+    
+    def tearDown(self):
+        pass
+    
+    def test_votes(self):
+        tasks = [Task.objects.create(summary="voted %s" % i, creator=self.user_admin) for i in range(3)]
+        Vote.objects.record_vote(tasks[0], self.user_admin, 1)
+        Vote.objects.record_vote(tasks[1], self.user_admin, -1)
+        
+        # a task listed in several sections is only looked up once
+        self.assertNumQueries(2, votes_for_objects, tasks + tasks[:2], self.user_admin)
+        scores, user_votes = votes_for_objects(tasks + tasks[:2], self.user_admin)
+        self.assertEquals(scores, Vote.objects.get_scores_in_bulk(tasks))
+        self.assertEquals(sorted(user_votes.keys()), [tasks[0].pk, tasks[1].pk])
+        self.assertTrue(user_votes[tasks[0].pk].is_upvote())
+        
+        # anonymous users have no votes to look up
+        self.assertNumQueries(1, votes_for_objects, tasks, AnonymousUser())
+
+
+class TestUserTaskLists(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.user_joe = User.objects.get(username__exact="joe")
+    
+    def tearDown(self):
+        pass
+    
+    def test_lists(self):
+        mine = Task.objects.create(summary="mine", creator=self.user_joe, assignee=self.user_joe)
+        assigned = Task.objects.create(summary="assigned", creator=self.user_admin, assignee=self.user_joe, state="4")
+        created = Task.objects.create(summary="created", creator=self.user_joe, assignee=self.user_admin)
+        closed = Task.objects.create(summary="closed", creator=self.user_joe, state="3")
+        Task.objects.create(summary="unrelated", creator=self.user_admin)
+        Nudge.objects.toggle(assigned, self.user_admin)
+        Nudge.objects.toggle(created, self.user_joe)
+        
+        # leaving out the tasks of the fixture
+        tasks = Task.objects.filter(object_id=None, pk__gte=mine.pk)
+        states = {"assigned": None, "created": ["1", "4"], "nudged": None}
+        self.assertNumQueries(1, user_task_lists, tasks, self.user_joe, states)
+        lists = user_task_lists(tasks, self.user_joe, states)
+        
+        self.assertEquals([task.pk for task in lists["assigned"]], [mine.pk, assigned.pk])
+        self.assertEquals([task.pk for task in lists["created"]], [created.pk, mine.pk])
+        self.assertEquals([task.pk for task in lists["nudged"]], [assigned.pk])
+        self.assertEquals(lists["nudged"][0].roles, set(["assigned", "nudged"]))
+        
+        states["created"] = None
+        lists = user_task_lists(tasks, self.user_joe, states)
+        self.assertTrue(closed.pk in [task.pk for task in lists["created"]])
+        
+        # the nudged tasks are among the assigned ones shown
+        states["assigned"] = ["1"]
+        lists = user_task_lists(tasks, self.user_joe, states)
+        self.assertEquals(lists["nudged"], [])
+
+
+class TestLoadHistory(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.user_joe = User.objects.get(username__exact="joe")
+        self.group = Group.objects.create(name="history")
+        ContentType.objects.get_for_model(Group)
+        TaskHistory.objects.all().delete()
+    
+    def tearDown(self):
+        pass
+    
+    def create_history(self, count):
+        for i in range(count):
+            task = Task.objects.create(summary="history %s" % i, creator=self.user_admin, assignee=self.user_joe)
+            task.tags.add("history%s" % i)
+            task.save_history(change_owner=self.user_admin)
+            task.status = "changed"
+            task.save()
+            task.save_history(change_owner=self.user_joe)
+            if i % 2:
+                # attaching the task itself would need a group app
+                task.history_task.update(
+                    content_type = ContentType.objects.get_for_model(Group),
+                    object_id = self.group.pk,
+                )
+    
+    def render(self, histories):
+        # everything the history list template looks at
+        return [
+            (h.task.id, h.owner.username, h.assignee.username, list(h.prefetched_tags), h.group)
+            for h in load_history(histories)
+        ]
+    
+    def test_query_count_is_flat(self):
+        """
+        Loading a page costs the same number of queries however many rows
+        it has: the rows, the keyframes and revisions deltas are resolved
+        from, the assignees deltas did not store and the groups.
+        """
+        self.create_history(2)
+        self.assertNumQueries(5, self.render, TaskHistory.objects.all())
+        
+        self.create_history(20)
+        self.assertNumQueries(5, self.render, TaskHistory.objects.all())
+    
+    def test_groups(self):
+        self.create_history(3)
+        histories = load_history(TaskHistory.objects.order_by("pk"))
+        for history in histories:
+            self.assertEquals(history.group, TaskHistory.objects.get(pk=history.pk).group)
+            self.assertEquals(history.prefetched_tags, [history.task.tags.get().name])
+        self.assertEquals([h.group for h in histories][:4], [None, None, self.group, self.group])
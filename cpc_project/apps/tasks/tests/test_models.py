@@ -1,9 +1,11 @@
 # coding: utf-8
+from django.db.models.signals import post_save
 from django.test import TestCase
 
 from django.contrib.auth.models import User
 
-from pinax.apps.tasks.models import Task, TaskHistory, Nudge
+from tasks.models import Task, TaskHistory, TaskCount, Nudge, DeletedTask
+from tasks.models import TASKS_HISTORY_KEYFRAME_INTERVAL
 
 
 
@@ -76,6 +78,58 @@ class TestTask(TestCase):
         self.assertEquals(len(self.other_task.task_nudge.all()), self.other_task_nudge_count)
 
 
+
+class TestNudge(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.user_joe = User.objects.get(username__exact="joe")
+        self.task = Task.objects.create(summary="nudged", creator=self.user_admin, assignee=self.user_joe)
+    
+    def tearDown(self):
+        pass
+    
+    def nudge_count(self):
+        return Task.objects.get(pk=self.task.pk).nudge_count
+    
+    def test_toggle(self):
+        self.assertEquals(Nudge.objects.toggle(self.task, self.user_admin), (True, 1))
+        self.assertEquals(Nudge.objects.toggle(self.task, self.user_joe), (True, 2))
+        self.assertEquals(self.nudge_count(), 2)
+        
+        self.assertEquals(Nudge.objects.toggle(self.task, self.user_admin), (False, 1))
+        self.assertEquals(self.nudge_count(), 1)
+        self.assertEquals(list(self.task.task_nudge.values_list("nudger", flat=True)), [self.user_joe.pk])
+    
+    def test_save_keeps_count(self):
+        stale = Task.objects.get(pk=self.task.pk)
+        Nudge.objects.toggle(self.task, self.user_admin)
+        stale.status = "saved with an old nudge count"
+        stale.save()
+        self.assertEquals(self.nudge_count(), 1)
+    
+    def test_save_leaves_attribute(self):
+        Nudge.objects.toggle(self.task, self.user_admin)
+        seen = []
+        def record(sender, instance, **kwargs):
+            seen.append(instance.nudge_count)
+        post_save.connect(record, sender=Task)
+        try:
+            self.task.save()
+        finally:
+            post_save.disconnect(record, sender=Task)
+        self.assertEquals(seen, [1])
+    
+    def test_denudge(self):
+        Nudge.objects.toggle(self.task, self.user_admin)
+        Nudge.objects.toggle(self.task, self.user_joe)
+        self.assertNumQueries(2, self.task.denudge)
+        self.assertEquals(self.task.nudge_count, 0)
+        self.assertEquals(self.nudge_count(), 0)
+        self.assertEquals(self.task.task_nudge.count(), 0)
+
+
 class TestTaskHistory(TestCase):
     fixtures = ["test_tasks.json"]
     
@@ -123,3 +177,169 @@ class TestTaskHistory(TestCase):
         
         # the person who made the change was joe
         self.assertEquals(history.owner, self.user_joe)
+    
+    def test_delete_leaves_tombstone(self):
+        task_id = self.task.pk
+        self.task.delete()
+        
+        self.assertEquals(TaskHistory.objects.filter(task=task_id).count(), 0)
+        self.assertEquals(list(DeletedTask.objects.values_list("task_id", flat=True)), [task_id])
+
+
+
+class TestTaskHistoryDeltas(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.user_joe = User.objects.get(username__exact="joe")
+        self.task = Task.objects.create(summary="history", detail="a long detail", creator=self.user_admin)
+        self.task.save_history()
+    
+    def tearDown(self):
+        pass
+    
+    def change(self, **kwargs):
+        for field, value in kwargs.items():
+            setattr(self.task, field, value)
+        self.task.save()
+        self.task.save_history(change_owner=self.user_admin)
+    
+    def test_only_changes_stored(self):
+        self.change(assignee=self.user_joe)
+        self.task.tags.add("delta")
+        self.change(status="working on it")
+        
+        first, second, third = TaskHistory.objects.filter(task=self.task).order_by("pk")
+        self.assertEquals(first.keyframe, True)
+        self.assertEquals(second.changed_fields, "assignee")
+        self.assertEquals(third.changed_fields, "tags,status")
+        self.assertEquals(third.detail, "")
+        
+        snapshot = third.snapshot()
+        self.assertEquals(snapshot["detail"], "a long detail")
+        self.assertEquals(snapshot["assignee"], self.user_joe.pk)
+        self.assertEquals(snapshot["tags"], ["delta"])
+        self.assertEquals(snapshot["status"], "working on it")
+        self.assertEquals(second.snapshot()["status"], "")
+    
+    def test_resolve(self):
+        self.change(summary="renamed")
+        self.change(state="4", assignee=self.user_joe)
+        
+        histories = list(TaskHistory.objects.filter(task=self.task).order_by("-pk"))
+        self.assertNumQueries(2, TaskHistory.objects.resolve, histories)
+        self.assertEquals(
+            [(h.summary, h.state, h.assignee_id, h.detail) for h in histories], [
+            ("renamed", "4", self.user_joe.pk, "a long detail"),
+            ("renamed", "1", None, "a long detail"),
+            ("history", "1", None, "a long detail"),
+        ])
+    
+    def test_keyframe_interval(self):
+        for i in range(TASKS_HISTORY_KEYFRAME_INTERVAL):
+            self.change(status="step %s" % i)
+        keyframes = TaskHistory.objects.filter(task=self.task, keyframe=True).count()
+        self.assertEquals(keyframes, 2)
+        latest = TaskHistory.objects.filter(task=self.task).latest("pk")
+        self.assertEquals(latest.snapshot()["status"], "step %s" % (TASKS_HISTORY_KEYFRAME_INTERVAL - 1))
+
+
+class TestTaskCount(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.user_joe = User.objects.get(username__exact="joe")
+        TaskCount.objects.rebuild()
+    
+    def tearDown(self):
+        pass
+    
+    def assertCountsMatch(self):
+        self.assertEquals(TaskCount.objects.current(), TaskCount.objects.compute())
+    
+    def test_counts_follow_changes(self):
+        task = Task.objects.create(summary="counted", creator=self.user_admin)
+        task.tags.add("counted")
+        self.assertCountsMatch()
+        
+        counts = TaskCount.objects.counts_for(None)
+        tag = task.tags.all()[0]
+        self.assertEquals(counts["tag"][str(tag.pk)], 1)
+        
+        # assigning moves the task between assignee counts
+        task.assignee = self.user_joe
+        task.save()
+        self.assertCountsMatch()
+        self.assertEquals(TaskCount.objects.counts_for(None)["assignee"][str(self.user_joe.pk)],
+            Task.objects.filter(assignee=self.user_joe, object_id=None).exclude(state__in=["2", "3"]).count())
+        
+        # closing the task removes it from every count, tags included
+        task.state = "3"
+        task.save()
+        self.assertCountsMatch()
+        self.assertEquals(TaskCount.objects.counts_for(None)["tag"].get(str(tag.pk), 0), 0)
+        
+        # and reopening it (through a freshly loaded instance) adds it back
+        task = Task.objects.get(pk=task.pk)
+        task.state = "1"
+        task.save()
+        self.assertCountsMatch()
+        
+        task.delete()
+        self.assertCountsMatch()
+    
+    def test_tags_counted(self):
+        task = Task.objects.create(summary="tagged", creator=self.user_admin)
+        task.tags.add("one", "two")
+        self.assertCountsMatch()
+        task.tags.remove("one")
+        self.assertCountsMatch()
+        task.tags.set("three")
+        self.assertCountsMatch()
+    
+    def test_deferred_instances(self):
+        task = Task.objects.create(summary="deferred", creator=self.user_admin, assignee=self.user_joe)
+        task.tags.add("deferred")
+        
+        task = Task.objects.defer("state", "assignee").get(pk=task.pk)
+        task.summary = "still counted once"
+        task.save()
+        self.assertCountsMatch()
+        
+        Task.objects.defer("state").get(pk=task.pk).delete()
+        self.assertCountsMatch()
+
+
+class TestRenderedDetail(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+    
+    def tearDown(self):
+        pass
+    
+    def test_rendered_on_save(self):
+        task = Task.objects.create(summary="rendered", detail="**bold**", markup="creole", creator=self.user_admin)
+        self.assertEquals(task.detail_html.strip(), "<p><b>bold</b></p>")
+        
+        # saving again without changes does not render again
+        self.assertEquals(task.render_detail(), False)
+        
+        task.detail = "//italic//"
+        task.save()
+        self.assertEquals(Task.objects.get(pk=task.pk).rendered_detail.strip(), "<p><i>italic</i></p>")
+    
+    def test_stale_rendered_on_the_fly(self):
+        task = Task.objects.create(summary="rendered", detail="**bold**", markup="creole", creator=self.user_admin)
+        Task.objects.filter(pk=task.pk).update(detail="//italic//")
+        task = Task.objects.get(pk=task.pk)
+        self.assertEquals(task.detail_html.strip(), "<p><b>bold</b></p>")
+        self.assertEquals(task.rendered_detail.strip(), "<p><i>italic</i></p>")
+    
+    def test_non_ascii_detail(self):
+        task = Task.objects.create(summary="rendered", detail=u"**caf\xe9**", markup=u"creole", creator=self.user_admin)
+        self.assertEquals(task.detail_html.strip(), u"<p><b>caf\xe9</b></p>")
+        self.assertEquals(Task.objects.get(pk=task.pk).detail_html.strip(), u"<p><b>caf\xe9</b></p>")
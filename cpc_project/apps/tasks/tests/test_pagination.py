@@ -0,0 +1,120 @@
+# coding: utf-8
+import datetime
+
+from django.test import TestCase
+
+from django.contrib.auth.models import User
+
+from tasks.models import Nudge, Task, TaskHistory
+from tasks.pagination import paginate, decode_cursor, merge_streams, paginate_timeline
+
+
+
+class TestKeysetPagination(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        Task.objects.all().delete()
+        
+        # several tasks share a modified date to exercise the id tie breaker
+        modified = datetime.datetime(2011, 1, 1)
+        for i in range(23):
+            task = Task.objects.create(summary="task %s" % i, creator=self.user_admin)
+            Task.objects.filter(pk=task.pk).update(modified=modified + datetime.timedelta(hours=i // 3))
+        
+        self.expected = list(Task.objects.order_by("-modified", "-id").values_list("id", flat=True))
+    
+    def tearDown(self):
+        pass
+    
+    def ids(self, page):
+        return [task.id for task in page.object_list]
+    
+    def test_walk_forward_and_back(self):
+        pages = [paginate(Task.objects.all(), None, 5)]
+        while pages[-1].has_next():
+            pages.append(paginate(Task.objects.all(), pages[-1].next_cursor, 5))
+        
+        self.assertEquals(len(pages), 5)
+        self.assertFalse(pages[0].has_previous())
+        self.assertEquals(sum([self.ids(page) for page in pages], []), self.expected)
+        
+        # walking back from the last page gives the same pages
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = paginate(Task.objects.all(), page.previous_cursor, 5)
+            self.assertEquals(self.ids(page), self.ids(expected))
+        self.assertFalse(page.has_previous())
+    
+    def test_filtered_queryset(self):
+        Task.objects.filter(pk__in=self.expected[:10]).update(state="2")
+        page = paginate(Task.objects.exclude(state="2"), None, 5)
+        self.assertEquals(self.ids(page), self.expected[10:15])
+        page = paginate(Task.objects.exclude(state="2"), page.next_cursor, 5)
+        self.assertEquals(self.ids(page), self.expected[15:20])
+    
+    def test_invalid_cursor(self):
+        self.assertEquals(decode_cursor("not a cursor"), None)
+        page = paginate(Task.objects.all(), "not a cursor", 5)
+        self.assertEquals(self.ids(page), self.expected[:5])
+
+
+class TestTimelinePagination(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.task = Task.objects.create(summary="timeline", creator=self.user_admin)
+        
+        # history and nudges interleaved, sharing some modified dates
+        modified = datetime.datetime(2011, 1, 1)
+        for i in range(12):
+            self.task.save_history()
+            history = TaskHistory.objects.latest("pk")
+            TaskHistory.objects.filter(pk=history.pk).update(modified=modified + datetime.timedelta(hours=i // 2))
+        for i in range(9):
+            nudger = User.objects.create(username="nudger%s" % i)
+            Nudge.objects.create(task=self.task, nudger=nudger, modified=modified + datetime.timedelta(hours=i))
+        
+        events = [(h.modified, 0, h.pk) for h in TaskHistory.objects.filter(task=self.task)]
+        events.extend((n.modified, 1, n.pk) for n in Nudge.objects.filter(task=self.task))
+        self.expected = [(stream, pk) for modified, stream, pk in sorted(events, reverse=True)]
+    
+    def tearDown(self):
+        pass
+    
+    def querysets(self):
+        return [TaskHistory.objects.filter(task=self.task), Nudge.objects.filter(task=self.task)]
+    
+    def events(self, page):
+        return [(isinstance(item, Nudge) and 1 or 0, item.pk) for item in page.object_list]
+    
+    def test_walk_forward_and_back(self):
+        pages = [paginate_timeline(self.querysets(), None, 4)]
+        while pages[-1].has_next():
+            pages.append(paginate_timeline(self.querysets(), pages[-1].next_cursor, 4))
+        
+        self.assertEquals(len(pages), 6)
+        self.assertEquals(sum([self.events(page) for page in pages], []), self.expected)
+        
+        page = pages[-1]
+        walked = self.events(page)
+        while page.has_previous():
+            page = paginate_timeline(self.querysets(), page.previous_cursor, 4)
+            walked = self.events(page) + walked
+        self.assertEquals(walked, self.expected)
+    
+    def test_merge_is_lazy(self):
+        consumed = []
+        def stream(items):
+            for item in items:
+                consumed.append(item)
+                yield item
+        merged = merge_streams([
+            stream(TaskHistory.objects.filter(task=self.task).order_by("-modified", "-pk")),
+            stream(Nudge.objects.filter(task=self.task).order_by("-modified", "-pk")),
+        ])
+        merged.next()
+        # the head of each stream only
+        self.assertEquals(len(consumed), 2)
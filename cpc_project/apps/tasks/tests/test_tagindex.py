@@ -0,0 +1,72 @@
+from django.test import TestCase
+
+from django.contrib.auth.models import User
+
+from taggit.models import Tag
+
+from tasks import tagindex
+from tasks.models import Task
+from tasks.tagindex import TagIndex
+
+
+
+class TestTagIndex(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+    
+    def tearDown(self):
+        pass
+    
+    def test_suggest(self):
+        index = TagIndex([
+            ("Django", 3), ("django-filter", 10), ("docs", 1), ("dj", 0), ("python", 7),
+        ], limit=3)
+        # most used first, whatever the case
+        self.assertEquals(index.suggest("d"), ["django-filter", "Django", "docs"])
+        self.assertEquals(index.suggest("DJ"), ["django-filter", "Django", "dj"])
+        self.assertEquals(index.suggest("djan"), ["django-filter", "Django"])
+        self.assertEquals(index.suggest("django-"), ["django-filter"])
+        self.assertEquals(index.suggest(""), ["django-filter", "python", "Django"])
+        self.assertEquals(index.suggest("x"), [])
+        self.assertEquals(index.suggest("xyz"), [])
+    
+    def test_refresh(self):
+        task = Task.objects.create(summary="tagged", creator=self.user_admin)
+        task.tags.add("indexed")
+        self.assertTrue("indexed" in tagindex.get_index().suggest("index"))
+        
+        # tags changes show up in the next lookup
+        Tag.objects.create(name="indexer")
+        self.assertTrue("indexer" in tagindex.get_index().suggest("index"))
+        
+        # which can be limited to the tags used on tasks
+        self.assertEquals(tagindex.get_index(tasks_only=True).suggest("index"), ["indexed"])
+        
+        # and is not rebuilt when nothing changed
+        self.assertNumQueries(0, tagindex.get_index)
+    
+    def test_tagging_keeps_index(self):
+        task = Task.objects.create(summary="tagged", creator=self.user_admin)
+        task.tags.add("kept")
+        index = tagindex.get_index()
+        
+        # using or dropping existing tags only moves their usage counts
+        other = Task.objects.create(summary="also tagged", creator=self.user_admin)
+        other.tags.add("kept")
+        task.tags.clear()
+        self.assertTrue(tagindex.get_index() is index)
+        
+        # which are caught up with once the index is old enough
+        built = tagindex._indexes[tagindex.TASKS_TAG_AUTOCOMPLETE_TASKS_ONLY]
+        tagindex._indexes[tagindex.TASKS_TAG_AUTOCOMPLETE_TASKS_ONLY] = (
+            built[0], built[1], built[2] - tagindex.TASKS_TAG_INDEX_MAX_AGE - 1
+        )
+        self.assertTrue(tagindex.get_index() is not index)
+        
+        # deleting a tag is seen right away
+        index = tagindex.get_index()
+        Tag.objects.get(name="kept").delete()
+        self.assertTrue(tagindex.get_index() is not index)
+        self.assertEquals(tagindex.get_index().suggest("kept"), [])
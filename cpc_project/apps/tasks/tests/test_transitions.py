@@ -0,0 +1,130 @@
+# coding: utf-8
+import csv
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from django.contrib.auth.models import Group
+from django.contrib.auth.models import User
+
+from tasks import exports, models
+from tasks.models import Task
+from tasks.transitions import TransitionIndex
+from tasks.workflow import OR, always, is_assignee, is_task_manager
+from tasks.workflow import TASK_MANAGER
+
+
+
+class TestTransitionIndex(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.user_joe = User.objects.get(username__exact="joe")
+        self.group = Group.objects.create(name=TASK_MANAGER)
+        self.group.user_set.add(self.user_admin)
+        
+        self.calls = []
+        def counted(predicate):
+            def wrapper(task, user):
+                self.calls.append(predicate.__name__)
+                return predicate(task, user)
+            wrapper.__name__ = predicate.__name__
+            wrapper.user_only = getattr(predicate, "user_only", False)
+            return wrapper
+        self.is_assignee = counted(is_assignee)
+        self.is_task_manager = counted(is_task_manager)
+        self.index = TransitionIndex([
+            (4, 4, always, "still in progress"),
+            (4, 5, self.is_assignee, "discussion needed"),
+            (4, 6, self.is_task_manager, "blocked"),
+            (4, 8, OR(self.is_assignee, self.is_task_manager), "fix needs review"),
+            (4, 2, self.is_task_manager, "resolved"),
+        ])
+    
+    def tearDown(self):
+        pass
+    
+    def create_task(self, assignee=None):
+        return Task.objects.create(summary="in progress", state="4",
+            creator = self.user_admin,
+            assignee = assignee,
+        )
+    
+    def test_predicates_evaluated_once(self):
+        task = self.create_task(assignee=self.user_joe)
+        self.assertEquals(self.index.allowable_states(task, self.user_joe), [
+            ("4", "still in progress"),
+            ("5", "discussion needed"),
+            ("8", "fix needs review"),
+        ])
+        self.assertEquals(sorted(self.calls), ["is_assignee", "is_task_manager"])
+    
+    def test_batch(self):
+        tasks = [self.create_task(assignee=self.user_joe) for i in range(3)]
+        tasks.append(self.create_task())
+        states = self.index.allowable_states_for(tasks, self.user_admin)
+        
+        for task in tasks:
+            self.assertEquals(states[task.pk], self.index.allowable_states(task, self.user_admin))
+        self.assertEquals([state for state, description in states[tasks[0].pk]], ["4", "6", "8", "2"])
+        
+        # the task manager check only depends on the user
+        self.calls = []
+        self.index.allowable_states_for(tasks, self.user_admin)
+        self.assertEquals(self.calls.count("is_task_manager"), 1)
+        self.assertEquals(self.calls.count("is_assignee"), 4)
+    
+    def test_or_name(self):
+        self.assertEquals(OR(is_assignee, is_task_manager).__name__, "is_assignee_or_is_task_manager")
+
+
+class TestExports(TestCase):
+    urls = "tasks.tests.tasks_urls"
+    
+    def setUp(self):
+        self.workflow = type("workflow", (object,), {
+            "STATE_CHOICES": (("1", "new"), ("2", 'say "done"')),
+            "STATE_TRANSITIONS": [
+                (1, 2, OR(is_assignee, is_task_manager), "resolve"),
+                (2, 1, always, "re-open"),
+            ],
+        })
+    
+    def tearDown(self):
+        pass
+    
+    def test_formats(self):
+        rows = list(csv.reader(exports.render(self.workflow, "csv").splitlines()))
+        self.assertEquals(rows, [
+            ["new", 'say "done"', "is_assignee_or_is_task_manager", "resolve"],
+            ['say "done"', "new", "always", "re-open"],
+        ])
+        
+        data = json.loads(exports.render(self.workflow, "json"))
+        self.assertEquals([state["name"] for state in data["states"]], ["new", 'say "done"'])
+        self.assertEquals(data["transitions"][0], {
+            "from": "1", "to": "2", "permission": "is_assignee_or_is_task_manager", "name": "resolve",
+        })
+        
+        dot = exports.render(self.workflow, "dot")
+        self.assertTrue('"2" [label="say \\"done\\""];' in dot)
+        self.assertTrue('"2" -> "1" [label="re-open (always)"];' in dot)
+    
+    def test_conditional_get(self):
+        url = reverse("tasks_export_state_transitions", kwargs={"format": "json"})
+        response = self.client.get(url)
+        self.failUnlessEqual(response.status_code, 200)
+        self.failUnlessEqual(response["Content-Type"], "application/json")
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.failUnlessEqual(response.status_code, 304)
+    
+    def test_compiled_once(self):
+        compiled = exports.compile_exports(self.workflow)
+        self.assertTrue(exports.compile_exports(self.workflow) is compiled)
+        self.assertEquals(compiled["csv"].content, exports.render(self.workflow, "csv"))
+        
+        # the configured workflow hands out the exports the view serves
+        self.assertTrue(models.workflow.export_state_transitions("json") is models.exports["json"])
@@ -1,14 +1,15 @@
 # coding: utf-8
 from django.test import TestCase
 
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import AnonymousUser, Group
 from django.contrib.auth.models import User
 
-from pinax.apps.tasks.models import Task
-from pinax.apps.tasks.workflow import always, is_assignee, is_assignee_or_none
-from pinax.apps.tasks.workflow import is_creator, no_assignee, is_task_manager
-from pinax.apps.tasks.workflow import OR
-from pinax.apps.tasks.workflow import TASK_MANAGER
+from tasks.models import Task
+from tasks.permissions import is_group_member
+from tasks.workflow import always, is_assignee, is_assignee_or_none
+from tasks.workflow import is_creator, no_assignee, is_task_manager
+from tasks.workflow import OR
+from tasks.workflow import TASK_MANAGER
 
 
 
@@ -84,3 +85,31 @@ class TestWorkflowFunctions(TestCase):
         self.assertEquals(True, OR(is_creator, is_assignee)(self.task, self.user_joe))
         self.assertEquals(False, OR(is_creator, is_assignee)(self.task, None))
         self.assertEquals(False, OR(is_creator, is_assignee)(self.task, self.user_sam))
+
+
+class TestPermissionCache(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_joe = User.objects.get(username__exact="joe")
+        self.task = Task.objects.create(summary="cached", creator=self.user_joe)
+        self.group = Group.objects.create(name=TASK_MANAGER)
+    
+    def tearDown(self):
+        pass
+    
+    def test_task_manager_looked_up_once(self):
+        self.assertNumQueries(1, is_task_manager, self.task, self.user_joe)
+        self.assertNumQueries(0, is_task_manager, self.task, self.user_joe)
+        self.assertEquals(False, is_task_manager(self.task, self.user_joe))
+    
+    def test_invalidated_on_group_change(self):
+        self.assertEquals(False, is_task_manager(self.task, self.user_joe))
+        self.user_joe.groups.add(self.group)
+        self.assertEquals(True, is_task_manager(self.task, self.user_joe))
+        self.user_joe.groups.clear()
+        self.assertEquals(False, is_task_manager(self.task, self.user_joe))
+    
+    def test_anonymous_not_a_member(self):
+        self.assertEquals(False, is_group_member(None, AnonymousUser()))
+        self.assertEquals(True, is_group_member(None, self.user_joe))
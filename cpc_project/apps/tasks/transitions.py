@@ -0,0 +1,66 @@
+"""
+The STATE_TRANSITIONS of a workflow module compiled into an index keyed by
+current state.
+
+Permission predicates are evaluated lazily and at most once per task and
+user: predicates combined with OR share the results of their parts, and
+predicates flagged ``user_only`` (they only look at the user, like
+is_task_manager) are evaluated once per user across a whole batch of tasks.
+"""
+
+
+
+def evaluate(predicate, task, user, memo, user_memo):
+    if getattr(predicate, "user_only", False):
+        results = user_memo
+    else:
+        results = memo
+    if predicate not in results:
+        parts = getattr(predicate, "predicates", None)
+        if parts is not None:
+            # OR: stops at the first part allowing the transition
+            results[predicate] = any(evaluate(part, task, user, memo, user_memo) for part in parts)
+        else:
+            results[predicate] = bool(predicate(task, user))
+    return results[predicate]
+
+
+class TransitionIndex(object):
+    
+    def __init__(self, transitions):
+        # state -> [(new state, description, predicate), ...] in the order
+        # of the workflow, states are strings like the ones stored on tasks
+        self.by_state = {}
+        for current_state, new_state, predicate, description in transitions:
+            self.by_state.setdefault(str(current_state), []).append(
+                (str(new_state), description, predicate)
+            )
+    
+    def allowable_states(self, task, user, user_memo=None):
+        """
+        Returns the (state, description) choices allowed for ``user`` given
+        the current state of ``task``.
+        """
+        memo = {}
+        if user_memo is None:
+            user_memo = memo
+        choices = []
+        for new_state, description, predicate in self.by_state.get(task.state, []):
+            if evaluate(predicate, task, user, memo, user_memo):
+                choices.append((new_state, description))
+        return choices
+    
+    def allowable_states_for(self, tasks, user):
+        """
+        Returns a dictionary mapping the primary key of each task to its
+        allowable states for ``user``.
+        """
+        user_memo = {}
+        return dict(
+            (task.pk, self.allowable_states(task, user, user_memo))
+            for task in tasks
+        )
+
+
+def compile_workflow(workflow):
+    return TransitionIndex(workflow.STATE_TRANSITIONS)
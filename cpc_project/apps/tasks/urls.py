@@ -1,14 +1,9 @@
 from django.conf.urls.defaults import *
 
-#from tasks.feeds import AllTaskFeed
 from tasks.models import Task
 
 from voting.views import vote_on_object
 
-#tasks_feed_dict = {"feed_dict": {
-#    "all": AllTaskFeed,
-#}}
-
 
 urlpatterns = patterns("",
     url(r"^$", "tasks.views.tasks", name="task_list"),
@@ -18,11 +13,14 @@ urlpatterns = patterns("",
     url(r"^task/(?P<id>\d+)/$", "tasks.views.task", name="task_detail"),
     url(r"^tasks_for_user/(?P<username>[-\w]+)/$", "tasks.views.user_tasks", name="tasks_for_user"),
     url(r"^mini_list/$", "tasks.views.mini_list", name="tasks_mini_list"),
+    url(r"^mini_list/json/$", "tasks.views.mini_list_json", name="tasks_mini_list_json"),
     url(r"^history/$", "tasks.views.tasks_history_list", name="tasks_history_list"),
     url(r"^history/(?P<id>\d+)/$", "tasks.views.tasks_history", name="tasks_history"),
     url(r"^nudge/(?P<id>\d+)/$", "tasks.views.nudge", name="tasks_nudge"),
-    url(r"^export_state_transitions.csv$", "tasks.views.export_state_transitions", name="tasks_export_state_transitions"),
-    # url(r"^feeds/(.*)/$", "django.contrib.syndication.views.feed", tasks_feed_dict),
+    url(r"^summary/$", "tasks.views.summary", name="tasks_summary"),
+    url(r"^export_state_transitions\.(?P<format>csv|json|dot)$", "tasks.views.export_state_transitions", name="tasks_export_state_transitions"),
+    url(r"^feeds/(?P<slug>\w+)/$", "tasks.feeds.task_feed", name="tasks_feed"),
+    url(r"^feeds/(?P<slug>\w+)/(?P<param>[^/]+)/$", "tasks.feeds.task_feed", name="tasks_feed"),
     
     url(r"^tags/autocomplete/", "tasks.views.tags_autocomplete_source", name="tags_autocomplete_source"),
     
@@ -2,18 +2,19 @@ import datetime
 import json
 import urllib
 
-from itertools import chain
-from operator import attrgetter
-
+from django import forms
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, ImproperlyConfigured
 from django.core.urlresolvers import reverse
-from django.db.models import Q, get_app
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.db import transaction
+from django.db.models import Count, Max, Q, get_app
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, Http404
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
+from django.utils.hashcompat import md5_constructor
 from django.utils.importlib import import_module
 from django.utils.translation import ugettext
+from django.views.decorators.http import condition
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -32,12 +33,21 @@ else:
 
 from tasks.filters import TaskFilter
 from tasks.forms import TaskForm, EditTaskForm
-from tasks.models import Task, TaskHistory, Nudge
-from tasks import signals
+from tasks.loaders import group_by_tag, load_assignees, load_history, user_task_lists
+from tasks.models import Task, TaskHistory, TaskCount, Nudge, DeletedTask, CLOSED_STATES, exports
+from tasks.pagination import paginate, paginate_timeline
+from tasks.permissions import is_group_member
+from tasks import signals, tagindex
 
 
 workflow = import_module(getattr(settings, "TASKS_WORKFLOW_MODULE", "tasks.workflow"))
 
+TASKS_PER_PAGE = getattr(settings, "TASKS_PER_PAGE", 100)
+TASKS_HISTORY_PER_PAGE = getattr(settings, "TASKS_HISTORY_PER_PAGE", 50)
+
+# dates in the JSON mini list, given back as its since parameter
+SINCE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
 
 def group_and_bridge(request):
     """
@@ -55,6 +65,16 @@ def group_and_bridge(request):
     return group, bridge
 
 
+def cursor_querystring(request):
+    """
+    The current query string without the pagination cursor, for building
+    the next and previous page links.
+    """
+    querydict = request.GET.copy()
+    querydict.pop("cursor", None)
+    return querydict.urlencode()
+
+
 def group_context(group, bridge):
     # @@@ use bridge
     ctx = {
@@ -69,7 +89,7 @@ def tasks(request, template_name="tasks/task_list.html"):
     
     group, bridge = group_and_bridge(request)
     if group:
-        is_member = group.request.user_is_member()
+        is_member = is_group_member(group, request.user)
     else:
         is_member = True
     
@@ -94,15 +114,20 @@ def tasks(request, template_name="tasks/task_list.html"):
     
     task_filter = TaskFilter(filter_data, queryset=tasks)
     
+    page = paginate(task_filter.qs, request.GET.get("cursor"), TASKS_PER_PAGE)
+    
     if group_by == "tag":
-        grouped_tasks = []
-        for tag in Task.tags.all():
-            tasktags = task_filter.qs.filter(tags__name__in=[str(tag)])
-            if tasktags:
-                grouped_tasks.append({ "grouper": tag, "list": tasktags })
+        grouped_tasks = group_by_tag(page.object_list)
     else:
         grouped_tasks = None
     
+    # open task totals for the section headers, the page may only hold a
+    # part of each section
+    if group_by in ["state", "assignee", "tag"]:
+        open_counts = TaskCount.objects.counts_for(group)[group_by]
+    else:
+        open_counts = None
+    
     group_by_querydict = request.GET.copy()
     group_by_querydict.pop("group_by", None)
     group_by_querystring = group_by_querydict.urlencode()
@@ -113,9 +138,12 @@ def tasks(request, template_name="tasks/task_list.html"):
         "gbqs": group_by_querystring,
         "is_member": is_member,
         "task_filter": task_filter,
-        "tasks": task_filter.qs,
+        "tasks": page.queryset,
+        "page": page,
+        "cursor_qs": cursor_querystring(request),
         "querystring": request.GET.urlencode(),
         "grouped_tasks": grouped_tasks,
+        "open_counts": open_counts,
     })
     
     return render_to_response(template_name, RequestContext(request, ctx))
@@ -125,7 +153,7 @@ def add_task(request, secret_id=None, form_class=TaskForm, template_name="tasks/
     
     group, bridge = group_and_bridge(request)
     if group:
-        is_member = group.request.user_is_member()
+        is_member = is_group_member(group, request.user)
     else:
         is_member = True
     
@@ -155,9 +183,10 @@ def add_task(request, secret_id=None, form_class=TaskForm, template_name="tasks/
                 task.group = group
                 if hasattr(workflow, "initial_state"):
                     task.state = workflow.initial_state(task, request.user)
-                task.save()
-                task_form.save_m2m()
-                task.save_history()
+                with transaction.commit_on_success():
+                    task.save()
+                    task_form.save_m2m()
+                    task.save_history()
                 messages.add_message(request, messages.SUCCESS,
                     ugettext("added task '%s'") % task.summary
                 )
@@ -198,7 +227,7 @@ def nudge(request, id):
     
     group, bridge = group_and_bridge(request)
     if group:
-        is_member = group.request.user_is_member()
+        is_member = is_group_member(group, request.user)
     else:
         is_member = True
     
@@ -210,22 +239,14 @@ def nudge(request, id):
     task = get_object_or_404(tasks, id=id)
     task_url = task.get_absolute_url(group)
     
-    nudged = Nudge.objects.filter(task__exact=task, nudger__exact=request.user)
-    if nudged:
+    nudged, count = Nudge.objects.toggle(task, request.user)
+    if not nudged:
         # you've already nudged this task.
-        nudge = nudged[0]
-        nudge.delete()
         messages.add_message(request, messages.SUCCESS,
             ugettext("You've removed your nudge from this task")
         )
         return HttpResponseRedirect(task_url)
     
-    
-    nudge = Nudge(nudger=request.user, task=task)
-    nudge.save()
-    
-    count = Nudge.objects.filter(task__exact=task).count()
-    
     # send the message to the user
     messages.add_message(request, messages.SUCCESS,
         ugettext("%s has been nudged about this task") % task.assignee
@@ -245,7 +266,7 @@ def task(request, id, template_name="tasks/task.html"):
     
     group, bridge = group_and_bridge(request)
     if group:
-        is_member = group.request.user_is_member()
+        is_member = is_group_member(group, request.user)
     else:
         is_member = True
     
@@ -256,19 +277,14 @@ def task(request, id, template_name="tasks/task.html"):
     
     task = get_object_or_404(tasks, id=id)
     
-    if not request.user.is_authenticated():
-        is_member = False
-    else:
-        if group:
-            is_member = group.user_is_member(request.user)
-        else:
-            is_member = True
+    is_member = is_group_member(group, request.user)
     
     if is_member and request.method == "POST":
         form = EditTaskForm(request.user, group, request.POST, instance=task)
         if form.is_valid():
-            task = form.save()
-            task.save_history(change_owner=request.user)
+            with transaction.commit_on_success():
+                task = form.save()
+                task.save_history(change_owner=request.user)
             if task.assignee == request.user:
                 task.denudge()
             if "status" in form.changed_data:
@@ -325,18 +341,21 @@ def task(request, id, template_name="tasks/task.html"):
     nudge["nudgeable"] = False
     
     # get the count of nudges so assignee can see general level of interest.
-    nudge["count"] = Nudge.objects.filter(task__exact=task).count()
+    nudge["count"] = task.nudge_count
+    
+    # get the nudge history, no need to look when nobody nudged
+    if task.nudge_count:
+        nudge["history"] = list(Nudge.objects.filter(task__exact=task).select_related("nudger"))
+    else:
+        nudge["history"] = []
     
     # get the nudge if you are not the assignee otherwise just a None
     if is_member and request.user != task.assignee and task.assignee:
         nudge["nudgeable"] = True
-        try:
-            nudge["nudge"] = Nudge.objects.filter(nudger__exact=request.user, task__exact=task)[0]
-        except IndexError:
-            nudge["nudge"] = None
-    
-    # get the nudge history
-    nudge["history"] = Nudge.objects.filter(task__exact=task)
+        nudge["nudge"] = None
+        for item in nudge["history"]:
+            if item.nudger_id == request.user.id:
+                nudge["nudge"] = item
     
     ctx = group_context(group, bridge)
     ctx.update({
@@ -349,12 +368,27 @@ def task(request, id, template_name="tasks/task.html"):
     return render_to_response(template_name, RequestContext(request, ctx))
 
 
+def filtered_states(task_filter):
+    """
+    The states selected in the form of a TaskFilter, None when it does not
+    filter on state (nothing or everything selected, or invalid).
+    """
+    field = task_filter.form.fields["state"]
+    try:
+        states = field.clean(task_filter.form["state"].data)
+    except forms.ValidationError:
+        return None
+    if not states or len(states) == len(list(field.choices)):
+        return None
+    return states
+
+
 @login_required
 def user_tasks(request, username, template_name="tasks/user_tasks.html"):
     
     group, bridge = group_and_bridge(request)
     if group:
-        is_member = group.request.user_is_member()
+        is_member = is_group_member(group, request.user)
     else:
         is_member = True
     
@@ -363,15 +397,10 @@ def user_tasks(request, username, template_name="tasks/user_tasks.html"):
     else:
         other_user = get_object_or_404(User, username=username)
     
-    assigned_tasks = other_user.assigned_tasks.all()
-    created_tasks = other_user.created_tasks.all()
-    
     if group:
-        assigned_tasks = group.content_objects(assigned_tasks)
-        created_tasks = group.content_objects(created_tasks)
+        tasks = group.content_objects(Task)
     else:
-        assigned_tasks = assigned_tasks.filter(object_id=None)
-        created_tasks = created_tasks.filter(object_id=None)
+        tasks = Task.objects.filter(object_id=None)
     
     # default filtering
     state_keys = dict(workflow.STATE_CHOICES).keys()
@@ -389,22 +418,20 @@ def user_tasks(request, username, template_name="tasks/user_tasks.html"):
     }
     filter_data.update(request.GET)
     
-    assigned_filter = TaskFilter(filter_data, queryset=assigned_tasks, prefix="a")
-    created_filter = TaskFilter(filter_data, queryset=created_tasks, prefix="c")
+    # the filters only provide the forms and the states they select, the
+    # three lists are loaded at once
+    assigned_filter = TaskFilter(filter_data, prefix="a")
+    created_filter = TaskFilter(filter_data, prefix="c")
+    nudged_filter = TaskFilter(filter_data, prefix="n")
     
-    assigned_tasks = assigned_filter.qs
-    created_tasks = created_filter.qs
-    
-    assigned_tasks = assigned_tasks.order_by("state", "-modified") # @@@ filter(project__deleted=False)
-    created_tasks = created_tasks.order_by("state", "-modified") # @@@ filter(project__deleted=False)
-    
-    nudged_tasks = assigned_tasks.extra(
-        tables = ["tasks_nudge"],
-        where = ["tasks_nudge.id = tasks_task.id"],
-    )
-    
-    nudged_filter = TaskFilter(filter_data, queryset=nudged_tasks, prefix="n")
-    nudged_tasks = nudged_filter.qs
+    task_lists = user_task_lists(tasks, other_user, {
+        "assigned": filtered_states(assigned_filter),
+        "created": filtered_states(created_filter),
+        "nudged": filtered_states(nudged_filter),
+    })
+    assigned_tasks = task_lists["assigned"]
+    created_tasks = task_lists["created"]
+    nudged_tasks = task_lists["nudged"]
     
     site_url = "http://" + Site.objects.get_current().domain
     
@@ -440,7 +467,7 @@ def mini_list(request, template_name="tasks/mini_list.html"):
     
     group, bridge = group_and_bridge(request)
     if group:
-        is_member = group.request.user_is_member()
+        is_member = is_group_member(group, request.user)
     else:
         is_member = True
     
@@ -459,11 +486,119 @@ def mini_list(request, template_name="tasks/mini_list.html"):
     return render_to_response(template_name, RequestContext(request, ctx))
 
 
+def mini_list_tasks(request):
+    group, bridge = group_and_bridge(request)
+    
+    assigned_tasks = request.user.assigned_tasks.all()
+    
+    if group:
+        assigned_tasks = group.content_objects(assigned_tasks)
+    else:
+        assigned_tasks = assigned_tasks.filter(object_id=None)
+    
+    return group, assigned_tasks
+
+
+def mini_list_state(request):
+    """
+    The latest modification date and number of the tasks assigned to the
+    current user for each state, made with one aggregate query and kept for
+    the rest of the request.
+    """
+    if not hasattr(request, "_mini_list_state"):
+        group, assigned_tasks = mini_list_tasks(request)
+        states = assigned_tasks.order_by().values("state").annotate(
+            latest = Max("modified"),
+            count = Count("pk"),
+        )
+        request._mini_list_state = dict(
+            (row["state"], (row["latest"], row["count"])) for row in states
+        )
+    return request._mini_list_state
+
+
+def mini_list_etag(request):
+    state = sorted(
+        (key, latest.strftime(SINCE_FORMAT), count)
+        for key, (latest, count) in mini_list_state(request).items()
+    )
+    return md5_constructor("%s|%s|%r" % (
+        request.user.pk, request.GET.get("since", ""), state
+    )).hexdigest()
+
+
+def mini_list_last_modified(request):
+    # closing a task modifies it without taking it out of the assigned tasks
+    # so the date also changes when a task leaves the open ones
+    state = mini_list_state(request)
+    if not state:
+        return None
+    return max(latest for latest, count in state.values())
+
+
+@login_required
+@condition(etag_func=mini_list_etag, last_modified_func=mini_list_last_modified)
+def mini_list_json(request):
+    """
+    The open tasks assigned to the current user for the bookmarklet to poll,
+    answered with 304 Not Modified while they are unchanged. With ``since``
+    (the ``latest`` of a previous answer) only the tasks modified after it
+    are listed, closed ones included so they can be taken off, and the ids
+    of the tasks changed or deleted since that are not assigned to the user
+    are given as ``removed``, a superset of the ones that left the list.
+    """
+    
+    group, assigned_tasks = mini_list_tasks(request)
+    
+    since = request.GET.get("since")
+    removed = []
+    if since:
+        try:
+            since = datetime.datetime.strptime(since, SINCE_FORMAT)
+        except ValueError:
+            return HttpResponseBadRequest("since must look like %s" % SINCE_FORMAT)
+        tasks = assigned_tasks.filter(modified__gt=since)
+        
+        # reassigned to someone else or deleted
+        if group:
+            others = group.content_objects(Task)
+        else:
+            others = Task.objects.filter(object_id=None)
+        others = others.filter(modified__gt=since).exclude(assignee=request.user)
+        removed.extend(others.values_list("pk", flat=True))
+        removed.extend(DeletedTask.objects.filter(deleted__gt=since).values_list("task_id", flat=True))
+    else:
+        tasks = assigned_tasks.exclude(state__in=CLOSED_STATES)
+    
+    tasks = tasks.order_by("state", "-modified")
+    
+    state = mini_list_state(request)
+    latest = mini_list_last_modified(request)
+    data = {
+        "count": sum(count for key, (modified, count) in state.items() if key not in CLOSED_STATES),
+        "latest": latest and latest.strftime(SINCE_FORMAT),
+        "tasks": [{
+            "id": task.pk,
+            "summary": task.summary,
+            "state": task.get_state_display(),
+            "open": task.state not in CLOSED_STATES,
+            "modified": task.modified.strftime(SINCE_FORMAT),
+            "url": task.get_absolute_url(group),
+        } for task in tasks],
+        "removed": removed,
+    }
+    
+    return HttpResponse(
+        json.dumps(data),
+        mimetype="application/json"
+    )
+
+
 def focus(request, field, value, template_name="tasks/focus.html"):
     
     group, bridge = group_and_bridge(request)
     if group:
-        is_member = group.request.user_is_member()
+        is_member = is_group_member(group, request.user)
     else:
         is_member = True
     
@@ -533,6 +668,8 @@ def focus(request, field, value, template_name="tasks/focus.html"):
         # Django will not merge queries that are both not distinct or distinct
         tasks = tasks.distinct() & task_filter.qs
     
+    page = paginate(tasks, request.GET.get("cursor"), TASKS_PER_PAGE)
+    
     group_by_querydict = request.GET.copy()
     group_by_querydict.pop("group_by", None)
     group_by_querystring = group_by_querydict.urlencode()
@@ -540,7 +677,9 @@ def focus(request, field, value, template_name="tasks/focus.html"):
     ctx = group_context(group, bridge)
     ctx.update({
         "task_filter": task_filter,
-        "tasks": tasks,
+        "tasks": page.queryset,
+        "page": page,
+        "cursor_qs": cursor_querystring(request),
         "field": field,
         "value": value,
         "group_by": group_by,
@@ -558,7 +697,7 @@ def tasks_history_list(request, template_name="tasks/tasks_history_list.html"):
     
     group, bridge = group_and_bridge(request)
     if group:
-        is_member = group.request.user_is_member()
+        is_member = is_group_member(group, request.user)
     else:
         is_member = True
     
@@ -566,22 +705,33 @@ def tasks_history_list(request, template_name="tasks/tasks_history_list.html"):
         tasks = group.content_objects(TaskHistory)
     else:
         tasks = TaskHistory.objects.filter(object_id=None)
-    tasks = tasks.order_by("-modified")
+    
+    page = paginate(tasks, request.GET.get("cursor"), TASKS_HISTORY_PER_PAGE)
     
     ctx = group_context(group, bridge)
     ctx.update({
-        "task_history": tasks,
+        "task_history": load_history(page.object_list),
+        "page": page,
+        "cursor_qs": cursor_querystring(request),
         "is_member": is_member,
     })
     
     return render_to_response(template_name, RequestContext(request, ctx))
 
 
+def humanized_history(changes):
+    for change in changes:
+        if isinstance(change, TaskHistory):
+            change.humanized_state = workflow.STATE_CHOICES_DICT.get(change.state, None)
+            change.humanized_resolution = workflow.RESOLUTION_CHOICES_DICT.get(change.resolution, None)
+        yield change
+
+
 def tasks_history(request, id, template_name="tasks/task_history.html"):
     
     group, bridge = group_and_bridge(request)
     if group:
-        is_member = group.request.user_is_member()
+        is_member = is_group_member(group, request.user)
     else:
         is_member = True
     
@@ -591,39 +741,84 @@ def tasks_history(request, id, template_name="tasks/task_history.html"):
         tasks = Task.objects.filter(object_id=None)
     
     task = get_object_or_404(tasks, id=id)
-    task_history = task.history_task.all().order_by("-modified")
-    nudge_history = task.task_nudge.all().order_by("-modified")
+    task_history = task.history_task.select_related("owner", "assignee")
+    nudge_history = task.task_nudge.select_related("nudger")
     
-    result_list = sorted(
-        chain(task_history, nudge_history),
-        key=attrgetter("modified")
-        )
-    result_list.reverse()
+    # a page of the history and nudges merged newest first by the database
+    # and a merge of the two, instead of the whole of both sorted here
+    page = paginate_timeline([task_history, nudge_history],
+        request.GET.get("cursor"), TASKS_HISTORY_PER_PAGE
+    )
+    changes = [change for change in page.object_list if isinstance(change, TaskHistory)]
+    load_assignees(TaskHistory.objects.resolve(changes))
     
-    for change in task_history:
-        change.humanized_state = workflow.STATE_CHOICES_DICT.get(change.state, None)
-        change.humanized_resolution = workflow.RESOLUTION_CHOICES_DICT.get(change.resolution, None)
+    # revisions are numbered from the first one of the task, not per page
+    if changes:
+        number = task.history_task.filter(pk__lt=min(change.pk for change in changes)).count()
+        for change in sorted(changes, key=lambda change: change.pk):
+            number += 1
+            change.revision = number
     
     ctx = group_context(group, bridge)
     ctx.update({
         "task": task,
-        "task_history": result_list,
-        "nudge_history": nudge_history,
+        "task_history": humanized_history(page.object_list),
+        "page": page,
+        "cursor_qs": cursor_querystring(request),
     })
     
     return render_to_response(template_name, RequestContext(request, ctx))
 
 
+def summary(request):
+    """
+    Open task counts of the current group by state, assignee and tag, read
+    from the maintained rollups.
+    """
+    
+    group, bridge = group_and_bridge(request)
+    
+    counts = TaskCount.objects.counts_for(group)
+    
+    usernames = dict(User.objects.filter(
+        pk__in = [int(pk) for pk in counts["assignee"] if pk]
+    ).values_list("pk", "username"))
+    tag_names = dict(Tag.objects.filter(
+        pk__in = [int(pk) for pk in counts["tag"]]
+    ).values_list("pk", "name"))
+    
+    data = {
+        "state": dict(
+            (workflow.STATE_CHOICES_DICT.get(state, state), count)
+            for state, count in counts["state"].items() if count
+        ),
+        "assignee": dict(
+            (usernames.get(int(pk)) if pk else "", count)
+            for pk, count in counts["assignee"].items() if count
+        ),
+        "tag": dict(
+            (tag_names.get(int(pk)), count)
+            for pk, count in counts["tag"].items() if count
+        ),
+    }
+    
+    return HttpResponse(
+        json.dumps(data),
+        mimetype="application/json"
+    )
+
+
 def tags_autocomplete_source(request):
     term = request.GET.get("term", "")
-    tags = Tag.objects.filter(name__istartswith=term).values_list("name", flat=True)
-    tags = [str(t) for t in tags]
+    tags = tagindex.get_index().suggest(term)
     return HttpResponse(
         json.dumps(tags),
         mimetype="application/json"
     )
 
 
-def export_state_transitions(request):
-    export = workflow.export_state_transitions()
-    return HttpResponse(export, mimetype="text/csv")
+@condition(etag_func=lambda request, format="csv": exports[format].etag)
+def export_state_transitions(request, format="csv"):
+    # rendered once when the workflow was loaded
+    export = exports[format]
+    return HttpResponse(export.content, mimetype=export.mimetype)
@@ -1,25 +1,273 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.encoding import force_unicode
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+
 from piston.handler import BaseHandler
+from piston.utils import rc
+
+from taggit.models import TaggedItem
+
+from tasks.bulk import create_tasks, validate_tasks
+from tasks.models import DeletedTask, Task, TaskHistory
+from tasks.pagination import paginate
+
+
+API_PAGE_SIZE = getattr(settings, "TASKS_API_PAGE_SIZE", 50)
+API_MAX_PAGE_SIZE = getattr(settings, "TASKS_API_MAX_PAGE_SIZE", 500)
+API_MAX_BATCH_SIZE = getattr(settings, "TASKS_API_MAX_BATCH_SIZE", 50000)
+API_SYNC_PAGE_SIZE = getattr(settings, "TASKS_API_SYNC_PAGE_SIZE", 500)
+# seconds a client finding no change is told to wait before asking again
+API_SYNC_RETRY_AFTER = getattr(settings, "TASKS_API_SYNC_RETRY_AFTER", 5)
+# ids are taken when rows are inserted but seen when they are committed, so
+# changes are only synced once older than any transaction writing them lasts
+API_SYNC_SETTLE = getattr(settings, "TASKS_API_SYNC_SETTLE", 5)
+
+API_EXCLUDE = ('content_type', 'creator', 'detail_html', 'detail_html_key')
+# the fields lists can be projected on, by name as values() takes them
+API_FIELDS = [f.name for f in Task._meta.fields if f.name not in API_EXCLUDE]
+
+SINCE_FORMATS = ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
+
+
+def filter_tasks(tasks, params):
+    """
+    Narrows ``tasks`` down with the state (several can be given), assignee
+    (a username or "unassigned") and modified_since parameters of a request.
+    Raises ValueError when one of them is invalid.
+    """
+    states = params.getlist("state")
+    if states:
+        tasks = tasks.filter(state__in=states)
+    
+    assignee = params.get("assignee")
+    if assignee == "unassigned":
+        tasks = tasks.filter(assignee=None)
+    elif assignee:
+        try:
+            tasks = tasks.filter(assignee=User.objects.get(username=assignee))
+        except User.DoesNotExist:
+            raise ValueError("Unknown assignee '%s'." % assignee)
+    
+    since = params.get("modified_since")
+    if since:
+        for format in SINCE_FORMATS:
+            try:
+                since = datetime.datetime.strptime(since, format)
+                break
+            except ValueError:
+                pass
+        else:
+            raise ValueError("Invalid modified_since '%s'." % since)
+        tasks = tasks.filter(modified__gt=since)
+    
+    return tasks
+
+
+def projected_fields(params):
+    """
+    The fields listed by the fields parameter of a request, or None when
+    there is none. Raises ValueError for fields the API does not expose.
+    """
+    fields = [field for field in params.get("fields", "").split(",") if field]
+    if not fields:
+        return None
+    unknown = [field for field in fields if field not in API_FIELDS]
+    if unknown:
+        raise ValueError("Unknown fields: %s." % ", ".join(unknown))
+    return fields
+
+
+def parse_sync_cursor(cursor):
+    """
+    The ids of the last history revision and the last tombstone a client
+    synced, from a cursor such as "1234.56". No cursor means nothing was.
+    """
+    if not cursor:
+        return 0, 0
+    try:
+        history_id, deleted_id = [int(part) for part in cursor.split(".")]
+    except ValueError:
+        raise ValueError("Invalid cursor '%s'." % cursor)
+    return history_id, deleted_id
+
+
+def settled(rows, before):
+    """
+    The (id, task id) pairs of ``rows``, (id, task id, date) triples in id
+    order, up to the first one dated ``before`` or later: rows with lower ids
+    may still be committed until then, and a cursor past them would skip them.
+    """
+    pairs = []
+    for pk, task_id, date in rows:
+        if date >= before:
+            break
+        pairs.append((pk, task_id))
+    return pairs
+
+
+def changes_since(history_id, deleted_id, limit=API_SYNC_PAGE_SIZE, settle=API_SYNC_SETTLE):
+    """
+    Returns the (history id, task id) pairs of the revisions and the
+    (tombstone id, task id) pairs of the deletions after the given ids,
+    oldest first and at most ``limit`` of each, from their primary keys.
+    Only the changes made over ``settle`` seconds ago are returned.
+    """
+    before = datetime.datetime.now() - datetime.timedelta(seconds=settle)
+    revisions = TaskHistory.objects.filter(pk__gt=history_id).order_by("pk")
+    tombstones = DeletedTask.objects.filter(pk__gt=deleted_id).order_by("pk")
+    return (
+        settled(revisions.values_list("pk", "task", "modified")[:limit], before),
+        settled(tombstones.values_list("pk", "task_id", "deleted")[:limit], before),
+    )
 
-from tasks.models import Task
 
 class TasksHandler(BaseHandler):
     model = Task
-    exclude = ('content_type', 'creator')
+    exclude = API_EXCLUDE
+    
+    def validators(self, request, task_id=None):
+        """
+        The last modification date and the values telling whether what read
+        answers with changed, without loading any task: the id, date and tag
+        ids of a task, or the latest date and the number of the tasks a list
+        filters. Returns None when read would answer with an error.
+        
+        Tagging a task does not change its date, so a task has no last
+        modification date to answer If-Modified-Since with, only its ETag.
+        """
+        if task_id:
+            modified = Task.objects.filter(pk=task_id).values_list("modified", flat=True)[:1]
+            if not modified:
+                return None
+            tag_ids = TaggedItem.objects.filter(
+                content_type = ContentType.objects.get_for_model(Task),
+                object_id = task_id,
+            ).order_by("tag").values_list("tag", flat=True)
+            return None, ["task", task_id, modified[0].isoformat()] + [str(tag_id) for tag_id in tag_ids]
+        
+        try:
+            tasks = filter_tasks(Task.objects.all(), request.GET)
+        except ValueError:
+            return None
+        latest = tasks.order_by().aggregate(modified=Max("modified"), count=Count("pk"))
+        return latest["modified"], [
+            "tasks",
+            latest["modified"] and latest["modified"].isoformat() or "",
+            str(latest["count"]),
+        ]
     
     def read(self, request, task_id=None):
         if task_id:
             task = Task.objects.get(pk=task_id)
             return task
-        else:
-            return Task.objects.all()
+        
+        try:
+            tasks = filter_tasks(Task.objects.all(), request.GET)
+            fields = projected_fields(request.GET) or API_FIELDS
+            limit = int(request.GET.get("limit", API_PAGE_SIZE))
+        except ValueError, e:
+            response = rc.BAD_REQUEST
+            response.write(": %s" % e)
+            return response
+        limit = max(1, min(limit, API_MAX_PAGE_SIZE))
+        
+        page = paginate(tasks, request.GET.get("cursor"), limit)
+        return {
+            "tasks": page.object_list.values(*fields),
+            "next": page.next_cursor,
+            "previous": page.previous_cursor,
+        }
     
-    def create(self, request):
+    def create(self, request, task_id=None):
+        if request.content_type and isinstance(request.data, list):
+            return self.create_many(request, request.data)
+        
         task = Task()
         
         task.summary = request.POST.get('summary')
         task.detail = request.POST.get('detail')
         task.creator = request.user
         
-        task.save()
+        with transaction.commit_on_success():
+            task.save()
+            task.save_history()
+        
+        return task
+    
+    def create_many(self, request, items):
+        """
+        Creates the tasks of a JSON array at once, or none of them when any
+        is invalid. Answers with the id or the errors of each item.
+        """
+        if len(items) > API_MAX_BATCH_SIZE:
+            response = rc.BAD_REQUEST
+            response.write(": at most %s tasks can be created at once." % API_MAX_BATCH_SIZE)
+            return response
+        
+        tasks, errors = validate_tasks(items, request.user)
+        if [e for e in errors if e]:
+            result, status = [], 400
+            for item_errors in errors:
+                if item_errors:
+                    item_errors = dict(
+                        (field, [force_unicode(message) for message in messages])
+                        for field, messages in item_errors.items()
+                    )
+                result.append({"errors": item_errors})
+        else:
+            create_tasks(tasks, request.user)
+            result, status = [{"id": task.pk} for task, tags in tasks], 201
+        return HttpResponse(json.dumps(result), mimetype="application/json", status=status)
+
+
+class ChangesHandler(BaseHandler):
+    """
+    Changes of the tasks since a cursor: the tasks changed, each of them
+    once and as it is now, and the ids of the tasks deleted, with the cursor
+    to ask from next. Reads never block: when nothing changed, the answer
+    has a ``retry_after`` number of seconds to wait before asking again.
+    """
+    allowed_methods = ("GET",)
+    
+    def read(self, request):
+        try:
+            history_id, deleted_id = parse_sync_cursor(request.GET.get("cursor"))
+            fields = projected_fields(request.GET) or API_FIELDS
+            limit = int(request.GET.get("limit", API_SYNC_PAGE_SIZE))
+        except ValueError, e:
+            response = rc.BAD_REQUEST
+            response.write(": %s" % e)
+            return response
+        limit = max(1, min(limit, API_MAX_PAGE_SIZE))
+        
+        revisions, tombstones = changes_since(history_id, deleted_id, limit)
+        if not (revisions or tombstones):
+            return {
+                "tasks": [],
+                "deleted": [],
+                "cursor": "%s.%s" % (history_id, deleted_id),
+                "more": False,
+                "retry_after": API_SYNC_RETRY_AFTER,
+            }
         
-        return task
\ No newline at end of file
+        task_ids = set(task_id for pk, task_id in revisions)
+        if "id" not in fields:
+            fields = ["id"] + list(fields)
+        if revisions:
+            history_id = revisions[-1][0]
+        if tombstones:
+            deleted_id = tombstones[-1][0]
+        return {
+            "tasks": task_ids and Task.objects.filter(pk__in=task_ids).order_by("pk").values(*fields) or [],
+            "deleted": [task_id for pk, task_id in tombstones],
+            "cursor": "%s.%s" % (history_id, deleted_id),
+            "more": len(revisions) == limit or len(tombstones) == limit,
+        }
@@ -0,0 +1,83 @@
+"""
+Conditional reads of the tasks API.
+
+Handlers tell what a read would answer with through a validators method,
+from queries that load no object. Requests whose If-None-Match or
+If-Modified-Since headers match are answered with a 304 straight away, and
+the serialized bodies are kept in the cache set with TASKS_API_CACHE under
+a key made of the same validators.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.hashcompat import md5_constructor
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.vary import vary_on_headers
+
+from piston.resource import CHALLENGE, Resource
+
+
+TASKS_API_CACHE = getattr(settings, "TASKS_API_CACHE", "default")
+TASKS_API_CACHE_TIMEOUT = getattr(settings, "TASKS_API_CACHE_TIMEOUT", 60 * 60)
+
+cache = get_cache(TASKS_API_CACHE)
+
+
+class ConditionalResource(Resource):
+    """
+    Resource answering the reads of handlers with a validators method
+    conditionally, with weak ETags since a same state of the tasks can be
+    serialized in several formats.
+    """
+    
+    @vary_on_headers("Authorization")
+    def __call__(self, request, *args, **kwargs):
+        if request.method != "GET" or not hasattr(self.handler, "validators"):
+            return super(ConditionalResource, self).__call__(request, *args, **kwargs)
+        
+        actor, anonymous = self.authenticate(request, "GET")
+        if anonymous is CHALLENGE:
+            return actor()
+        
+        validators = actor.validators(request, *args, **kwargs)
+        if validators is None:
+            return super(ConditionalResource, self).__call__(request, *args, **kwargs)
+        last_modified, parts = validators
+        
+        # the representation depends on the format, fields, page and filters
+        etag = md5_constructor(":".join(parts + [
+            self.determine_emitter(request, *args, **kwargs),
+            request.path,
+            request.META.get("QUERY_STRING", ""),
+        ])).hexdigest()
+        if last_modified is not None:
+            last_modified = int(time.mktime(last_modified.timetuple()))
+        
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if_modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+        if if_none_match:
+            not_modified = etag in parse_etags(if_none_match) or "*" in parse_etags(if_none_match)
+        else:
+            not_modified = bool(last_modified and if_modified_since and last_modified <= if_modified_since)
+        
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            key = "tasks_api:response:%s" % etag
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = super(ConditionalResource, self).__call__(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                if not getattr(response, "streaming", False):
+                    cache.set(key, (response.content, response["Content-Type"]), TASKS_API_CACHE_TIMEOUT)
+        
+        response["ETag"] = 'W/"%s"' % etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
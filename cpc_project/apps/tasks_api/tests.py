@@ -0,0 +1,256 @@
+import base64
+import datetime
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils.hashcompat import md5_constructor
+
+from django.contrib.auth.models import User
+
+from tasks.models import DeletedTask, Task, TaskHistory
+from tasks_api.handlers import API_SYNC_RETRY_AFTER, API_SYNC_SETTLE, ChangesHandler, TasksHandler, parse_sync_cursor
+from tasks_api.urls import tasks_resource
+from tasks_api.views import ndjson_lines
+
+
+class TestSyncCursor(TestCase):
+    
+    def test_no_cursor(self):
+        self.assertEquals(parse_sync_cursor(None), (0, 0))
+        self.assertEquals(parse_sync_cursor(""), (0, 0))
+    
+    def test_cursor(self):
+        self.assertEquals(parse_sync_cursor("1234.56"), (1234, 56))
+    
+    def test_invalid_cursor(self):
+        for cursor in ["1234", "1234.56.7", "a.b", "."]:
+            self.assertRaises(ValueError, parse_sync_cursor, cursor)
+
+
+class TestChangesHandler(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.tasks = list(Task.objects.order_by("pk"))
+        for task in self.tasks:
+            task.save_history()
+        self.settle()
+    
+    def tearDown(self):
+        pass
+    
+    def settle(self):
+        # changes are synced once older than the settle margin
+        past = datetime.datetime.now() - datetime.timedelta(seconds=API_SYNC_SETTLE + 1)
+        TaskHistory.objects.update(modified=past)
+        DeletedTask.objects.update(deleted=past)
+    
+    def read(self, **params):
+        request = RequestFactory().get("/tasks/changes", params)
+        request.user = self.user_admin
+        return ChangesHandler().read(request)
+    
+    def test_changes(self):
+        changes = self.read()
+        self.assertEquals([task["id"] for task in changes["tasks"]], [task.pk for task in self.tasks])
+        self.assertEquals(changes["deleted"], [])
+        self.assertEquals(changes["more"], False)
+        
+        self.assertFalse("retry_after" in changes)
+        
+        # nothing changed since, the client is told when to ask again
+        cursor = changes["cursor"]
+        changes = self.read(cursor=cursor)
+        self.assertEquals(list(changes["tasks"]), [])
+        self.assertEquals(changes["deleted"], [])
+        self.assertEquals(changes["cursor"], cursor)
+        self.assertEquals(changes["retry_after"], API_SYNC_RETRY_AFTER)
+    
+    def test_unsettled_changes_wait(self):
+        cursor = self.read()["cursor"]
+        Task.objects.filter(pk=self.tasks[0].pk).update(summary="changed")
+        Task.objects.get(pk=self.tasks[0].pk).save_history()
+        
+        # a revision inserted before it may still be committed
+        changes = self.read(cursor=cursor)
+        self.assertEquals(list(changes["tasks"]), [])
+        self.assertEquals(changes["cursor"], cursor)
+        
+        self.settle()
+        changes = self.read(cursor=cursor)
+        self.assertEquals([t["summary"] for t in changes["tasks"]], ["changed"])
+        self.assertNotEquals(changes["cursor"], cursor)
+    
+    def test_deleted(self):
+        cursor = self.read()["cursor"]
+        task_id = self.tasks[0].pk
+        self.tasks[0].delete()
+        self.settle()
+        
+        changes = self.read(cursor=cursor)
+        self.assertEquals(list(changes["tasks"]), [])
+        self.assertEquals(changes["deleted"], [task_id])
+    
+    def test_pages(self):
+        changes = self.read(limit=1, fields="summary")
+        self.assertEquals(list(changes["tasks"]), [{"id": self.tasks[0].pk, "summary": self.tasks[0].summary}])
+        self.assertEquals(changes["more"], True)
+        
+        changes = self.read(limit=1, cursor=changes["cursor"])
+        self.assertEquals([task["id"] for task in changes["tasks"]], [self.tasks[1].pk])
+    
+    def test_invalid_cursor(self):
+        self.assertEquals(self.read(cursor="nope").status_code, 400)
+
+
+class TestTasksHandler(TestCase):
+    fixtures = ["test_tasks.json"]
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        for i in range(3):
+            Task.objects.create(summary="listed %s" % i, creator=self.user_admin)
+        self.ids = list(Task.objects.order_by("-modified", "-pk").values_list("pk", flat=True))
+    
+    def tearDown(self):
+        pass
+    
+    def read(self, **params):
+        request = RequestFactory().get("/tasks/", params)
+        request.user = self.user_admin
+        return TasksHandler().read(request)
+    
+    def test_pages(self):
+        page = self.read(limit=2)
+        self.assertEquals(sorted(page.keys()), ["next", "previous", "tasks"])
+        self.assertEquals([task["id"] for task in page["tasks"]], self.ids[:2])
+        self.assertEquals(page["previous"], None)
+        
+        page = self.read(limit=2, cursor=page["next"])
+        self.assertEquals([task["id"] for task in page["tasks"]], self.ids[2:4])
+        
+        page = self.read(limit=2, cursor=page["previous"])
+        self.assertEquals([task["id"] for task in page["tasks"]], self.ids[:2])
+        self.assertEquals(page["previous"], None)
+    
+    def test_fields(self):
+        page = self.read(limit=1, fields="summary,state")
+        task = Task.objects.get(pk=self.ids[0])
+        self.assertEquals(list(page["tasks"]), [{"summary": task.summary, "state": task.state}])
+    
+    def test_bad_filters(self):
+        for params in [{"assignee": "nobody"}, {"modified_since": "yesterday"}, {"fields": "detail_html"}, {"limit": "all"}]:
+            self.assertEquals(self.read(**params).status_code, 400)
+
+
+class TestStreamTasks(TestCase):
+    fixtures = ["test_tasks.json"]
+    urls = "tasks_api.urls"
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.auth = "Basic %s" % base64.b64encode("admin:test")
+    
+    def tearDown(self):
+        pass
+    
+    def stream(self, **params):
+        return self.client.get("/tasks/stream", params, HTTP_AUTHORIZATION=self.auth)
+    
+    def test_stream(self):
+        response = self.stream(fields="id,summary")
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response["Content-Type"], "application/x-ndjson")
+        self.assertEquals(
+            [json.loads(line) for line in response.content.splitlines()],
+            [{"id": pk, "summary": summary} for pk, summary in Task.objects.order_by("pk").values_list("pk", "summary")],
+        )
+    
+    def test_chunks(self):
+        tasks = Task.objects.all()
+        lines = list(ndjson_lines(tasks, ["summary"], chunk_size=2))
+        self.assertEquals(
+            [json.loads(line)["summary"] for line in lines],
+            list(tasks.order_by("pk").values_list("summary", flat=True)),
+        )
+    
+    def test_filters(self):
+        self.assertEquals(self.stream(assignee="nobody").status_code, 400)
+        resolved = Task.objects.create(summary="resolved", creator=self.user_admin, state="2")
+        response = self.stream(state="2", fields="id,state")
+        self.assertEquals(
+            [json.loads(line) for line in response.content.splitlines()],
+            [{"id": resolved.pk, "state": "2"}],
+        )
+    
+    def test_authentication(self):
+        self.assertEquals(self.client.get("/tasks/stream").status_code, 401)
+
+
+class TestConditionalResource(TestCase):
+    fixtures = ["test_tasks.json"]
+    urls = "tasks_api.urls"
+    
+    def setUp(self):
+        self.user_admin = User.objects.get(username__exact="admin")
+        self.task = Task.objects.create(summary="conditional", creator=self.user_admin)
+        self.auth = "Basic %s" % base64.b64encode("admin:test")
+    
+    def tearDown(self):
+        pass
+    
+    def get(self, path, **headers):
+        return self.client.get(path, {"format": "json"}, HTTP_AUTHORIZATION=self.auth, **headers)
+    
+    def test_if_none_match(self):
+        response = self.get("/tasks/")
+        self.assertEquals(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertEquals(self.get("/tasks/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        
+        self.task.summary = "changed"
+        self.task.save()
+        response = self.get("/tasks/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue("changed" in response.content)
+    
+    def test_if_modified_since(self):
+        last_modified = self.get("/tasks/")["Last-Modified"]
+        self.assertEquals(self.get("/tasks/", HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        
+        Task.objects.filter(pk=self.task.pk).update(modified=datetime.datetime.now() + datetime.timedelta(days=1))
+        self.assertEquals(self.get("/tasks/", HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+    
+    def test_cached_body(self):
+        content = self.get("/tasks/").content
+        
+        # the same state is answered from the cache without reading the tasks
+        def read(*args, **kwargs):
+            raise AssertionError("read again")
+        tasks_resource.handler.read = read
+        try:
+            response = self.get("/tasks/")
+        finally:
+            del tasks_resource.handler.read
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, content)
+    
+    def test_task_tags(self):
+        request = RequestFactory().get("/tasks/%s" % self.task.pk)
+        last_modified, parts = TasksHandler().validators(request, str(self.task.pk))
+        # tagging does not bump the date of the task, it has no Last-Modified
+        self.assertEquals(last_modified, None)
+        
+        self.task.tags.add("conditional")
+        self.assertNotEquals(TasksHandler().validators(request, str(self.task.pk))[1], parts)
+    
+    def test_task_not_modified(self):
+        self.task.tags.add("conditional")
+        path = "/tasks/%s" % self.task.pk
+        request = RequestFactory().get(path, {"format": "json"})
+        etag = 'W/"%s"' % md5_constructor(":".join(
+            TasksHandler().validators(request, str(self.task.pk))[1] + ["json", path, "format=json"]
+        )).hexdigest()
+        self.assertEquals(self.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
@@ -1,14 +1,16 @@
 from django.conf.urls.defaults import *
 
 from piston.resource import Resource
-from piston.authentication import HttpBasicAuthentication
 
-from tasks_api.handlers import TasksHandler
+from tasks_api.handlers import ChangesHandler, TasksHandler
+from tasks_api.resources import ConditionalResource
+from tasks_api.views import auth
 
-auth = HttpBasicAuthentication(realm="Pinax realm")
-
-tasks_resource = Resource(TasksHandler, authentication=auth)
+tasks_resource = ConditionalResource(TasksHandler, authentication=auth)
+changes_resource = Resource(ChangesHandler, authentication=auth)
 
 urlpatterns = patterns('',
     url(r'^tasks/(?P<task_id>\d*)$', tasks_resource),
+    url(r'^tasks/stream$', 'tasks_api.views.stream_tasks'),
+    url(r'^tasks/changes$', changes_resource),
 )
\ No newline at end of file
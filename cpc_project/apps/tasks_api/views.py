@@ -0,0 +1,50 @@
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DateTimeAwareJSONEncoder
+from django.http import HttpResponse, HttpResponseBadRequest
+
+from piston.authentication import HttpBasicAuthentication
+
+from tasks.models import Task
+from tasks_api.handlers import API_FIELDS, filter_tasks, projected_fields
+
+
+API_STREAM_CHUNK_SIZE = getattr(settings, "TASKS_API_STREAM_CHUNK_SIZE", 500)
+
+auth = HttpBasicAuthentication(realm="Pinax realm")
+
+
+def ndjson_lines(tasks, fields, chunk_size=API_STREAM_CHUNK_SIZE):
+    """
+    Yields the ``fields`` of ``tasks`` as lines of JSON, fetching them by
+    chunks of ``chunk_size`` rows in id order so only one chunk is held in
+    memory at a time.
+    """
+    columns = list(fields)
+    if "id" not in columns:
+        columns.append("id")
+    last = 0
+    while True:
+        chunk = list(tasks.filter(pk__gt=last).order_by("pk").values(*columns)[:chunk_size])
+        for row in chunk:
+            yield json.dumps(dict((field, row[field]) for field in fields), cls=DateTimeAwareJSONEncoder) + "\n"
+        if len(chunk) < chunk_size:
+            break
+        last = chunk[-1]["id"]
+
+
+def stream_tasks(request):
+    """
+    All the tasks matching the filters of the list API as newline delimited
+    JSON, streamed. Piston buffers what its handlers return, this view is
+    served beside it with the same authentication.
+    """
+    if not auth.is_authenticated(request):
+        return auth.challenge()
+    try:
+        tasks = filter_tasks(Task.objects.all(), request.GET)
+        fields = projected_fields(request.GET) or API_FIELDS
+    except ValueError, e:
+        return HttpResponseBadRequest(str(e))
+    return HttpResponse(ndjson_lines(tasks, fields), mimetype="application/x-ndjson")
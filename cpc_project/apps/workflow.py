@@ -5,7 +5,10 @@ We break out workflow elements to enable us to more easily refactor in the
 future.
 """
 
-from django.contrib.auth.models import Group
+import sys
+
+from tasks import exports
+from tasks.permissions import group_names
 
 
 TASK_MANAGER = "coredev"
@@ -39,10 +42,13 @@ def is_task_manager(task, user):
         return False
     if user.is_superuser:
         return True
-    if Group.objects.filter(name__exact=TASK_MANAGER).filter(user=user):
+    if TASK_MANAGER in group_names(user):
         return True
     return False
 
+# only depends on the user, evaluated once per user for a batch of tasks
+is_task_manager.user_only = True
+
 
 def no_assignee(task, user):
     if not task.assignee:
@@ -52,7 +58,13 @@ def no_assignee(task, user):
 
 def OR(*l):
     # lets you run multiple permissions against a single state transition
-    return lambda *args: any(f(*args) for f in l)
+    def either(*args):
+        return any(f(*args) for f in l)
+    # named after its parts (is_assignee_or_is_task_manager) so exports of
+    # the transitions stay readable, the parts are kept for tasks.transitions
+    either.__name__ = "_or_".join(f.__name__ for f in l)
+    either.predicates = l
+    return either
 
 
 STATE_TRANSITIONS = [
@@ -142,23 +154,12 @@ STATE_ID_LIST = [x[0] for x in STATE_CHOICES]
 
 
 def export_state_transitions(format="csv"):
-    # ugly cowboy code that really needs refactoring
-    rows = []
-    for row in STATE_TRANSITIONS:
-        record = ""
-        current_state = STATE_CHOICES_DICT[str(row[0])]
-        new_state = STATE_CHOICES_DICT[str(row[1])]
-        permission = str(row[2]).split()[1]
-        transition_name = row[3]
-        record = """ "%s","%s","%s","%s" """ % (current_state, new_state, permission, transition_name)
-        rows.append(record.strip())
-    
-    # ick turn this into a string.
-    # TODO: to this right!
-    text = ""
-    for row in rows:
-        text += row + "\n"
-    return text
+    """
+    Returns the Export of the state transitions of this workflow in
+    ``format``, the one the export view serves when this is the configured
+    workflow.
+    """
+    return exports.compile_exports(sys.modules[__name__])[format]
 
 
 # lame hack to speed up shell scripts
@@ -0,0 +1,3 @@
+### Indexes backing keyset pagination on (modified, id)
+CREATE INDEX "tasks_task_modified_id" ON "tasks_task" ("modified", "id");
+CREATE INDEX "tasks_taskhistory_modified_id" ON "tasks_taskhistory" ("modified", "id");
@@ -0,0 +1,28 @@
+### New Model: tasks.TaskCount
+CREATE TABLE "tasks_taskcount" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "content_type_id" integer REFERENCES "django_content_type" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "object_id" integer CHECK ("object_id" >= 0),
+    "dimension" varchar(10) NOT NULL,
+    "value" varchar(100) NOT NULL,
+    "count" integer NOT NULL,
+    UNIQUE ("content_type_id", "object_id", "dimension", "value")
+)
+;
+CREATE INDEX "tasks_taskcount_content_type_id" ON "tasks_taskcount" ("content_type_id");
+### Initial open task counts (same as ./manage.py rebuild_task_counts)
+INSERT INTO "tasks_taskcount" ("content_type_id", "object_id", "dimension", "value", "count")
+    SELECT "content_type_id", "object_id", 'state', "state", COUNT(*)
+    FROM "tasks_task" WHERE "state" NOT IN ('2', '3')
+    GROUP BY "content_type_id", "object_id", "state";
+INSERT INTO "tasks_taskcount" ("content_type_id", "object_id", "dimension", "value", "count")
+    SELECT "content_type_id", "object_id", 'assignee', COALESCE(CAST("assignee_id" AS varchar), ''), COUNT(*)
+    FROM "tasks_task" WHERE "state" NOT IN ('2', '3')
+    GROUP BY "content_type_id", "object_id", "assignee_id";
+INSERT INTO "tasks_taskcount" ("content_type_id", "object_id", "dimension", "value", "count")
+    SELECT t."content_type_id", t."object_id", 'tag', CAST(i."tag_id" AS varchar), COUNT(*)
+    FROM "tasks_task" t
+    INNER JOIN "taggit_taggeditem" i ON i."object_id" = t."id"
+    WHERE i."content_type_id" = (SELECT "id" FROM "django_content_type" WHERE "app_label" = 'tasks' AND "model" = 'task')
+    AND t."state" NOT IN ('2', '3')
+    GROUP BY t."content_type_id", t."object_id", i."tag_id";
@@ -0,0 +1,4 @@
+### New Fields: tasks.Task.detail_html, tasks.Task.detail_html_key
+ALTER TABLE "tasks_task" ADD COLUMN "detail_html" text NOT NULL DEFAULT '';
+ALTER TABLE "tasks_task" ADD COLUMN "detail_html_key" varchar(32) NOT NULL DEFAULT '';
+### Existing tasks render on the fly until ./manage.py render_task_details has run
@@ -0,0 +1,5 @@
+### New Fields: tasks.TaskHistory.tag_names, tasks.TaskHistory.keyframe, tasks.TaskHistory.changed_fields
+ALTER TABLE "tasks_taskhistory" ADD COLUMN "tag_names" text NOT NULL DEFAULT '';
+ALTER TABLE "tasks_taskhistory" ADD COLUMN "keyframe" boolean NOT NULL DEFAULT true;
+ALTER TABLE "tasks_taskhistory" ADD COLUMN "changed_fields" varchar(100) NOT NULL DEFAULT '';
+CREATE INDEX "tasks_taskhistory_task_id_id" ON "tasks_taskhistory" ("task_id", "id");
@@ -0,0 +1,5 @@
+# existing history rows are full snapshots (keyframes), convert them to
+# keyframes and deltas, this prints the space saved
+from django.core.management import call_command
+
+call_command("compact_task_history")
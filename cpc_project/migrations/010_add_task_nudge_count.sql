@@ -0,0 +1,11 @@
+### New Field: tasks.Task.nudge_count
+ALTER TABLE "tasks_task" ADD COLUMN "nudge_count" integer NOT NULL DEFAULT 0 CHECK ("nudge_count" >= 0);
+### One nudge per user and task
+DELETE FROM "tasks_nudge" WHERE "id" IN (
+    SELECT "a"."id" FROM "tasks_nudge" "a", "tasks_nudge" "b"
+    WHERE "a"."task_id" = "b"."task_id" AND "a"."nudger_id" = "b"."nudger_id" AND "a"."id" > "b"."id"
+);
+ALTER TABLE "tasks_nudge" ADD CONSTRAINT "tasks_nudge_task_id_nudger_id_key" UNIQUE ("task_id", "nudger_id");
+UPDATE "tasks_task" SET "nudge_count" = (
+    SELECT COUNT(*) FROM "tasks_nudge" WHERE "tasks_nudge"."task_id" = "tasks_task"."id"
+);
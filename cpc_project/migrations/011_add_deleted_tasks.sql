@@ -0,0 +1,7 @@
+### New Model: tasks.DeletedTask
+CREATE TABLE "tasks_deletedtask" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "task_id" integer CHECK ("task_id" >= 0) NOT NULL,
+    "deleted" timestamp with time zone NOT NULL
+)
+;
@@ -0,0 +1,17 @@
+### New Model: signals.NotificationJob
+CREATE TABLE "signals_notificationjob" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "label" varchar(40) NOT NULL,
+    "task_id" integer NOT NULL REFERENCES "tasks_task" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "actor_id" integer NOT NULL REFERENCES "auth_user" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "content_type_id" integer REFERENCES "django_content_type" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "object_id" integer CHECK ("object_id" >= 0),
+    "extra" text NOT NULL,
+    "created" timestamp with time zone NOT NULL,
+    "claimed" timestamp with time zone,
+    "last_recipient" integer CHECK ("last_recipient" >= 0) NOT NULL
+)
+;
+CREATE INDEX "signals_notificationjob_task_id" ON "signals_notificationjob" ("task_id");
+CREATE INDEX "signals_notificationjob_actor_id" ON "signals_notificationjob" ("actor_id");
+CREATE INDEX "signals_notificationjob_content_type_id" ON "signals_notificationjob" ("content_type_id");
@@ -207,6 +207,13 @@ DEBUG_TOOLBAR_CONFIG = {
 
 MARKUP_DEFAULT_FILTER = "creole"
 
+# caches of the tasks app, each an alias of CACHES or a backend URI such as
+# "locmem://" or "file:///var/tmp/cpc_task_rows". The tag index version must
+# be in a cache shared by every process for tag changes to reach them all.
+TASKS_ROW_CACHE = "default"
+TASKS_TAG_INDEX_CACHE = "default"
+TASKS_API_CACHE = "default"
+
 ANALYTICS_SETTINGS = {
     "google": {
         "2": "UA-2401894-13",